@@ -0,0 +1,532 @@
+"""
+Benchmark reproducible de todos los endpoints de la API.
+
+Siembra una base de datos (SQLite temporal por defecto) con las clases de
+models.py, recorre cada ruta de src/main.py con el test client de Flask y
+guarda p50/p95/p99, throughput, sentencias SQL y memoria pico por escenario
+en un JSON. Con --baseline compara contra un resultado anterior y termina con
+codigo 1 si algun escenario empeora mas que --threshold.
+
+    pipenv run bench --products 50000 --output resultados.json
+    pipenv run bench --baseline resultados.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#diferencia minima en segundos para considerar una regresion de latencia (ruido)
+TOLERANCIA_ABSOLUTA = 0.0005
+
+
+class Escenario:
+    """
+        un endpoint a medir. url y body reciben el numero de iteracion;
+        preparar(n) se ejecuta antes de medir y puede crear los registros que
+        consumen los escenarios destructivos (ej: DELETE).
+    """
+
+    def __init__(self, nombre, metodo, url, body=None, preparar=None, content_type=None, headers=None):
+        self.nombre = nombre
+        self.metodo = metodo
+        self.url = url
+        self.body = body
+        self.preparar = preparar
+        self.content_type = content_type
+        self.headers = headers
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los endpoints de la API.")
+    parser.add_argument("--database", help="URL de la base de datos (por defecto SQLite temporal)")
+    parser.add_argument("--reset", action="store_true",
+                        help="borra y vuelve a crear las tablas de --database antes de sembrar")
+    parser.add_argument("--categories", type=int, default=50,
+                        help="categorias sembradas, mas que las DEPARTAMENTOS raices del arbol")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200, help="requests medidos por escenario")
+    parser.add_argument("--warmup", type=int, default=10, help="requests sin medir por escenario")
+    parser.add_argument("--memory-iterations", type=int, default=5,
+                        help="requests medidos con tracemalloc para la memoria pico")
+    parser.add_argument("--cache", action="store_true", help="medir con el cache de respuestas activo")
+    parser.add_argument("--startup-runs", type=int, default=10,
+                        help="procesos nuevos para medir el arranque de la app (0 para no medirlo)")
+    parser.add_argument("--only", help="solo los escenarios cuyo nombre contenga este texto")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de un resultado anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="empeoramiento relativo permitido del p95 contra --baseline")
+    args = parser.parse_args(argv)
+    #las primeras DEPARTAMENTOS categorias son raices, los escenarios del arbol mueven las demas
+    if args.categories <= DEPARTAMENTOS:
+        parser.error(f"--categories debe ser mayor que {DEPARTAMENTOS}")
+    return args
+
+
+def cargar_app(args):
+    """configura el entorno que create_app() lee al crear la app e importa main"""
+    if args.database:
+        os.environ["DB_CONNECTION_STRING"] = args.database
+    else:
+        archivo = os.path.join(tempfile.mkdtemp(prefix="shopfix-bench-"), "bench.db")
+        os.environ["DB_CONNECTION_STRING"] = "sqlite:///" + archivo
+        args.reset = True
+    os.environ["CACHE_BACKEND"] = "memory" if args.cache else "none"
+    sys.path.insert(0, os.path.join(RAIZ, "src"))
+    import main
+    return main
+
+
+def sembrar(args, db, Categoria, Producto, User):
+    """crea categorias x productos x usuarios con las clases del modelo, en lotes"""
+    if args.reset:
+        db.drop_all()
+        db.create_all()
+    if Categoria.query.count():
+        print("La base de datos ya tiene datos, no se siembra de nuevo")
+    else:
+        db.session.bulk_save_objects([
+            Categoria.registrar_categoria(f"categoria {i}", f"descripcion {i}", f"icono-{i}")
+            for i in range(args.categories)
+        ])
+        ids_categorias = [categoria_id for (categoria_id,) in db.session.query(Categoria.id).order_by(Categoria.id)]
+        #las primeras categorias son departamentos y el resto cuelga de ellas, para medir las ramas
+        from arbol import segmento
+        raices = ids_categorias[:DEPARTAMENTOS]
+        for posicion, categoria_id in enumerate(ids_categorias[DEPARTAMENTOS:]):
+            padre_id = raices[posicion % len(raices)]
+            db.session.query(Categoria).filter(Categoria.id == categoria_id).update(
+                {"padre_id": padre_id, "ruta": segmento(padre_id)}, synchronize_session=False
+            )
+        for inicio in range(0, args.products, 10000):
+            db.session.bulk_save_objects([
+                Producto.registrar_producto(
+                    f"producto {i} {PALABRAS[i % len(PALABRAS)]}",
+                    f"{PALABRAS[(i * 7) % len(PALABRAS)]} de prueba numero {i}",
+                    (i * 37) % 100000,
+                    f"https://img.example.com/{i}.png",
+                    ids_categorias[i % len(ids_categorias)]
+                )
+                for i in range(inicio, min(inicio + 10000, args.products))
+            ])
+        db.session.bulk_save_objects([
+            User.registro_usuario(f"usuario{i}@example.com", "secreto", False)
+            for i in range(args.users)
+        ])
+        #bulk_save_objects no pasa por los eventos que mantienen el resumen de facetas
+        from facetas import reconstruir_resumen
+        reconstruir_resumen(db.session)
+        db.session.commit()
+    return {
+        "categorias": [categoria_id for (categoria_id,) in db.session.query(Categoria.id).order_by(Categoria.id)],
+        "productos": [producto_id for (producto_id,) in db.session.query(Producto.id).order_by(Producto.id)],
+    }
+
+
+DEPARTAMENTOS = 5
+PALABRAS = ["camisa", "pantalon", "zapato", "gorra", "chaqueta", "vestido", "bufanda", "cinturon"]
+
+
+def escenarios(main, datos):
+    """un escenario por cada ruta (y variante relevante) de src/main.py"""
+    from models import db, Categoria, Producto
+    from utils import encode_cursor
+    categorias = datos["categorias"]
+    productos = datos["productos"]
+    medio = productos[len(productos) // 2]
+    cambio_medio = db.session.query(Producto.cambio).filter(Producto.id == medio).scalar()
+
+    def nuevas_categorias(n):
+        objetos = [Categoria.registrar_categoria(f"bench {time.time_ns()} {i}", "d", "i") for i in range(n)]
+        db.session.add_all(objetos)
+        db.session.commit()
+        return [categoria.id for categoria in objetos]
+
+    def nuevos_productos(n):
+        objetos = [Producto.registrar_producto(f"bench {i}", "d", i, "i", categorias[0]) for i in range(n)]
+        db.session.add_all(objetos)
+        db.session.commit()
+        return [producto.id for producto in objetos]
+
+    ids_para_borrar = {}
+
+    def reservar(nombre, crear):
+        def preparar(n):
+            ids_para_borrar[nombre] = crear(n)
+        return preparar
+
+    def producto_nuevo(i):
+        return {
+            "titulo": f"nuevo {i}", "descripcion": "d", "precio": i,
+            "imagen": "i", "categoria_id": categorias[i % len(categorias)]
+        }
+
+    return [
+        Escenario("GET /", "GET", lambda i: "/"),
+        Escenario("GET /categorias", "GET", lambda i: "/categorias"),
+        Escenario("GET /categorias?include=productos", "GET", lambda i: "/categorias?include=productos"),
+        Escenario("GET /categorias?categoryname", "GET", lambda i: "/categorias?categoryname=categoria 1"),
+        Escenario("GET /categorias/<id>", "GET", lambda i: f"/categorias/{categorias[i % len(categorias)]}"),
+        Escenario("POST /categorias", "POST", lambda i: "/categorias",
+                  lambda i: {"nombre": f"post {time.time_ns()}", "descripcion": "d", "icono": "i"}),
+        Escenario("PUT /categorias/<id>", "PUT", lambda i: f"/categorias/{categorias[i % len(categorias)]}",
+                  lambda i: {"descripcion": f"editada {i}"}),
+        Escenario("DELETE /categorias/<id>", "DELETE",
+                  lambda i: f"/categorias/{ids_para_borrar['categorias'][i]}",
+                  preparar=reservar("categorias", nuevas_categorias)),
+        Escenario("GET /categorias/<id>?include=ancestros,subcategorias", "GET",
+                  lambda i: f"/categorias/{categorias[i % len(categorias)]}?include=ancestros,subcategorias"),
+        Escenario("PUT /categorias/<id> padre_id", "PUT",
+                  lambda i: f"/categorias/{categorias[DEPARTAMENTOS + i % (len(categorias) - DEPARTAMENTOS)]}",
+                  lambda i: {"padre_id": categorias[i % DEPARTAMENTOS]}),
+        Escenario("GET /cache/stats", "GET", lambda i: "/cache/stats"),
+        Escenario("GET /metrics", "GET", lambda i: "/metrics"),
+        Escenario("GET /user", "GET", lambda i: "/user"),
+        Escenario("GET /productos", "GET", lambda i: "/productos"),
+        Escenario("GET /productos?limit=200", "GET", lambda i: "/productos?limit=200"),
+        Escenario("GET /productos?limit=200 gzip", "GET", lambda i: "/productos?limit=200",
+                  headers={"Accept-Encoding": "gzip"}),
+        Escenario("GET /productos?limit=200 br", "GET", lambda i: "/productos?limit=200",
+                  headers={"Accept-Encoding": "br"}),
+        Escenario("GET /productos?fields&limit=200", "GET",
+                  lambda i: "/productos?fields=id,titulo,precio,imagen&limit=200"),
+        Escenario("GET /productos?offset profundo", "GET",
+                  lambda i: f"/productos?offset={len(productos) // 2}"),
+        Escenario("GET /productos?cursor profundo", "GET",
+                  lambda i: f"/productos?cursor={encode_cursor('id', medio, medio)}"),
+        Escenario("GET /productos?sort=-precio&filtros", "GET",
+                  lambda i: f"/productos?sort=-precio&precio_min=100&precio_max=90000&categoria_id={categorias[0]}"),
+        Escenario("GET /productos?categoria_rama", "GET",
+                  lambda i: f"/productos?categoria_rama={categorias[i % DEPARTAMENTOS]}"),
+        Escenario("GET /productos?productname", "GET", lambda i: "/productos?productname=producto 1"),
+        Escenario("GET /productos/<id>", "GET", lambda i: f"/productos/{productos[i % len(productos)]}"),
+        Escenario("GET /productos?ids (50)", "GET",
+                  lambda i: "/productos?ids=" + ",".join(str(productos[(i * 50 + j) % len(productos)]) for j in range(50))),
+        Escenario("POST /productos/batch-get (100)", "POST", lambda i: "/productos/batch-get",
+                  lambda i: {"ids": [productos[(i * 37 + j) % len(productos)] for j in range(100)]}),
+        Escenario("GET /productos/search", "GET",
+                  lambda i: f"/productos/search?q={PALABRAS[i % len(PALABRAS)]} prue"),
+        Escenario("GET /productos/facets", "GET", lambda i: "/productos/facets"),
+        Escenario("GET /productos/facets?precio_min (GROUP BY)", "GET", lambda i: "/productos/facets?precio_min=0"),
+        Escenario("GET /productos/facets?categoria_id", "GET",
+                  lambda i: f"/productos/facets?categoria_id={categorias[i % len(categorias)]}"),
+        Escenario("GET /productos/facets?q", "GET",
+                  lambda i: f"/productos/facets?q={PALABRAS[i % len(PALABRAS)]}"),
+        Escenario("GET /productos/export?format=ndjson", "GET", lambda i: "/productos/export?format=ndjson"),
+        Escenario("GET /productos/export?format=csv", "GET", lambda i: "/productos/export?format=csv"),
+        Escenario("GET /productos/export?format=ndjson gzip", "GET", lambda i: "/productos/export?format=ndjson",
+                  headers={"Accept-Encoding": "gzip"}),
+        Escenario("POST /productos", "POST", lambda i: "/productos", producto_nuevo),
+        Escenario("POST /productos/bulk", "POST", lambda i: "/productos/bulk",
+                  lambda i: [producto_nuevo(i * 100 + j) for j in range(100)]),
+        Escenario("PATCH /productos/bulk", "PATCH", lambda i: "/productos/bulk",
+                  lambda i: [{"id": productos[(i * 100 + j) % len(productos)], "precio": j} for j in range(100)]),
+        Escenario("PATCH /productos/<id>", "PATCH", lambda i: f"/productos/{productos[i % len(productos)]}",
+                  lambda i: {"precio": i}),
+        Escenario("DELETE /productos/<id>", "DELETE",
+                  lambda i: f"/productos/{ids_para_borrar['productos'][i]}",
+                  preparar=reservar("productos", nuevos_productos)),
+        Escenario("GET /changes", "GET", lambda i: "/changes"),
+        Escenario("GET /changes?since", "GET",
+                  lambda i: f"/changes?since={encode_cursor('cambios', cambio_medio, [1, medio])}"),
+        Escenario("POST /users/register", "POST", lambda i: "/users/register",
+                  lambda i: {"email": f"bench{time.time_ns()}@example.com", "password": "secreto"}),
+    ] + escenarios_orm() + escenarios_admin(datos)
+
+
+def escenarios_orm():
+    """
+        los listados como eran antes de las tuplas de columnas y fast_json: objetos del ORM,
+        serialize() y jsonify con el codificador de Flask, en /bench-orm para comparar
+    """
+    from flask import current_app, json as flask_json, request
+    from models import Categoria, Producto
+    from utils import get_page_args
+    app = current_app._get_current_object()
+
+    def responder(datos):
+        cuerpo = flask_json.dumps(datos, cls=flask_json.JSONEncoder) + "\n"
+        return app.response_class(cuerpo, mimetype="application/json")
+
+    def productos_orm():
+        limit, offset = get_page_args(request.args)
+        productos = Producto.query.order_by(Producto.id).limit(limit).offset(offset).all()
+        return responder({"resultados": [producto.serialize() for producto in productos]})
+
+    def categorias_orm():
+        limit, offset = get_page_args(request.args)
+        categorias = Categoria.query.order_by(Categoria.id).limit(limit).offset(offset).all()
+        return responder({"resultados": [
+            categoria.serializar(len(categoria.productos)) for categoria in categorias
+        ]})
+
+    if "bench_orm_productos" not in app.view_functions:
+        app.add_url_rule("/bench-orm/productos", "bench_orm_productos", productos_orm)
+        app.add_url_rule("/bench-orm/categorias", "bench_orm_categorias", categorias_orm)
+    return [
+        Escenario("GET /productos?limit=200 ORM+jsonify", "GET", lambda i: "/bench-orm/productos?limit=200"),
+        Escenario("GET /categorias ORM+jsonify", "GET", lambda i: "/bench-orm/categorias"),
+    ]
+
+
+def escenarios_admin(datos):
+    """
+        las vistas del admin contra ModelView sin cambios, montado en /admin-default
+        con las mismas columnas: conteo, pagina profunda, orden y busqueda
+    """
+    from flask import current_app
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+    from admin import ProductoView
+    from models import db, Producto
+    from utils import encode_cursor
+    app = current_app._get_current_object()
+    if "admin" not in app.blueprints:
+        return []
+    if "admin_default" not in app.blueprints:
+        por_defecto = Admin(app, name="ModelView", url="/admin-default", endpoint="admin_default",
+                            template_mode="bootstrap3")
+        vista = ModelView(Producto, db.session, endpoint="producto_default", url="producto")
+        vista.column_list = ProductoView.column_list
+        vista.column_formatters = ProductoView.column_formatters
+        vista.page_size = ProductoView.page_size
+        vista._refresh_cache()
+        por_defecto.add_view(vista)
+    productos = datos["productos"]
+    medio = productos[len(productos) // 2]
+    pagina = len(productos) // 2 // ProductoView.page_size
+    cursor = encode_cursor("id:asc", medio, medio)
+    escenarios = []
+    for sufijo, prefijo, profunda in (
+        ("", "/admin/producto/", f"?page={pagina}&cursor={cursor}"),
+        (" ModelView", "/admin-default/producto/", f"?page={pagina}"),
+    ):
+        escenarios.extend([
+            Escenario(f"GET admin productos{sufijo}", "GET", lambda i, u=prefijo: u),
+            Escenario(f"GET admin productos pagina profunda{sufijo}", "GET", lambda i, u=prefijo + profunda: u),
+            #la columna 2 es precio en ambas vistas
+            Escenario(f"GET admin productos ?sort=precio{sufijo}", "GET",
+                      lambda i, u=prefijo: u + "?sort=2&desc=1"),
+            Escenario(f"GET admin productos ?search{sufijo}", "GET",
+                      lambda i, u=prefijo: u + f"?search=producto {i % 1000 + 1000}"),
+        ])
+    return escenarios
+
+
+#importa main y crea la app en un proceso nuevo; sin create_app la app se crea al importar
+CODIGO_ARRANQUE = """
+import time
+inicio = time.perf_counter()
+import main
+importado = time.perf_counter()
+if hasattr(main, "create_app"):
+    main.create_app()
+print(importado - inicio, time.perf_counter() - importado)
+"""
+
+
+def medir_arranque(args):
+    """tiempo de arranque en frio de un worker, con y sin Flask-Admin"""
+    resultados = {}
+    for nombre, admin in (("arranque api", "false"), ("arranque api+admin", "true")):
+        if args.only and args.only not in nombre:
+            continue
+        entorno = dict(os.environ, ENABLE_ADMIN=admin)
+        entorno.pop("FLASK_RUN_FROM_CLI", None)
+        imports, creaciones, procesos = [], [], []
+        for _ in range(args.startup_runs):
+            inicio = time.perf_counter()
+            salida = subprocess.check_output(
+                [sys.executable, "-c", CODIGO_ARRANQUE], cwd=os.path.join(RAIZ, "src"), env=entorno
+            )
+            procesos.append(time.perf_counter() - inicio)
+            importado, creado = map(float, salida.split()[-2:])
+            imports.append(importado)
+            creaciones.append(creado)
+        resultados[nombre] = {
+            "import_ms": percentil(imports, 50) * 1000,
+            "create_app_ms": percentil(creaciones, 50) * 1000,
+            "arranque_ms": percentil([i + c for i, c in zip(imports, creaciones)], 50) * 1000,
+            "proceso_ms": percentil(procesos, 50) * 1000,
+        }
+        print(
+            f"{nombre:45} import {resultados[nombre]['import_ms']:8.2f} ms  "
+            f"create_app {resultados[nombre]['create_app_ms']:8.2f} ms  "
+            f"proceso {resultados[nombre]['proceso_ms']:8.2f} ms"
+        )
+    return resultados
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def medir(cliente, escenario, args, contador):
+    total = args.warmup + args.iterations + args.memory_iterations
+    if escenario.preparar is not None:
+        escenario.preparar(total)
+
+    bytes_respuesta = []
+
+    def pedir(i):
+        opciones = {"headers": escenario.headers}
+        if escenario.body is not None:
+            body = escenario.body(i)
+            if escenario.content_type is None:
+                opciones["json"] = body
+            else:
+                opciones["data"] = body
+                opciones["content_type"] = escenario.content_type
+        respuesta = cliente.open(escenario.url(i), method=escenario.metodo, **opciones)
+        #consumir el cuerpo completo, incluidas las respuestas en streaming
+        bytes_respuesta.append(len(respuesta.get_data()))
+        return respuesta.status_code
+
+    for i in range(args.warmup):
+        pedir(i)
+
+    latencias = []
+    sentencias = []
+    estados = {}
+    inicio = time.perf_counter()
+    for i in range(args.warmup, args.warmup + args.iterations):
+        contador[0] = 0
+        t = time.perf_counter()
+        estado = pedir(i)
+        latencias.append(time.perf_counter() - t)
+        sentencias.append(contador[0])
+        estados[str(estado)] = estados.get(str(estado), 0) + 1
+    duracion = time.perf_counter() - inicio
+
+    pico = 0
+    for i in range(args.warmup + args.iterations, total):
+        tracemalloc.start()
+        pedir(i)
+        pico = max(pico, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "iteraciones": args.iterations,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "throughput_rps": args.iterations / duracion,
+        "sentencias_sql_promedio": sum(sentencias) / len(sentencias),
+        "sentencias_sql_max": max(sentencias),
+        "memoria_pico_kb": pico / 1024,
+        "bytes_promedio": sum(bytes_respuesta) / len(bytes_respuesta),
+        "estados": estados,
+    }
+
+
+def comparar(resultados, baseline, threshold):
+    """devuelve la lista de regresiones contra el baseline"""
+    regresiones = []
+    for nombre, actual in resultados["escenarios"].items():
+        anterior = baseline["escenarios"].get(nombre)
+        if anterior is None:
+            continue
+        limite = anterior["p95_ms"] * (1 + threshold) + TOLERANCIA_ABSOLUTA * 1000
+        if actual["p95_ms"] > limite:
+            regresiones.append(
+                f"{nombre}: p95 {actual['p95_ms']:.2f} ms > {anterior['p95_ms']:.2f} ms (+{threshold:.0%})"
+            )
+        if actual["sentencias_sql_max"] > anterior["sentencias_sql_max"]:
+            regresiones.append(
+                f"{nombre}: sentencias SQL {actual['sentencias_sql_max']} > {anterior['sentencias_sql_max']}"
+            )
+    for nombre, actual in resultados.get("arranque", {}).items():
+        anterior = baseline.get("arranque", {}).get(nombre)
+        if anterior is None:
+            continue
+        if actual["arranque_ms"] > anterior["arranque_ms"] * (1 + threshold) + TOLERANCIA_ABSOLUTA * 1000:
+            regresiones.append(
+                f"{nombre}: {actual['arranque_ms']:.2f} ms > {anterior['arranque_ms']:.2f} ms (+{threshold:.0%})"
+            )
+    return regresiones
+
+
+def commit_actual():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app_module = cargar_app(args)
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from models import db, Categoria, Producto, User
+
+    contador = [0]
+
+    def contar(*_):
+        contador[0] += 1
+    event.listen(Engine, "before_cursor_execute", contar)
+
+    app = app_module.create_app()
+    resultados = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parametros": {
+            "categories": args.categories, "products": args.products, "users": args.users,
+            "iterations": args.iterations, "cache": args.cache,
+        },
+        "escenarios": {},
+    }
+    with app.app_context():
+        resultados["dialecto"] = db.engine.dialect.name
+        inicio = time.perf_counter()
+        datos = sembrar(args, db, Categoria, Producto, User)
+        print(f"Base sembrada en {time.perf_counter() - inicio:.1f}s ({resultados['dialecto']})")
+        cliente = app.test_client()
+        for escenario in escenarios(app_module, datos):
+            if args.only and args.only not in escenario.nombre:
+                continue
+            resultado = medir(cliente, escenario, args, contador)
+            resultados["escenarios"][escenario.nombre] = resultado
+            print(
+                f"{escenario.nombre:45} p50 {resultado['p50_ms']:8.2f} ms  p95 {resultado['p95_ms']:8.2f} ms  "
+                f"p99 {resultado['p99_ms']:8.2f} ms  {resultado['throughput_rps']:8.1f} req/s  "
+                f"sql {resultado['sentencias_sql_promedio']:5.1f}  mem {resultado['memoria_pico_kb']:9.1f} KB  "
+                f"resp {resultado['bytes_promedio'] / 1024:8.1f} KB  {resultado['estados']}"
+            )
+
+    if args.startup_runs:
+        resultados["arranque"] = medir_arranque(args)
+
+    if args.output:
+        with open(args.output, "w") as salida:
+            json.dump(resultados, salida, indent=2, sort_keys=True)
+        print(f"Resultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as entrada:
+            baseline = json.load(entrada)
+        regresiones = comparar(resultados, baseline, args.threshold)
+        for regresion in regresiones:
+            print(f"REGRESION {regresion}")
+        if regresiones:
+            return 1
+        print(f"Sin regresiones contra {args.baseline} ({baseline.get('commit')})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
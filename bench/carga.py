@@ -0,0 +1,242 @@
+"""
+Prueba de carga de la API en modo WSGI (main.py, workers gthread) y ASGI
+(asgi.py, workers de uvicorn) con gunicorn, la misma base, la misma cantidad
+de procesos y la misma mezcla de GET /productos, GET /productos?ids= y
+GET /categorias.
+
+Siembra la base como bench/benchmark.py, levanta cada servidor y lo carga con
+--concurrency conexiones keep-alive a la vez durante --duration segundos por
+nivel. Por nivel informa throughput, p50 y p99; al final, para cada modo, la capacidad:
+el mayor throughput (y con que concurrencia) con p99 dentro de --p99-ms.
+
+Con SQLite local cada consulta tarda microsegundos y el limite es la CPU;
+--db-latency-ms agrega esa espera a cada sentencia para emular una base en
+otra maquina, que es donde un hilo bloqueado por request se nota.
+
+    pipenv run load --products 20000 --workers 2 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import cargar_app, percentil, sembrar  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga WSGI contra ASGI.")
+    parser.add_argument("--database", help="URL de la base de datos (por defecto SQLite temporal)")
+    parser.add_argument("--reset", action="store_true",
+                        help="borra y vuelve a crear las tablas de --database antes de sembrar")
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=2, help="procesos de cada servidor")
+    parser.add_argument("--threads", type=int, default=4, help="hilos por worker de gunicorn")
+    parser.add_argument("--concurrency", default="4,8,16,32,64,128",
+                        help="conexiones simultaneas de cada nivel, separadas por coma")
+    parser.add_argument("--duration", type=float, default=10, help="segundos medidos por nivel")
+    parser.add_argument("--warmup", type=float, default=2, help="segundos sin medir por nivel")
+    parser.add_argument("--db-latency-ms", type=float, default=0,
+                        help="espera agregada a cada sentencia de SQLite")
+    parser.add_argument("--p99-ms", type=float, default=100, help="p99 maximo para contar la capacidad")
+    parser.add_argument("--modes", default="wsgi,asgi", help="modos a medir, separados por coma")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    return parser.parse_args(argv)
+
+
+def puerto_libre():
+    with socket.socket() as conexion:
+        conexion.bind(("127.0.0.1", 0))
+        return conexion.getsockname()[1]
+
+
+def comando(modo, puerto, args):
+    """gunicorn con los mismos workers: hilos (gthread) para WSGI y un event loop (uvicorn) para ASGI"""
+    servidor = [
+        sys.executable, "-m", "gunicorn.app.wsgiapp", f"servidor_carga:{modo}",
+        "--chdir", os.path.join(RAIZ, "bench"), "-b", f"127.0.0.1:{puerto}",
+        "-w", str(args.workers), "--log-level", "warning",
+    ]
+    if modo == "wsgi":
+        return servidor + ["-k", "gthread", "--threads", str(args.threads)]
+    return servidor + ["-k", "uvicorn_worker.UvicornWorker"]
+
+
+def levantar(modo, puerto, args):
+    """arranca el servidor y espera a que responda"""
+    entorno = dict(
+        os.environ, CACHE_BACKEND="none", ENABLE_ADMIN="false", SLOW_QUERY_MS="60000",
+        CARGA_DB_LATENCIA_MS=str(args.db_latency_ms),
+        PYTHONPATH=os.pathsep.join([os.path.join(RAIZ, "src"), os.path.join(RAIZ, "bench")]),
+    )
+    entorno.pop("FLASK_RUN_FROM_CLI", None)
+    proceso = subprocess.Popen(comando(modo, puerto, args), env=entorno)
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"el servidor {modo} termino con codigo {proceso.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{puerto}/productos?limit=1", timeout=1).read()
+            return proceso
+        except OSError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"el servidor {modo} no respondio")
+
+
+async def leer_respuesta(reader):
+    """(estado, cerrar) de una respuesta HTTP/1.1, consumiendo el cuerpo"""
+    cabecera = await reader.readuntil(b"\r\n\r\n")
+    lineas = cabecera.decode("latin-1").split("\r\n")
+    estado = int(lineas[0].split()[1])
+    encabezados = {}
+    for linea in lineas[1:]:
+        if ":" in linea:
+            nombre, valor = linea.split(":", 1)
+            encabezados[nombre.strip().lower()] = valor.strip().lower()
+    if encabezados.get("transfer-encoding") == "chunked":
+        while True:
+            largo = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(largo + 2)
+            if largo == 0:
+                break
+    else:
+        await reader.readexactly(int(encabezados.get("content-length", 0)))
+    return estado, encabezados.get("connection") == "close"
+
+
+async def conexion_de_carga(puerto, rutas, desfase, inicio_medicion, fin, latencias, estados):
+    """una conexion keep-alive que pide rutas en orden hasta fin"""
+    reader = writer = None
+    i = desfase
+    while time.perf_counter() < fin:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        inicio = time.perf_counter()
+        pedido = f"GET {ruta} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+        writer.write(pedido)
+        try:
+            estado, cerrar = await leer_respuesta(reader)
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            estado, cerrar = 0, True
+            if not getattr(error, "partial", b""):
+                #el servidor cerro la conexion keep-alive al mismo tiempo que se enviaba el GET:
+                #como cualquier cliente HTTP se repite una vez en una conexion nueva
+                writer.close()
+                reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+                writer.write(pedido)
+                try:
+                    estado, cerrar = await leer_respuesta(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    pass
+        if inicio >= inicio_medicion:
+            latencias.append(time.perf_counter() - inicio)
+            estados[estado] = estados.get(estado, 0) + 1
+        if cerrar:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def nivel(puerto, rutas, concurrencia, args):
+    latencias, estados = [], {}
+    inicio_medicion = time.perf_counter() + args.warmup
+    fin = inicio_medicion + args.duration
+    await asyncio.gather(*[
+        conexion_de_carga(puerto, rutas, i * 7, inicio_medicion, fin, latencias, estados)
+        for i in range(concurrencia)
+    ])
+    return {
+        "concurrencia": concurrencia,
+        "throughput_rps": len(latencias) / args.duration,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "estados": {str(estado): cantidad for estado, cantidad in estados.items()},
+    }
+
+
+def rutas_de_carga(datos):
+    """mezcla de lecturas que sirven los dos modos"""
+    productos = datos["productos"]
+    categorias = datos["categorias"]
+    rutas = []
+    for i in range(100):
+        rutas.append(f"/productos?limit=20&categoria_id={categorias[i % len(categorias)]}")
+        ids = ",".join(str(productos[(i * 97 + j * 13) % len(productos)]) for j in range(20))
+        rutas.append(f"/productos?ids={ids}")
+        rutas.append(f"/categorias?limit=20&offset={i % 3 * 10}")
+    return rutas
+
+
+def capacidad(niveles, p99_ms):
+    """el nivel de mayor throughput con p99 dentro del limite y sin errores"""
+    dentro = [
+        resultado for resultado in niveles
+        if resultado["p99_ms"] <= p99_ms and set(resultado["estados"]) == {"200"}
+    ]
+    return max(dentro, key=lambda resultado: resultado["throughput_rps"]) if dentro else None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    #los servidores corren sin cache de respuestas, cada request llega a la base
+    args.cache = False
+    main_module = cargar_app(args)
+    from models import db, Categoria, Producto, User
+    app = main_module.create_app({"ENABLE_ADMIN": False})
+    with app.app_context():
+        datos = sembrar(args, db, Categoria, Producto, User)
+        db.engine.dispose()
+    rutas = rutas_de_carga(datos)
+    concurrencias = [int(valor) for valor in args.concurrency.split(",")]
+    resultados = {
+        "parametros": {
+            "products": args.products, "workers": args.workers, "threads": args.threads,
+            "db_latency_ms": args.db_latency_ms, "duration": args.duration, "p99_ms": args.p99_ms,
+        },
+        "modos": {},
+    }
+    for modo in args.modes.split(","):
+        puerto = puerto_libre()
+        proceso = levantar(modo, puerto, args)
+        niveles = []
+        try:
+            for concurrencia in concurrencias:
+                resultado = asyncio.run(nivel(puerto, rutas, concurrencia, args))
+                niveles.append(resultado)
+                print(
+                    f"{modo:5} c={concurrencia:<4} {resultado['throughput_rps']:9.1f} req/s  "
+                    f"p50 {resultado['p50_ms']:8.2f} ms  p99 {resultado['p99_ms']:8.2f} ms  {resultado['estados']}",
+                    flush=True
+                )
+        finally:
+            proceso.terminate()
+            proceso.wait()
+        resultados["modos"][modo] = {"niveles": niveles, "capacidad": capacidad(niveles, args.p99_ms)}
+    for modo, resultado in resultados["modos"].items():
+        mejor = resultado["capacidad"]
+        if mejor is None:
+            print(f"{modo}: ningun nivel con p99 <= {args.p99_ms} ms")
+        else:
+            print(
+                f"{modo}: {mejor['throughput_rps']:.1f} req/s con p99 <= {args.p99_ms} ms "
+                f"({mejor['concurrencia']} conexiones, p99 {mejor['p99_ms']:.2f} ms)"
+            )
+    if args.output:
+        with open(args.output, "w") as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Costo del contador de cambios en las escrituras del catalogo.
+
+Toda escritura toma la fila de contador_cambio justo antes del commit y la
+tiene hasta terminarlo (ver src/cambios.py), asi GET /changes no necesita saber
+que transacciones siguen abiertas. Este benchmark mide cuanto cuesta: --concurrency
+hilos hacen PATCH /productos/<id>, cada uno a productos distintos, y con
+--bulk-batch otro hilo inserta lotes con POST /productos/bulk al mismo tiempo.
+Por nivel informa throughput, p50 y p99 de los PATCH en dos modos:
+
+- contador: la app tal cual.
+- sin-contador: el numero de cambio es fijo y no se bloquea el contador.
+  El feed no sirve asi, solo marca el limite de lo que se pierde.
+
+En SQLite las escrituras se serializan de todos modos (un solo escritor), la
+comparacion tiene sentido contra PostgreSQL o MySQL con --database.
+
+    pipenv run writes --database postgresql://localhost/shopfix --reset --bulk-batch 1000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import cargar_app, percentil, sembrar  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Escrituras concurrentes con y sin el contador de cambios.")
+    parser.add_argument("--database", help="URL de la base de datos (por defecto SQLite temporal)")
+    parser.add_argument("--reset", action="store_true",
+                        help="borra y vuelve a crear las tablas de --database antes de sembrar")
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--concurrency", default="1,2,4,8,16",
+                        help="hilos de PATCH de cada nivel, separados por coma")
+    parser.add_argument("--duration", type=float, default=5, help="segundos medidos por nivel")
+    parser.add_argument("--bulk-batch", type=int, default=0,
+                        help="filas por lote de un POST /productos/bulk continuo durante cada nivel (0 sin bulk)")
+    parser.add_argument("--modes", default="contador,sin-contador", help="modos a medir, separados por coma")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    return parser.parse_args(argv)
+
+
+def sin_contador():
+    """reemplaza el contador por un numero fijo sin lock; devuelve la funcion que lo restaura"""
+    import models
+    original = models.tomar_cambios
+    models.tomar_cambios = lambda conexion, cantidad=1: 1
+
+    def restaurar():
+        models.tomar_cambios = original
+    return restaurar
+
+
+def nivel(app, datos, concurrencia, args):
+    """PATCH continuos de concurrencia hilos (y el bulk, si se pide) durante args.duration"""
+    productos = datos["productos"]
+    categorias = datos["categorias"]
+    fin = time.perf_counter() + args.duration
+    latencias, estados, lotes = [], {}, [0]
+    candado = threading.Lock()
+
+    def parchar(hilo):
+        cliente = app.test_client()
+        propias, i = [], 0
+        while time.perf_counter() < fin:
+            #cada hilo escribe sus propios productos, no hay filas en comun
+            producto_id = productos[(i * concurrencia + hilo) % len(productos)]
+            inicio = time.perf_counter()
+            estado = cliente.patch(f"/productos/{producto_id}", json={"precio": i}).status_code
+            propias.append(time.perf_counter() - inicio)
+            i += 1
+            with candado:
+                estados[estado] = estados.get(estado, 0) + 1
+        with candado:
+            latencias.extend(propias)
+
+    def insertar():
+        cliente = app.test_client()
+        i = 0
+        while time.perf_counter() < fin:
+            cliente.post(f"/productos/bulk?batch_size={args.bulk_batch}", json=[
+                {
+                    "titulo": f"bulk {i} {j}", "descripcion": "d", "precio": j, "imagen": "i",
+                    "categoria_id": categorias[j % len(categorias)]
+                }
+                for j in range(args.bulk_batch)
+            ])
+            i += 1
+        lotes[0] = i
+
+    hilos = [threading.Thread(target=parchar, args=(hilo,)) for hilo in range(concurrencia)]
+    if args.bulk_batch:
+        hilos.append(threading.Thread(target=insertar))
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return {
+        "concurrencia": concurrencia,
+        "throughput_rps": len(latencias) / args.duration,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "lotes_bulk": lotes[0],
+        "estados": {str(estado): cantidad for estado, cantidad in estados.items()},
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.cache = False
+    main_module = cargar_app(args)
+    from models import db, Categoria, Producto, User
+    #las esperas por el lock del contador no se registran como consultas lentas
+    app = main_module.create_app({"ENABLE_ADMIN": False, "SLOW_QUERY_MS": 60000})
+    with app.app_context():
+        datos = sembrar(args, db, Categoria, Producto, User)
+        dialecto = db.engine.dialect.name
+    concurrencias = [int(valor) for valor in args.concurrency.split(",")]
+    resultados = {
+        "dialecto": dialecto,
+        "parametros": {"products": args.products, "duration": args.duration, "bulk_batch": args.bulk_batch},
+        "modos": {},
+    }
+    for modo in args.modes.split(","):
+        restaurar = sin_contador() if modo == "sin-contador" else None
+        niveles = []
+        try:
+            for concurrencia in concurrencias:
+                resultado = nivel(app, datos, concurrencia, args)
+                niveles.append(resultado)
+                print(
+                    f"{modo:12} c={concurrencia:<4} {resultado['throughput_rps']:9.1f} PATCH/s  "
+                    f"p50 {resultado['p50_ms']:8.2f} ms  p99 {resultado['p99_ms']:8.2f} ms  "
+                    f"bulk {resultado['lotes_bulk']:4} lotes  {resultado['estados']}",
+                    flush=True
+                )
+        finally:
+            if restaurar is not None:
+                restaurar()
+        resultados["modos"][modo] = niveles
+    if args.output:
+        with open(args.output, "w") as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
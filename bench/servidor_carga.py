@@ -0,0 +1,41 @@
+"""
+Apps que levanta bench/carga.py: wsgi para gunicorn y asgi para uvicorn.
+
+Con CARGA_DB_LATENCIA_MS cada sentencia de SQLite espera esos milisegundos en
+el hilo que la ejecuta (el del request en WSGI, el de aiosqlite en ASGI),
+como el viaje de ida y vuelta a una base en otra maquina que SQLite local no
+tiene. En otras bases la variable se ignora.
+"""
+import os
+import sqlite3
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCIA = float(os.environ.get("CARGA_DB_LATENCIA_MS", 0)) / 1000
+
+
+def esperar(sentencia):
+    time.sleep(LATENCIA)
+
+
+@event.listens_for(Engine, "connect")
+def agregar_latencia(dbapi_connection, connection_record):
+    if not LATENCIA:
+        return
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.set_trace_callback(esperar)
+    elif hasattr(dbapi_connection, "_connection") and hasattr(dbapi_connection._connection, "set_trace_callback"):
+        #aiosqlite: el callback corre en el hilo de la conexion, no en el event loop
+        dbapi_connection.await_(dbapi_connection._connection.set_trace_callback(esperar))
+
+
+def __getattr__(nombre):
+    #cada servidor crea solo la app que usa
+    if nombre == "wsgi":
+        from main import create_app
+        return create_app()
+    if nombre == "asgi":
+        from asgi import application
+        return application
+    raise AttributeError(nombre)
@@ -0,0 +1,50 @@
+"""
+Configuracion de gunicorn (Procfile: gunicorn wsgi --chdir ./src/ -c gunicorn.conf.py).
+
+La app se carga una vez en el proceso maestro (preload_app) y cada worker
+descarta al arrancar las conexiones heredadas del fork. Workers e hilos salen
+de la cantidad de CPUs si no se indican con WEB_CONCURRENCY y GUNICORN_THREADS.
+Con mas de un worker el cache de respuestas tiene que ser compartido (redis);
+sin CACHE_BACKEND queda desactivado y se avisa en el log al arrancar.
+"""
+import multiprocessing
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = timeout
+keepalive = 5
+#reinicia cada worker de vez en cuando para acotar fugas de memoria
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+#cada hilo usa a lo sumo una conexion, el pool de cada worker no necesita mas
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+#el cache memory es de cada worker y una escritura solo invalida el del worker que la atiende,
+#los demas servirian respuestas viejas hasta CACHE_TTL: con varios workers el cache va en redis.
+#Sin CACHE_BACKEND no se cachea, con CACHE_BACKEND=memory no se arranca
+_cache_desactivado = workers > 1 and "CACHE_BACKEND" not in os.environ
+if workers > 1:
+    if os.environ.setdefault("CACHE_BACKEND", "none") == "memory":
+        raise RuntimeError(
+            f"CACHE_BACKEND=memory no se invalida entre los {workers} workers: "
+            "usar CACHE_BACKEND=redis (o none) o WEB_CONCURRENCY=1"
+        )
+
+
+def on_starting(server):
+    if _cache_desactivado:
+        server.log.warning(
+            "Cache de respuestas desactivado (CACHE_BACKEND=none) con %s workers: "
+            "definir CACHE_BACKEND=redis y CACHE_REDIS_URL para cachear", workers
+        )
+
+
+def post_fork(server, worker):
+    from wsgi import application
+    from pool import dispose_engines
+    dispose_engines(application)
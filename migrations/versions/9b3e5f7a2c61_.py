@@ -0,0 +1,37 @@
+"""categoria.padre_id and materialized path (ruta)
+
+Revision ID: 9b3e5f7a2c61
+Revises: f2a6d8c4b137
+Create Date: 2026-10-18 22:41:05.126733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5f7a2c61'
+down_revision = 'f2a6d8c4b137'
+branch_labels = None
+depends_on = None
+
+FK_NOMBRE = 'fk_categoria_padre_id_categoria'
+
+
+def upgrade():
+    #las categorias que ya existen quedan como raices (ruta vacia)
+    with op.batch_alter_table('categoria') as batch_op:
+        batch_op.add_column(sa.Column('padre_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('ruta', sa.String(length=255), server_default='', nullable=False))
+        batch_op.create_foreign_key(FK_NOMBRE, 'categoria', ['padre_id'], ['id'], ondelete='SET NULL')
+    op.create_index(op.f('ix_categoria_padre_id'), 'categoria', ['padre_id'], unique=False)
+    op.create_index(op.f('ix_categoria_ruta'), 'categoria', ['ruta'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_categoria_ruta'), table_name='categoria')
+    op.drop_index(op.f('ix_categoria_padre_id'), table_name='categoria')
+    with op.batch_alter_table('categoria') as batch_op:
+        batch_op.drop_constraint(FK_NOMBRE, type_='foreignkey')
+        batch_op.drop_column('ruta')
+        batch_op.drop_column('padre_id')
@@ -0,0 +1,37 @@
+"""version columns on categoria and producto for optimistic concurrency
+
+Revision ID: a7c3e9f2b618
+Revises: e5b7c9a1d204
+Create Date: 2026-10-18 19:12:47.310582
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f2b618'
+down_revision = 'e5b7c9a1d204'
+branch_labels = None
+depends_on = None
+
+#SQLite recrea la tabla producto al quitar la columna y con ella se pierden los triggers de busqueda
+def triggers_busqueda_sqlite():
+    """triggers de la busqueda en SQLite, tal como los definio la migracion d3f9a6b2e871"""
+    return context.script.get_revision('d3f9a6b2e871').module.TRIGGERS_SQLITE
+
+
+def upgrade():
+    #las filas existentes quedan en la version 1
+    op.add_column('categoria', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('producto', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('producto') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('categoria') as batch_op:
+        batch_op.drop_column('version')
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in triggers_busqueda_sqlite():
+            op.execute(trigger)
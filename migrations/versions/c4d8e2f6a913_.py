@@ -0,0 +1,68 @@
+"""change feed: updated_at, cambio and eliminacion tombstones
+
+Revision ID: c4d8e2f6a913
+Revises: a7c3e9f2b618
+Create Date: 2026-10-18 20:26:03.518842
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2f6a913'
+down_revision = 'a7c3e9f2b618'
+branch_labels = None
+depends_on = None
+
+#SQLite recrea la tabla producto en los batch y con ella se pierden los triggers de busqueda
+def triggers_busqueda_sqlite():
+    """triggers de la busqueda en SQLite, tal como los definio la migracion d3f9a6b2e871"""
+    return context.script.get_revision('d3f9a6b2e871').module.TRIGGERS_SQLITE
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        #el cambio 1 queda para las filas que ya existen
+        op.execute("CREATE SEQUENCE cambio_seq START 2")
+    for tabla in ('categoria', 'producto'):
+        #en SQLite un DEFAULT CURRENT_TIMESTAMP solo se puede agregar recreando la tabla
+        with op.batch_alter_table(tabla, recreate='always' if dialect == 'sqlite' else 'auto') as batch_op:
+            batch_op.add_column(sa.Column(
+                'updated_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False
+            ))
+            #las filas existentes quedan en el cambio 1, la app asigna los siguientes
+            batch_op.add_column(sa.Column('cambio', sa.BigInteger(), server_default='1', nullable=False))
+        op.create_index(f'ix_{tabla}_cambio_id', tabla, ['cambio', 'id'], unique=False)
+        if dialect == 'postgresql':
+            #las inserciones fuera de la app tambien toman un numero de la secuencia
+            op.alter_column(tabla, 'cambio', server_default=sa.text("nextval('cambio_seq')"))
+    op.create_table('eliminacion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=20), nullable=False),
+    sa.Column('entidad_id', sa.Integer(), nullable=False),
+    sa.Column('eliminado_en', sa.DateTime(), nullable=False),
+    sa.Column('cambio', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_eliminacion_cambio_id', 'eliminacion', ['cambio', 'id'], unique=False)
+    if dialect == 'sqlite':
+        for trigger in triggers_busqueda_sqlite():
+            op.execute(trigger)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    op.drop_index('ix_eliminacion_cambio_id', table_name='eliminacion')
+    op.drop_table('eliminacion')
+    for tabla in ('producto', 'categoria'):
+        op.drop_index(f'ix_{tabla}_cambio_id', table_name=tabla)
+        with op.batch_alter_table(tabla) as batch_op:
+            batch_op.drop_column('cambio')
+            batch_op.drop_column('updated_at')
+    if dialect == 'postgresql':
+        op.execute("DROP SEQUENCE cambio_seq")
+    elif dialect == 'sqlite':
+        for trigger in triggers_busqueda_sqlite():
+            op.execute(trigger)
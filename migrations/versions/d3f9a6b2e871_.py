@@ -0,0 +1,70 @@
+"""full-text search index on producto titulo and descripcion
+
+Revision ID: d3f9a6b2e871
+Revises: b52e07a1c3d4
+Create Date: 2026-10-18 15:42:09.268113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f9a6b2e871'
+down_revision = 'b52e07a1c3d4'
+branch_labels = None
+depends_on = None
+
+#este DDL queda congelado aunque cambie el de src/busqueda.py: las migraciones que recrean
+#producto en SQLite vuelven a crear TRIGGERS_SQLITE desde aqui (context.script.get_revision)
+VECTOR_POSTGRES = (
+    "setweight(to_tsvector('simple', titulo), 'A') || "
+    "setweight(to_tsvector('simple', descripcion), 'B')"
+)
+
+TRIGGERS_SQLITE = [
+    "CREATE TRIGGER producto_busqueda_ai AFTER INSERT ON producto BEGIN "
+    "INSERT INTO producto_busqueda(rowid, titulo, descripcion) "
+    "VALUES (new.id, new.titulo, new.descripcion); END",
+    "CREATE TRIGGER producto_busqueda_ad AFTER DELETE ON producto BEGIN "
+    "INSERT INTO producto_busqueda(producto_busqueda, rowid, titulo, descripcion) "
+    "VALUES ('delete', old.id, old.titulo, old.descripcion); END",
+    "CREATE TRIGGER producto_busqueda_au AFTER UPDATE OF titulo, descripcion ON producto BEGIN "
+    "INSERT INTO producto_busqueda(producto_busqueda, rowid, titulo, descripcion) "
+    "VALUES ('delete', old.id, old.titulo, old.descripcion); "
+    "INSERT INTO producto_busqueda(rowid, titulo, descripcion) "
+    "VALUES (new.id, new.titulo, new.descripcion); END",
+]
+
+DDL_POR_DIALECTO = {
+    "postgresql": [
+        f"CREATE INDEX ix_producto_busqueda ON producto USING GIN (({VECTOR_POSTGRES}))",
+    ],
+    "mysql": [
+        "CREATE FULLTEXT INDEX ix_producto_busqueda ON producto (titulo, descripcion)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE producto_busqueda USING fts5("
+        "titulo, descripcion, content='producto', content_rowid='id')",
+    ] + TRIGGERS_SQLITE,
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for sentencia in DDL_POR_DIALECTO.get(dialect, []):
+        op.execute(sentencia)
+    if dialect == 'sqlite':
+        #indexar los productos que ya existen
+        op.execute("INSERT INTO producto_busqueda(producto_busqueda) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect in ('postgresql', 'mysql'):
+        op.drop_index('ix_producto_busqueda', table_name='producto')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER producto_busqueda_au")
+        op.execute("DROP TRIGGER producto_busqueda_ad")
+        op.execute("DROP TRIGGER producto_busqueda_ai")
+        op.execute("DROP TABLE producto_busqueda")
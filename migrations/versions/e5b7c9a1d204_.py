@@ -0,0 +1,52 @@
+"""producto.categoria_id ON DELETE SET NULL
+
+Revision ID: e5b7c9a1d204
+Revises: d3f9a6b2e871
+Create Date: 2026-10-18 18:05:31.774210
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7c9a1d204'
+down_revision = 'd3f9a6b2e871'
+branch_labels = None
+depends_on = None
+
+FK_NOMBRE = 'fk_producto_categoria_id_categoria'
+#SQLite no nombra la llave foranea original, el batch la reconoce con esta convencion
+CONVENCION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+#SQLite recrea la tabla producto en el batch y con ella se pierden los triggers de busqueda
+def triggers_busqueda_sqlite():
+    """triggers de la busqueda en SQLite, tal como los definio la migracion d3f9a6b2e871"""
+    return context.script.get_revision('d3f9a6b2e871').module.TRIGGERS_SQLITE
+
+
+def fk_actual():
+    """nombre de la llave foranea producto.categoria_id -> categoria.id en la base"""
+    for fk in sa.inspect(op.get_bind()).get_foreign_keys('producto'):
+        if fk['constrained_columns'] == ['categoria_id'] and fk['name']:
+            return fk['name']
+    return FK_NOMBRE
+
+
+def reemplazar_fk(ondelete):
+    nombre = fk_actual()
+    with op.batch_alter_table('producto', naming_convention=CONVENCION) as batch_op:
+        batch_op.drop_constraint(nombre, type_='foreignkey')
+        batch_op.create_foreign_key(FK_NOMBRE, 'categoria', ['categoria_id'], ['id'], ondelete=ondelete)
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in triggers_busqueda_sqlite():
+            op.execute(trigger)
+
+
+def upgrade():
+    #al borrar una categoria la base deja sus productos sin categoria, sin pasar por el ORM
+    reemplazar_fk('SET NULL')
+
+
+def downgrade():
+    reemplazar_fk(None)
@@ -0,0 +1,48 @@
+"""contador_cambio: change numbers taken from a counter row instead of MAX + 1
+
+Revision ID: e8f1b3d5a7c2
+Revises: 9b3e5f7a2c61
+Create Date: 2026-10-19 10:12:47.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f1b3d5a7c2'
+down_revision = '9b3e5f7a2c61'
+branch_labels = None
+depends_on = None
+
+#el contador sigue desde el ultimo numero ya asignado (1 si no hay filas)
+INICIAR_CONTADOR = (
+    "INSERT INTO contador_cambio (id, valor) SELECT 1, COALESCE(MAX(ultimo), 1) FROM ("
+    "SELECT MAX(cambio) AS ultimo FROM categoria UNION ALL "
+    "SELECT MAX(cambio) FROM producto UNION ALL "
+    "SELECT MAX(cambio) FROM eliminacion) AS ultimos"
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.create_table('contador_cambio',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('valor', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(INICIAR_CONTADOR)
+    if dialect == 'postgresql':
+        for tabla in ('categoria', 'producto'):
+            op.alter_column(tabla, 'cambio', server_default='1')
+        op.execute("DROP SEQUENCE cambio_seq")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE SEQUENCE cambio_seq")
+        op.execute("SELECT setval('cambio_seq', (SELECT valor FROM contador_cambio))")
+        for tabla in ('categoria', 'producto'):
+            op.alter_column(tabla, 'cambio', server_default=sa.text("nextval('cambio_seq')"))
+    op.drop_table('contador_cambio')
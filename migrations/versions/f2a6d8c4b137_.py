@@ -0,0 +1,43 @@
+"""resumen_faceta: product counts per category and price range
+
+Revision ID: f2a6d8c4b137
+Revises: c4d8e2f6a913
+Create Date: 2026-10-18 21:34:12.905317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6d8c4b137'
+down_revision = 'c4d8e2f6a913'
+branch_labels = None
+depends_on = None
+
+#mismo ancho que facetas.RANGO_PRECIO al crear el resumen
+RANGO_PRECIO = 100
+
+
+def upgrade():
+    op.create_table('resumen_faceta',
+    sa.Column('faceta', sa.String(length=20), nullable=False),
+    sa.Column('valor', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('cantidad', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('faceta', 'valor')
+    )
+    #el resumen parte de los productos que ya existen, despues lo ajustan las escrituras
+    rango = f"precio - ((precio % {RANGO_PRECIO}) + {RANGO_PRECIO}) % {RANGO_PRECIO}"
+    op.execute(
+        "INSERT INTO resumen_faceta (faceta, valor, cantidad) "
+        "SELECT 'categoria', COALESCE(categoria_id, 0), COUNT(*) FROM producto "
+        "GROUP BY COALESCE(categoria_id, 0)"
+    )
+    op.execute(
+        "INSERT INTO resumen_faceta (faceta, valor, cantidad) "
+        f"SELECT 'precio', {rango}, COUNT(*) FROM producto GROUP BY {rango}"
+    )
+
+
+def downgrade():
+    op.drop_table('resumen_faceta')
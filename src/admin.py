@@ -1,18 +1,234 @@
+"""
+Admin de Flask-Admin con vistas que escalan a tablas grandes.
+
+ModelView cuenta la tabla con COUNT(*) en cada pagina y permite ordenar y
+buscar por cualquier columna. ScalableModelView:
+- sin busqueda ni filtros cuenta solo hasta ADMIN_ESTIMATED_COUNT_THRESHOLD
+  filas (COUNT sobre un LIMIT); si la tabla supera ese tamano usa el conteo
+  estimado de la base (pg_class.reltuples en PostgreSQL, information_schema
+  en MySQL, MAX(rowid) en SQLite) y el paginador solo tiene anterior y siguiente
+- ordena y busca solo por columnas con indice; la busqueda es por prefijo
+- pagina por llave (cursor con la ultima fila vista) al ir a la pagina
+  siguiente, asi las paginas profundas no hacen OFFSET
+"""
 import os
+from flask import g
 from flask_admin import Admin
-from models import db, User, Categoria, Producto
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import String, and_, func, or_, text, tuple_
+from models import db, User, Categoria, Producto
+from utils import APIException, decode_cursor, encode_cursor
+
+#mayor que cualquier caracter que siga al prefijo buscado
+FIN_PREFIJO = "\uffff"
+
+CONTEO_ESTIMADO = {
+    "postgresql": "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:tabla)",
+    "mysql": (
+        "SELECT table_rows FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = :tabla"
+    ),
+}
+
+
+def columnas_indexadas(modelo):
+    """columnas que encabezan un indice (llave primaria, unique, index o compuesto)"""
+    tabla = modelo.__table__
+    nombres = [columna.key for columna in tabla.primary_key.columns]
+    nombres.extend(columna.key for columna in tabla.columns if columna.index or columna.unique)
+    nombres.extend(list(indice.columns)[0].key for indice in tabla.indexes)
+    return tuple(dict.fromkeys(nombres))
+
+
+class ScalableModelView(ModelView):
+    list_template = 'admin/model/scalable_list.html'
+    page_size = 50
+    column_default_sort = 'id'
+    #la version y el numero de cambio los maneja el ORM al guardar
+    form_excluded_columns = ('version', 'updated_at', 'cambio', 'ruta')
+    #filas a partir de las cuales se usa el conteo estimado
+    estimated_count_threshold = 10000
+
+    def __init__(self, model, session, **kwargs):
+        indexadas = columnas_indexadas(model)
+        if self.column_sortable_list is None:
+            self.column_sortable_list = indexadas
+        if self.column_searchable_list is None:
+            self.column_searchable_list = [
+                nombre for nombre in indexadas if isinstance(model.__table__.c[nombre].type, String)
+            ]
+        ModelView.__init__(self, model, session, **kwargs)
+
+    def normalize_search(self, termino):
+        """texto buscado tal como se guarda en la base"""
+        return termino
+
+    def estimated_count(self):
+        """filas aproximadas de la tabla segun la base, o None si el dialecto no lo permite"""
+        tabla = self.model.__table__
+        dialecto = self.session.get_bind().dialect.name
+        if dialecto == "sqlite":
+            #con ids autoincrementales el mayor rowid se acerca al total y usa la llave primaria
+            return self.session.query(func.max(text("rowid"))).select_from(tabla).scalar() or 0
+        if dialecto not in CONTEO_ESTIMADO:
+            return None
+        estimado = self.session.execute(text(CONTEO_ESTIMADO[dialecto]), {"tabla": tabla.name}).scalar()
+        #PostgreSQL devuelve -1 si la tabla nunca se analizo
+        return estimado if estimado is not None and estimado >= 0 else None
+
+    def bounded_count(self):
+        """filas de la tabla contadas hasta estimated_count_threshold + 1"""
+        llave = getattr(self.model, self._primary_key)
+        filas = self.session.query(llave).limit(self.estimated_count_threshold + 1).subquery()
+        return self.session.query(func.count()).select_from(filas).scalar()
+
+    def estimated_total(self):
+        return g.get("admin_estimado")
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        g.admin_estimado = g.admin_conteo = None
+        if not search and not filters:
+            #por debajo del umbral el conteo acotado es el total, asi el estimado
+            #solo se consulta para las tablas grandes
+            conteo = self.bounded_count()
+            if conteo <= self.estimated_count_threshold:
+                g.admin_conteo = conteo
+            else:
+                g.admin_estimado = self.estimated_count()
+        count, data = ModelView.get_list(
+            self, page, sort_column, sort_desc, search, filters, execute=execute, page_size=page_size
+        )
+        return (count if g.admin_conteo is None else g.admin_conteo), data
+
+    def get_count_query(self):
+        #ya contado o estimado: Flask-Admin no cuenta (con el estimado usa el paginador simple)
+        if g.get("admin_conteo") is not None or g.get("admin_estimado") is not None:
+            return None
+        return ModelView.get_count_query(self)
+
+    def _get_list_extra_args(self):
+        view_args = ModelView._get_list_extra_args(self)
+        #el cursor vale solo para la pagina pedida, no se arrastra a los demas enlaces
+        g.admin_cursor = view_args.extra_args.pop("cursor", None)
+        return view_args
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        termino = self.normalize_search(search.strip())
+        if not termino:
+            return query, count_query, joins, count_joins
+        #rango en vez de LIKE 'termino%': usa el indice en cualquier dialecto y collation
+        condicion = or_(*[
+            and_(campo >= termino, campo < termino + FIN_PREFIJO) for campo, _ in self._search_fields
+        ])
+        query = query.filter(condicion)
+        if count_query is not None:
+            count_query = count_query.filter(condicion)
+        return query, count_query, joins, count_joins
+
+    def _keyset_column(self, sort_column, sort_desc):
+        """(nombre, columna, descendente) del orden si admite paginar por llave, o None"""
+        if sort_column is None:
+            orden = next(iter(self._get_default_order()), None)
+            if orden is None or orden[1]:
+                return None
+            columna, _, descendente = orden
+            nombre = columna.key
+        else:
+            columna = self._sortable_columns.get(sort_column)
+            if columna is None or isinstance(columna, list) or self._sortable_joins.get(sort_column):
+                return None
+            nombre, descendente = sort_column, bool(sort_desc)
+        tabla = self.model.__table__
+        #con NULL la comparacion por llave se saltaria filas
+        if columna.key not in tabla.c or tabla.c[columna.key].nullable:
+            return None
+        return f"{nombre}:{'desc' if descendente else 'asc'}", getattr(self.model, columna.key), descendente
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        query, joins = ModelView._apply_sorting(self, query, joins, sort_column, sort_desc)
+        llave = getattr(self.model, self._primary_key)
+        orden = self._keyset_column(sort_column, sort_desc)
+        if orden is not None and orden[1].key != llave.key:
+            #el id desempata filas con el mismo valor y completa la llave del cursor
+            query = query.order_by(llave.desc() if orden[2] else llave.asc())
+        g.admin_orden = orden
+        return query, joins
+
+    def _apply_pagination(self, query, page, page_size):
+        orden = g.get("admin_orden")
+        cursor = g.get("admin_cursor")
+        if orden is None or not cursor or not page:
+            return ModelView._apply_pagination(self, query, page, page_size)
+        nombre, columna, descendente = orden
+        try:
+            valor, ultimo_id = decode_cursor(cursor, nombre, columna)
+        except APIException:
+            #cursor de otro orden o alterado: se vuelve a OFFSET
+            return ModelView._apply_pagination(self, query, page, page_size)
+        llave = getattr(self.model, self._primary_key)
+        if columna.key == llave.key:
+            clave, ultima = llave, ultimo_id
+        else:
+            clave, ultima = tuple_(columna, llave), tuple_(valor, ultimo_id)
+        query = query.filter(clave < ultima if descendente else clave > ultima)
+        return query.limit(page_size or self.page_size)
+
+    def keyset_url(self, url, data):
+        """url de la pagina siguiente con el cursor de la ultima fila, si el orden lo permite"""
+        orden = g.get("admin_orden")
+        if orden is None or not data:
+            return url
+        nombre, columna, _ = orden
+        ultima = data[-1]
+        cursor = encode_cursor(nombre, getattr(ultima, columna.key), getattr(ultima, self._primary_key))
+        return f"{url}{'&' if '?' in url else '?'}cursor={cursor}"
+
+
+def normalizar_nombre(termino):
+    #titulos y nombres se guardan con la primera letra en mayuscula
+    return termino.lower().capitalize()
+
+
+class UserView(ScalableModelView):
+    def normalize_search(self, termino):
+        return termino.lower()
+
+
+class CategoriaView(ScalableModelView):
+    #el formulario no carga todos los productos de la categoria
+    #la ruta se arma con padre_id desde la API (PUT /categorias/<id>)
+    form_excluded_columns = ('productos', 'version', 'updated_at', 'cambio', 'ruta')
+
+    def normalize_search(self, termino):
+        return normalizar_nombre(termino)
+
+
+class ProductoView(ScalableModelView):
+    #con la relacion en la lista Flask-Admin la carga con joinedload en la misma consulta
+    column_list = ('titulo', 'descripcion', 'precio', 'imagen', 'categoria')
+    column_formatters = {
+        'categoria': lambda view, context, model, name: model.categoria.nombre if model.categoria else ''
+    }
+    form_ajax_refs = {
+        'categoria': {'fields': ('nombre',), 'page_size': 10}
+    }
+
+    def normalize_search(self, termino):
+        return normalizar_nombre(termino)
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
+    ScalableModelView.estimated_count_threshold = app.config.get('ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Categoria, db.session))
-    admin.add_view(ModelView(Producto, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CategoriaView(Categoria, db.session))
+    admin.add_view(ProductoView(Producto, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ScalableModelView(YourModelName, db.session))
+    return admin
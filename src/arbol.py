@@ -0,0 +1,163 @@
+"""
+Arbol de categorias con ruta materializada.
+
+Cada categoria guarda en ruta los ids de sus ancestros desde la raiz, con
+ANCHO_SEGMENTO digitos cada uno (las raices tienen ruta vacia). Los
+descendientes de una categoria son las filas cuya ruta empieza con la ruta de
+la categoria mas su propio segmento; como la ruta solo tiene digitos ese
+prefijo es el rango [prefijo, prefijo + 1) en cualquier collation y usa el
+indice de ruta. Los ancestros se leen de la misma ruta por llave primaria, y
+mover una rama es un UPDATE de la categoria mas un solo UPDATE que reemplaza
+el prefijo de la ruta de todos sus descendientes.
+"""
+from sqlalchemy import and_, case, event, exists, literal, or_, select
+from models import db, bloquear_escritura, Categoria, Producto
+from utils import APIException
+
+ANCHO_SEGMENTO = 10
+MAX_LARGO_RUTA = Categoria.__table__.c.ruta.type.length
+
+def segmento(categoria_id):
+    return str(categoria_id).zfill(ANCHO_SEGMENTO)
+
+def ids_en_ruta(ruta):
+    """ids de los ancestros de la ruta, de la raiz al padre"""
+    return [int(ruta[inicio:inicio + ANCHO_SEGMENTO]) for inicio in range(0, len(ruta), ANCHO_SEGMENTO)]
+
+def ruta_de_hijos(categoria):
+    """ruta que tienen los hijos de la categoria (una fila con id y ruta)"""
+    return categoria.ruta + segmento(categoria.id)
+
+def descendientes_de(columna_ruta, categoria):
+    """condicion de las filas que estan debajo de la categoria, sin incluirla"""
+    prefijo = ruta_de_hijos(categoria)
+    siguiente = str(int(prefijo) + 1).zfill(len(prefijo))
+    return and_(columna_ruta >= prefijo, columna_ruta < siguiente)
+
+def en_rama(categoria):
+    """condicion de la categoria y sus descendientes"""
+    return or_(Categoria.id == categoria.id, descendientes_de(Categoria.ruta, categoria))
+
+def productos_en_rama(categoria):
+    """condicion de los productos de la categoria o de cualquiera de sus descendientes"""
+    return Producto.categoria_id.in_(select([Categoria.id]).where(en_rama(categoria)))
+
+def ubicar(sesion, categoria_id):
+    """(id, ruta) de la categoria, o None si no existe"""
+    return sesion.query(Categoria.id, Categoria.ruta).filter(Categoria.id == categoria_id).first()
+
+def leer_padre_id(insumo):
+    """padre_id del insumo: None (raiz) o el id de la categoria padre"""
+    padre_id = insumo.get("padre_id")
+    if padre_id is not None and (isinstance(padre_id, bool) or not isinstance(padre_id, int)):
+        raise APIException("padre_id debe ser un numero entero o null")
+    return padre_id
+
+def ruta_bajo(sesion, padre_id):
+    """ruta de una categoria nueva o movida bajo padre_id (None es la raiz)"""
+    if padre_id is None:
+        return ""
+    padre = ubicar(sesion, padre_id)
+    if padre is None:
+        raise APIException("La categoria padre no existe")
+    ruta = ruta_de_hijos(padre)
+    if len(ruta) > MAX_LARGO_RUTA:
+        raise APIException("La categoria padre ya esta en el nivel maximo")
+    return ruta
+
+def bloquear_para_mover(sesion, categoria_id, padre_id):
+    """
+        (id, ruta) de la categoria que se mueve bajo padre_id, o None si no existe. Bloquea
+        (FOR UPDATE, en orden de id) su fila, la del padre nuevo y las de los ancestros del
+        padre: dos movimientos que juntos armarian un ciclo comparten una de esas filas, asi
+        el segundo espera y valida con las rutas que dejo el primero. Si el padre se movio
+        antes de tomar el lock se vuelve a leer su ruta
+    """
+    if not str(categoria_id).isdigit():
+        return None
+    tabla = Categoria.__table__
+    bloquear_escritura(sesion.connection())
+    ruta_padre = ""
+    while True:
+        ids = {int(categoria_id)}
+        if padre_id is not None:
+            ids.update([padre_id] + ids_en_ruta(ruta_padre))
+        filas = {
+            fila.id: fila for fila in sesion.execute(
+                select([tabla.c.id, tabla.c.ruta]).where(tabla.c.id.in_(ids))
+                .order_by(tabla.c.id).with_for_update()
+            )
+        }
+        padre = filas.get(padre_id)
+        if padre is None or padre.ruta == ruta_padre:
+            return filas.get(int(categoria_id))
+        ruta_padre = padre.ruta
+
+def ruta_para_mover(sesion, categoria, padre_id):
+    """ruta de la categoria (id, ruta) al moverla bajo padre_id, validando que la rama quepa"""
+    nueva_ruta = ruta_bajo(sesion, padre_id)
+    if padre_id is not None and (
+        padre_id == categoria.id or nueva_ruta.startswith(ruta_de_hijos(categoria))
+    ):
+        raise APIException("Una categoria no se puede mover debajo de si misma")
+    if len(nueva_ruta) > len(categoria.ruta):
+        #la rama no puede pasar del largo de la columna
+        mas_larga = sesion.query(db.func.max(db.func.length(Categoria.ruta))).filter(
+            descendientes_de(Categoria.ruta, categoria)
+        ).scalar() or len(categoria.ruta)
+        if mas_larga - len(categoria.ruta) + len(nueva_ruta) > MAX_LARGO_RUTA:
+            raise APIException("La rama quedaria mas profunda que el nivel maximo")
+    return nueva_ruta
+
+def mover_descendientes(conexion, categoria, ruta_hijos, valores_hijos=None):
+    """
+        cambia con un solo UPDATE el prefijo de la ruta de todos los descendientes de la
+        categoria (id y ruta anteriores) para que sus hijos queden con ruta_hijos;
+        valores_hijos se asignan ademas a los hijos directos
+    """
+    tabla = Categoria.__table__
+    largo = len(ruta_de_hijos(categoria))
+    valores = {
+        "ruta": literal(ruta_hijos) + db.func.substr(tabla.c.ruta, largo + 1),
+        "version": tabla.c.version + 1,
+    }
+    for columna, valor in (valores_hijos or {}).items():
+        valores[columna] = case([(db.func.length(tabla.c.ruta) == largo, valor)], else_=tabla.c[columna])
+    conexion.execute(tabla.update().where(descendientes_de(tabla.c.ruta, categoria)).values(valores))
+
+def tiene_hijos():
+    """columna tiene_hijos de la categoria, para leerla en la misma sentencia que la categoria"""
+    hija = Categoria.__table__.alias("hija")
+    return exists().where(hija.c.padre_id == Categoria.__table__.c.id).label("tiene_hijos")
+
+def subir_hijos(conexion, categoria):
+    """despues de borrar la categoria (id, ruta, padre_id) sus hijos pasan a su padre"""
+    mover_descendientes(conexion, categoria, categoria.ruta, {"padre_id": categoria.padre_id})
+
+def ancestros(sesion, categoria):
+    """categorias de la raiz al padre de la categoria, en una consulta por llave primaria"""
+    ids = ids_en_ruta(categoria.ruta)
+    if not ids:
+        return []
+    por_id = {
+        fila.id: fila for fila in
+        sesion.query(*Categoria.columnas_serializadas()).filter(Categoria.id.in_(ids))
+    }
+    return [por_id[categoria_id] for categoria_id in ids if categoria_id in por_id]
+
+def descendientes(sesion, categoria):
+    """
+        categorias debajo de la categoria en una consulta por el indice de ruta, en orden
+        de ruta: cada categoria seguida de su rama (en profundidad)
+    """
+    return (
+        sesion.query(*Categoria.columnas_serializadas())
+        .filter(descendientes_de(Categoria.ruta, categoria))
+        .order_by(Categoria.ruta, Categoria.id)
+        .all()
+    )
+
+#el admin borra por el ORM: los hijos tambien pasan al padre de la categoria borrada
+@event.listens_for(Categoria, "after_delete")
+def subir_hijos_orm(mapper, connection, target):
+    subir_hijos(connection, target)
@@ -0,0 +1,263 @@
+"""
+Modo ASGI opcional de la API del catalogo:
+
+    uvicorn asgi:application --app-dir src
+
+Sirve GET/POST /categorias, GET/POST /productos y POST /users/register con
+los mismos contratos que main.py, pero con sesiones asincronicas de
+SQLAlchemy (asyncpg, aiomysql o aiosqlite segun la base): mientras una
+consulta espera a la base el proceso atiende otros requests en vez de tener
+un hilo bloqueado. Las consultas, validaciones y serializaciones son las de
+catalogo.py y models.py; corren con AsyncSession.run_sync, donde cada viaje a
+la base se espera sin bloquear el event loop.
+
+No tiene cache de respuestas, replicas de lectura, admin ni metricas; con
+CACHE_BACKEND=redis las altas invalidan el cache que comparte con los
+workers WSGI. El resto de las rutas sigue en la app WSGI (gunicorn wsgi).
+Necesita SQLAlchemy 1.4+, starlette, uvicorn y el driver de la base, que son
+opcionales (categoria asgi del Pipfile):
+
+    pipenv install --categories "packages asgi"
+
+Se importan al crear la app, asi el resto del proyecto no depende de ellos.
+"""
+import contextlib
+import logging
+import os
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+#las altas de productos ajustan el resumen de facetas con los eventos del ORM
+import facetas
+from arbol import ids_en_ruta
+from cache import RedisBackend
+from catalogo import (
+    categoria_de_insumo, leer_productos, listar_categorias, listar_productos, resultado_por_ids
+)
+from fast_json import dumps
+from models import Categoria, Producto, User
+from pool import activar_llaves_foraneas
+from utils import APIException, get_fields, get_ids
+
+logger = logging.getLogger("shopfix.asgi")
+
+#driver asincronico de cada base de DB_CONNECTION_STRING
+DRIVERS_ASINCRONICOS = {
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def configuracion(config=None):
+    """variables de entorno de la app ASGI, con los mismos nombres que create_app()"""
+    resultado = {
+        #ASYNC_DB_CONNECTION_STRING si el driver asincronico no es el de la tabla de arriba
+        'ASYNC_DB_CONNECTION_STRING': os.environ.get('ASYNC_DB_CONNECTION_STRING'),
+        'DB_CONNECTION_STRING': os.environ.get('DB_CONNECTION_STRING'),
+        'DB_POOL_SIZE': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'DB_MAX_OVERFLOW': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'DB_POOL_TIMEOUT': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'DB_POOL_RECYCLE': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'DB_POOL_PRE_PING': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+        'DB_STATEMENT_TIMEOUT_MS': int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0)),
+        'CACHE_BACKEND': os.environ.get('CACHE_BACKEND', 'memory'),
+        'CACHE_TTL': int(os.environ.get('CACHE_TTL', 60)),
+        'CACHE_REDIS_URL': os.environ.get('CACHE_REDIS_URL'),
+        #con replicas en la app WSGI las invalidaciones se recuerdan esta ventana (ver cache.py)
+        'DB_REPLICA_CONNECTION_STRINGS': os.environ.get('DB_REPLICA_CONNECTION_STRINGS', ''),
+        'DB_REPLICA_STICKY_SECONDS': int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5)),
+        'COMPRESS_MIN_SIZE': int(os.environ.get('COMPRESS_MIN_SIZE', 500)),
+        'COMPRESS_LEVEL': int(os.environ.get('COMPRESS_LEVEL', 6)),
+        'MULTI_GET_MAX_IDS': int(os.environ.get('MULTI_GET_MAX_IDS', 100)),
+    }
+    resultado.update(config or {})
+    return resultado
+
+def url_asincronica(config):
+    """url de la base con su driver asincronico"""
+    if config['ASYNC_DB_CONNECTION_STRING']:
+        return make_url(config['ASYNC_DB_CONNECTION_STRING'])
+    sa_url = make_url(config['DB_CONNECTION_STRING'])
+    return sa_url.set(drivername=DRIVERS_ASINCRONICOS[sa_url.get_backend_name()])
+
+def crear_engine(config):
+    """engine asincronico con el mismo pool y limite por sentencia que el de la app WSGI"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    sa_url = url_asincronica(config)
+    #tambien en SQLite: cada conexion de aiosqlite es un hilo, no se abre una por request
+    opciones = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_pre_ping": config['DB_POOL_PRE_PING'],
+        "pool_size": config['DB_POOL_SIZE'],
+        "max_overflow": config['DB_MAX_OVERFLOW'],
+        "pool_timeout": config['DB_POOL_TIMEOUT'],
+        "pool_recycle": config['DB_POOL_RECYCLE'],
+    }
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and sa_url.get_backend_name() == "postgresql":
+        opciones["connect_args"] = {"server_settings": {"statement_timeout": str(int(timeout))}}
+    engine = create_async_engine(sa_url, **opciones)
+    if sa_url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", activar_llaves_foraneas)
+    return engine
+
+def respuesta(cuerpo, status=200):
+    from starlette.responses import Response
+    return Response(dumps(cuerpo), status_code=status, media_type="application/json")
+
+async def error_de_uso(request, error):
+    return respuesta(error.to_dict(), error.status_code)
+
+async def en_sesion(request, funcion, *args):
+    """resultado de funcion(sesion, *args), corrida con una sesion nueva"""
+    async with request.app.state.sesiones() as sesion:
+        return await sesion.run_sync(funcion, *args)
+
+async def leer_insumo(request):
+    """cuerpo JSON del request, None si no viene o no es JSON (como request.json en Flask)"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def alta(request, funcion):
+    """
+        corre el alta funcion(sesion, insumo), que devuelve (cuerpo, status, etiquetas),
+        e invalida esas etiquetas en el cache compartido
+    """
+    from starlette.concurrency import run_in_threadpool
+    cuerpo, status, etiquetas = await en_sesion(request, funcion, await leer_insumo(request))
+    cache = request.app.state.cache
+    if etiquetas and cache is not None:
+        #redis es sincronico, no se bloquea el event loop
+        await run_in_threadpool(cache.invalidate, etiquetas)
+    return respuesta(cuerpo, status)
+
+def guardar(sesion, objeto):
+    """agrega y confirma el objeto; devuelve el cuerpo del error 500 si falla"""
+    sesion.add(objeto)
+    try:
+        sesion.commit()
+    except Exception as error:
+        sesion.rollback()
+        logger.exception("No se pudo guardar %r", objeto)
+        return {"resultado": f"{error.args}"}
+    return None
+
+def crear_categoria(sesion, insumo):
+    error = Categoria.validar_insumo(insumo)
+    if error is not None:
+        return {"resultado": error}, 400, ()
+    #con padre_id la categoria se crea debajo de esa categoria, sin el queda como raiz
+    categoria = categoria_de_insumo(sesion, insumo)
+    error = guardar(sesion, categoria)
+    if error is not None:
+        return error, 500, ()
+    #las subcategorias de sus ancestros cambian
+    etiquetas = ["categorias"] + [f"categoria:{ancestro}" for ancestro in ids_en_ruta(categoria.ruta)]
+    return categoria.serializar(0), 201, etiquetas
+
+def crear_producto(sesion, insumo):
+    error = Producto.validar_insumo(insumo)
+    if error is not None:
+        return {"resultado": error}, 400, ()
+    producto = Producto.registrar_producto(
+        insumo["titulo"],
+        insumo["descripcion"],
+        insumo["precio"],
+        insumo["imagen"],
+        insumo["categoria_id"]
+    )
+    error = guardar(sesion, producto)
+    if error is not None:
+        return error, 500, ()
+    #los conteos de productos de las categorias tambien cambian
+    return producto.serialize(), 201, ["productos", "categorias", f"categoria:{producto.categoria_id}"]
+
+def registrar_usuario(sesion, insumo):
+    error = User.validar_insumo(insumo)
+    if error is not None:
+        return {"resultado": error}, 400, ()
+    usuario = User.registro_usuario(insumo["email"], insumo["password"])
+    error = guardar(sesion, usuario)
+    if error is not None:
+        return error, 500, ()
+    return usuario.serialize(), 201, ()
+
+def productos_por_ids(sesion, ids, campos):
+    """GET /productos?ids= sin cache de respuestas: todos los ids con un solo IN"""
+    filas = leer_productos(sesion, ids)
+    por_id = {fila.id: serializado for fila, serializado in zip(filas, Producto.serializar_filas(filas))}
+    return resultado_por_ids(ids, por_id, campos)
+
+async def categorias(request):
+    if request.method == "GET":
+        return respuesta(await en_sesion(request, listar_categorias, request.query_params))
+    return await alta(request, crear_categoria)
+
+async def productos(request):
+    if request.method == "GET":
+        args = request.query_params
+        #con ids= se devuelven esos productos en vez de una pagina del listado
+        if "ids" in args:
+            campos = get_fields(args, Producto.CAMPOS_SERIALIZADOS)
+            ids = get_ids(args["ids"], request.app.state.config['MULTI_GET_MAX_IDS'])
+            return respuesta(await en_sesion(request, productos_por_ids, ids, campos))
+        return respuesta(await en_sesion(request, listar_productos, args))
+    return await alta(request, crear_producto)
+
+async def usuarios(request):
+    return await alta(request, registrar_usuario)
+
+def create_asgi_app(config=None):
+    """crea la app ASGI con la configuracion de las variables de entorno (config la sobreescribe)"""
+    try:
+        from sqlalchemy.ext.asyncio import AsyncSession
+        from starlette.applications import Starlette
+        from starlette.middleware import Middleware
+        from starlette.middleware.cors import CORSMiddleware
+        from starlette.middleware.gzip import GZipMiddleware
+        from starlette.routing import Route
+    except ImportError as error:
+        raise RuntimeError(
+            f"El modo ASGI necesita {error.name}: pipenv install --categories \"packages asgi\""
+        ) from error
+    config = configuracion(config)
+    engine = crear_engine(config)
+
+    @contextlib.asynccontextmanager
+    async def ciclo_de_vida(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/categorias', categorias, methods=['GET', 'POST']),
+            Route('/productos', productos, methods=['GET', 'POST']),
+            Route('/users/register', usuarios, methods=['POST']),
+        ],
+        middleware=[
+            Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+            Middleware(
+                GZipMiddleware, minimum_size=config['COMPRESS_MIN_SIZE'], compresslevel=config['COMPRESS_LEVEL']
+            ),
+        ],
+        exception_handlers={APIException: error_de_uso},
+        lifespan=ciclo_de_vida,
+    )
+    app.state.config = config
+    app.state.sesiones = sessionmaker(engine, class_=AsyncSession)
+    app.state.cache = None
+    if config['CACHE_BACKEND'] == 'redis':
+        ventana = config['DB_REPLICA_STICKY_SECONDS'] if config['DB_REPLICA_CONNECTION_STRINGS'].strip() else 0
+        app.state.cache = RedisBackend.from_url(config['CACHE_REDIS_URL'], config['CACHE_TTL'], ventana)
+    return app
+
+def __getattr__(nombre):
+    #uvicorn y gunicorn piden asgi:application, la app se crea en ese momento
+    if nombre == "application":
+        global application
+        application = create_asgi_app()
+        return application
+    raise AttributeError(nombre)
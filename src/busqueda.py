@@ -0,0 +1,103 @@
+"""
+Busqueda de texto completo de productos sobre titulo y descripcion.
+
+Cada dialecto usa su propio indice de texto:
+PostgreSQL un indice GIN sobre un tsvector, MySQL un indice FULLTEXT y
+SQLite una tabla FTS5 sincronizada con triggers. La migracion d3f9a6b2e871
+los crea con su propia copia congelada de este DDL; aqui se usa para las
+bases creadas con db.create_all().
+"""
+import re
+from sqlalchemy import DDL, bindparam, event, literal_column
+from sqlalchemy.sql import column, operators, table
+from sqlalchemy.sql.elements import BinaryExpression, ClauseList
+from models import db, Producto
+
+#el mismo texto de la expresion del indice, asi PostgreSQL puede usarlo
+VECTOR_POSTGRES = (
+    "setweight(to_tsvector('simple', titulo), 'A') || "
+    "setweight(to_tsvector('simple', descripcion), 'B')"
+)
+
+#la tabla FTS5 no se actualiza sola (content='producto'), la sincronizan estos triggers
+TRIGGERS_SQLITE = [
+    "CREATE TRIGGER producto_busqueda_ai AFTER INSERT ON producto BEGIN "
+    "INSERT INTO producto_busqueda(rowid, titulo, descripcion) "
+    "VALUES (new.id, new.titulo, new.descripcion); END",
+    "CREATE TRIGGER producto_busqueda_ad AFTER DELETE ON producto BEGIN "
+    "INSERT INTO producto_busqueda(producto_busqueda, rowid, titulo, descripcion) "
+    "VALUES ('delete', old.id, old.titulo, old.descripcion); END",
+    "CREATE TRIGGER producto_busqueda_au AFTER UPDATE OF titulo, descripcion ON producto BEGIN "
+    "INSERT INTO producto_busqueda(producto_busqueda, rowid, titulo, descripcion) "
+    "VALUES ('delete', old.id, old.titulo, old.descripcion); "
+    "INSERT INTO producto_busqueda(rowid, titulo, descripcion) "
+    "VALUES (new.id, new.titulo, new.descripcion); END",
+]
+
+DDL_POR_DIALECTO = {
+    "postgresql": [
+        f"CREATE INDEX ix_producto_busqueda ON producto USING GIN (({VECTOR_POSTGRES}))",
+    ],
+    "mysql": [
+        "CREATE FULLTEXT INDEX ix_producto_busqueda ON producto (titulo, descripcion)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE producto_busqueda USING fts5("
+        "titulo, descripcion, content='producto', content_rowid='id')",
+    ] + TRIGGERS_SQLITE,
+}
+
+for dialecto, sentencias in DDL_POR_DIALECTO.items():
+    for sentencia in sentencias:
+        event.listen(Producto.__table__, "after_create", DDL(sentencia).execute_if(dialect=dialecto))
+
+producto_busqueda = table("producto_busqueda", column("rowid"))
+
+MAX_TERMINOS = 10
+
+def terminos(texto):
+    """separa el texto en palabras, sin los operadores de cada motor de busqueda"""
+    return re.findall(r"\w+", texto.lower())[:MAX_TERMINOS]
+
+def buscar_productos(consulta, texto):
+    """
+        filtra la consulta de productos por los terminos del texto (todos deben
+        aparecer, el ultimo como prefijo) y la ordena por relevancia
+    """
+    palabras = terminos(texto)
+    dialecto = db.engine.dialect.name
+    if dialecto == "postgresql":
+        expresion = " & ".join(palabras[:-1] + [palabras[-1] + ":*"])
+        vector = literal_column(f"({VECTOR_POSTGRES})")
+        tsquery = db.func.to_tsquery(literal_column("'simple'"), expresion)
+        return (
+            consulta.filter(vector.op("@@")(tsquery))
+            .order_by(db.func.ts_rank(vector, tsquery).desc(), Producto.id)
+        )
+    if dialecto == "mysql":
+        expresion = " ".join(
+            [f"+{palabra}" for palabra in palabras[:-1]] + [f"+{palabras[-1]}*"]
+        )
+        relevancia = BinaryExpression(
+            ClauseList(Producto.titulo, Producto.descripcion, group=False),
+            bindparam("busqueda", expresion),
+            operator=operators.match_op
+        )
+        return consulta.filter(relevancia).order_by(relevancia.desc(), Producto.id)
+    if dialecto == "sqlite":
+        expresion = " ".join(
+            [f'"{palabra}"' for palabra in palabras[:-1]] + [f'"{palabras[-1]}"*']
+        )
+        return (
+            consulta.join(producto_busqueda, producto_busqueda.c.rowid == Producto.id)
+            .filter(literal_column("producto_busqueda").op("MATCH")(expresion))
+            #bm25 ordena de mas a menos relevante, el titulo pesa mas que la descripcion
+            .order_by(db.func.bm25(literal_column("producto_busqueda"), 10.0, 1.0), Producto.id)
+        )
+    #sin indice de texto se usa LIKE sobre cada termino
+    for palabra in palabras:
+        consulta = consulta.filter(
+            Producto.titulo.contains(palabra, autoescape=True) |
+            Producto.descripcion.contains(palabra, autoescape=True)
+        )
+    return consulta.order_by(Producto.id)
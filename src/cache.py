@@ -0,0 +1,367 @@
+"""
+Cache de respuestas GET con ETag fuerte, 304 y invalidacion por etiquetas.
+
+Si la app comprime respuestas (compression.py), cada entrada guarda tambien el
+cuerpo ya comprimido en cada codificacion, asi los aciertos no recomprimen.
+
+Cada respuesta cacheada se guarda con etiquetas (ej: "productos", "producto:5");
+los handlers de escritura invalidan solo las etiquetas que afectan, asi se borran
+exactamente las llaves que dependen del registro modificado.
+
+Con replicas de lectura (replicas.py) el cliente que acaba de escribir no lee
+del cache, y no se guardan respuestas leidas de una replica si alguna de sus
+etiquetas se invalido hace menos de DB_REPLICA_STICKY_SECONDS: la replica
+podria no tener todavia esa escritura.
+"""
+import base64
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask import current_app, g, request
+
+
+class LRUBackend:
+    """
+        backend en memoria del proceso, con maximo de entradas y TTL.
+        Cada worker tiene su propia copia: con varios workers usar RedisBackend.
+        invalidation_window son los segundos que se recuerda la invalidacion de cada etiqueta
+    """
+
+    def __init__(self, max_entries=1024, ttl=60, invalidation_window=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.invalidation_window = invalidation_window
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._invalidated = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _get(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return item[1]
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, keys):
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def generation(self):
+        return self._generation
+
+    def set(self, key, entry, tags, generation):
+        self.set_many([(key, entry, tags)], generation)
+
+    def set_many(self, items, generation):
+        with self._lock:
+            #si hubo una escritura mientras se generaba la respuesta no se guarda
+            if generation != self._generation:
+                return
+            for key, entry, tags in items:
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (time.monotonic() + self.ttl, entry, tags)
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            if self.invalidation_window:
+                now = time.monotonic()
+                self._invalidated = {
+                    tag: moment for tag, moment in self._invalidated.items()
+                    if now - moment < self.invalidation_window
+                }
+                self._invalidated.update(dict.fromkeys(tags, now))
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def invalidated_recently(self, tags):
+        """True si alguna de las etiquetas se invalido hace menos de invalidation_window"""
+        with self._lock:
+            now = time.monotonic()
+            return any(
+                now - self._invalidated[tag] < self.invalidation_window
+                for tag in tags if tag in self._invalidated
+            )
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+
+class RedisBackend:
+    """
+        backend compartido entre workers. Solo usa get/mget/set/incr/sadd/smembers/delete/expire/exists,
+        pipeline y watch, asi cualquier cliente compatible (ej: fakeredis en local) puede reemplazarlo.
+    """
+
+    def __init__(self, client, ttl=60, prefix="shopfix:cache:", invalidation_window=0):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.invalidation_window = invalidation_window
+
+    @classmethod
+    def from_url(cls, url, ttl=60, invalidation_window=0):
+        #redis es opcional, solo se importa si se configura este backend
+        import redis
+        return cls(redis.Redis.from_url(url), ttl, invalidation_window=invalidation_window)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.prefix + "respuesta:*"))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def get_many(self, keys):
+        #un solo viaje a redis para todas las llaves
+        raws = self.client.mget([self.prefix + key for key in keys])
+        return [None if raw is None else json.loads(raw) for raw in raws]
+
+    def generation(self):
+        return int(self.client.get(self.prefix + "generacion") or 0)
+
+    def set(self, key, entry, tags, generation):
+        self.set_many([(key, entry, tags)], generation)
+
+    def set_many(self, items, generation):
+        from redis.exceptions import WatchError
+        generation_key = self.prefix + "generacion"
+        with self.client.pipeline() as pipe:
+            try:
+                #WATCH de la generacion: un invalidate entre la lectura y el EXEC anula el MULTI
+                pipe.watch(generation_key)
+                if generation != int(pipe.get(generation_key) or 0):
+                    return
+                pipe.multi()
+                for key, entry, tags in items:
+                    pipe.set(self.prefix + key, json.dumps(entry), ex=self.ttl)
+                    for tag in tags:
+                        pipe.sadd(self.prefix + "tag:" + tag, self.prefix + key)
+                        pipe.expire(self.prefix + "tag:" + tag, self.ttl)
+                pipe.execute()
+            except WatchError:
+                #las respuestas son anteriores a la invalidacion, no se guardan
+                pass
+
+    def invalidate(self, tags):
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        pipe = self.client.pipeline()
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        keys = set().union(*pipe.execute())
+        pipe = self.client.pipeline()
+        pipe.incr(self.prefix + "generacion")
+        pipe.delete(*keys, *tag_keys)
+        if self.invalidation_window:
+            for tag in tags:
+                pipe.set(self.prefix + "invalidada:" + tag, 1, px=int(self.invalidation_window * 1000))
+        pipe.execute()
+
+    def invalidated_recently(self, tags):
+        """True si alguna de las etiquetas se invalido hace menos de invalidation_window"""
+        if not self.invalidation_window:
+            return False
+        return self.client.exists(*[self.prefix + "invalidada:" + tag for tag in tags]) > 0
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class ResponseCache:
+    """cache de respuestas GET con contadores de aciertos y fallos"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        ttl = app.config.get('CACHE_TTL', 60)
+        #con replicas una lectura puede no tener una escritura de hace menos que esto (ver store)
+        window = app.config.get('DB_REPLICA_STICKY_SECONDS', 5) if app.config.get('DB_REPLICA_CONNECTION_STRINGS') else 0
+        if backend == 'memory':
+            self.backend = LRUBackend(app.config.get('CACHE_MAX_ENTRIES', 1024), ttl, window)
+        elif backend == 'redis':
+            self.backend = RedisBackend.from_url(app.config['CACHE_REDIS_URL'], ttl, window)
+        elif backend == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"CACHE_BACKEND desconocido: {backend}")
+        app.extensions['response_cache'] = self
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entradas": len(self.backend) if self.backend is not None else 0
+        }
+
+    def prometheus(self):
+        """contadores del cache en formato Prometheus"""
+        return "\n".join([
+            "# HELP shopfix_cache_hits_total Respuestas servidas desde el cache.",
+            "# TYPE shopfix_cache_hits_total counter",
+            f"shopfix_cache_hits_total {self.hits}",
+            "# HELP shopfix_cache_misses_total Respuestas que no estaban en el cache.",
+            "# TYPE shopfix_cache_misses_total counter",
+            f"shopfix_cache_misses_total {self.misses}",
+        ])
+
+    def cached(self, *tags):
+        """
+            cachea el GET de la vista. Las etiquetas pueden usar los argumentos
+            de la ruta, ej: @response_cache.cached("producto:{producto_id}")
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                if request.method != 'GET' or self.backend is None:
+                    return view(**kwargs)
+                key = self.key(request.path, request.args.items(multi=True))
+                #quien acaba de escribir lee del primario: la entrada pudo llenarse desde una replica
+                #que todavia no tenia su escritura
+                entry = None if self.reads_own_writes() else self.backend.get(key)
+                self._count(entry is not None)
+                if entry is None:
+                    generation = self.backend.generation()
+                    response = current_app.make_response(view(**kwargs))
+                    if response.status_code != 200:
+                        return response
+                    entry = self.store(key, response, [tag.format(**kwargs) for tag in tags], generation)
+                return self._response(entry)
+            return wrapper
+        return decorator
+
+    def reads_own_writes(self):
+        """True si el request lee del primario por una escritura reciente del cliente (replicas.py)"""
+        replicas = current_app.extensions.get('read_replicas')
+        return replicas is not None and bool(replicas.replicas) and replicas.reads_own_writes()
+
+    def from_stale_replica(self, tags):
+        """
+            True si la respuesta se leyo de una replica y alguna de sus etiquetas se invalido
+            dentro de la ventana en que la replica puede no tener esa escritura
+        """
+        return g.get("replica") is not None and self.backend.invalidated_recently(tags)
+
+    def key(self, path, args=()):
+        """llave de la respuesta de un GET a path con los parametros args (pares nombre, valor)"""
+        return "respuesta:" + path + "?" + urlencode(sorted(args))
+
+    def get_many(self, keys):
+        """entradas cacheadas de las llaves (None las que no estan), en una sola lectura del backend"""
+        entries = self.backend.get_many(keys)
+        for entry in entries:
+            self._count(entry is not None)
+        return entries
+
+    def store(self, key, response, tags, generation):
+        """
+            guarda la respuesta 200 de una vista con sus etiquetas y devuelve la entrada;
+            generation es la del backend antes de leer los datos de la respuesta.
+            No se guarda lo leido de una replica que puede no tener una invalidacion reciente
+        """
+        entry = self._entry(response)
+        if not self.from_stale_replica(tags):
+            self.backend.set(key, entry, tags, generation)
+        return entry
+
+    def store_many(self, items, generation):
+        """guarda varias respuestas (llave, respuesta, etiquetas) en una sola escritura del backend"""
+        self.backend.set_many(
+            [
+                (key, self._entry(response), tags) for key, response, tags in items
+                if not self.from_stale_replica(tags)
+            ],
+            generation
+        )
+
+    def _entry(self, response):
+        body = response.get_data()
+        entry = {
+            "body": body.decode("utf-8"),
+            #el ETag de la vista (ej: representation_etag, que ya depende del cuerpo) o el hash del cuerpo
+            "etag": response.get_etag()[0] or hashlib.sha1(body).hexdigest(),
+            "mimetype": response.mimetype
+        }
+        compression = current_app.extensions.get('response_compression')
+        if compression is not None and compression.compressible(response.mimetype, len(body)):
+            #base64 para que la entrada siga siendo JSON en redis
+            entry["compressed"] = {
+                encoding: base64.b64encode(data).decode("ascii")
+                for encoding, data in compression.compress_all(body).items()
+            }
+        return entry
+
+    def _response(self, entry):
+        """respuesta desde una entrada del cache, en la codificacion que acepte el cliente"""
+        compression = current_app.extensions.get('response_compression')
+        encoding = None
+        if compression is not None and "compressed" in entry:
+            encoding = compression.negotiate()
+        if encoding in entry.get("compressed", ()):
+            response = current_app.response_class(
+                base64.b64decode(entry["compressed"][encoding]), mimetype=entry["mimetype"]
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            #cada codificacion es una representacion distinta, con su propio ETag
+            response.set_etag(f"{entry['etag']}-{encoding}")
+        else:
+            response = current_app.response_class(entry["body"], mimetype=entry["mimetype"])
+            response.set_etag(entry["etag"])
+        return response.make_conditional(request)
+
+    def invalidate(self, *tags):
+        """borra todas las respuestas cacheadas con alguna de las etiquetas"""
+        if self.backend is not None:
+            self.backend.invalidate(tags)
@@ -0,0 +1,128 @@
+"""
+Feed de cambios del catalogo para sincronizar clientes por diferencias
+(GET /changes?since=<token>).
+
+Categoria y Producto guardan el numero del ultimo cambio (cambio) y su fecha
+(updated_at); los borrados dejan una fila en Eliminacion. El feed recorre las
+tres tablas por el indice (cambio, id) desde el token, asi su costo depende de
+cuantas filas cambiaron y no del tamano del catalogo.
+
+Cada transaccion marca las filas que escribe con un numero negativo propio y,
+justo antes del commit, toma un solo numero de ContadorCambio y lo pone en esas
+filas (models.confirmar_cambios), con un UPDATE por tabla en la que escribio
+filas; si no escribio ninguna no toma el contador. El contador queda bloqueado solo durante ese
+paso y el commit, asi las transacciones se confirman en el orden de sus numeros
+y el feed entrega cambios hasta el valor del contador ya confirmado: una
+transaccion abierta no queda detras del token de un cliente. Las escrituras
+corren en paralelo hasta el commit; quien tiene el contador ya tiene todas sus
+filas, asi no hay esperas en orden inverso. bench/escrituras.py mide el costo.
+"""
+from sqlalchemy import event, tuple_
+from models import db, Categoria, Producto, Eliminacion, ContadorCambio
+from utils import APIException, decode_cursor, encode_cursor
+
+#orden de las tablas cuando comparten numero de cambio, debe ser estable entre versiones
+ORDEN_FUENTES = {"categoria": 0, "producto": 1, "eliminacion": 2}
+
+def registrar_eliminaciones(conexion, tipo, ids):
+    """inserta las filas de Eliminacion (tombstones) de los ids borrados de tipo"""
+    if ids:
+        conexion.execute(
+            Eliminacion.__table__.insert(), [{"tipo": tipo, "entidad_id": entidad_id} for entidad_id in ids]
+        )
+
+#los borrados por el ORM (ej: el admin) tambien dejan su registro
+@event.listens_for(Categoria, "after_delete")
+@event.listens_for(Producto, "after_delete")
+def registrar_eliminacion_orm(mapper, connection, target):
+    registrar_eliminaciones(connection, target.__tablename__, [target.id])
+
+def soltar_productos(conexion, categoria_id):
+    """
+        antes de borrar la categoria deja sus productos sin categoria con un UPDATE, asi
+        toman un numero de cambio y una version nueva; el ON DELETE SET NULL de la base
+        los cambiaria sin que aparezcan en el feed. Devuelve cuantos productos solto
+    """
+    tabla = Producto.__table__
+    return conexion.execute(
+        tabla.update().where(tabla.c.categoria_id == categoria_id)
+        .values(categoria_id=None, version=tabla.c.version + 1)
+    ).rowcount
+
+#el ORM solo actualiza los productos que tiene cargados, el resto queda para este UPDATE
+@event.listens_for(Categoria, "before_delete")
+def soltar_productos_orm(mapper, connection, target):
+    soltar_productos(connection, target.id)
+
+def decodificar_token(token):
+    """(cambio, orden, id) de la ultima fila entregada; sin token, antes del primer cambio"""
+    if not token:
+        return 0, -1, 0
+    try:
+        cambio, (orden, fila_id) = decode_cursor(token, "cambios")
+        return int(cambio), int(orden), int(fila_id)
+    except (APIException, TypeError, ValueError):
+        raise APIException("El parametro since no es valido")
+
+def despues_de(columna_cambio, columna_id, orden_fuente, ultimo):
+    """condicion (cambio, orden, id) > ultimo para las filas de una fuente"""
+    cambio, orden, fila_id = ultimo
+    if orden_fuente < orden:
+        return columna_cambio > cambio
+    if orden_fuente > orden:
+        return columna_cambio >= cambio
+    return tuple_(columna_cambio, columna_id) > tuple_(cambio, fila_id)
+
+def consultar_cambios(token, limit):
+    """
+        cambios posteriores al token, a lo sumo limit, en orden (cambio, tabla, id).
+        Devuelve {"resultados", "next_token", "has_more"}; con has_more el cliente
+        pide de nuevo con next_token enseguida, sin has_more cuando quiera volver a sincronizar
+    """
+    ultimo = decodificar_token(token)
+    #los numeros mayores son de transacciones que todavia no hicieron commit
+    confirmado = db.session.query(ContadorCambio.valor).filter(ContadorCambio.id == 1).scalar()
+    fuentes = [
+        ("categoria", Categoria, Categoria.columnas_serializadas()),
+        ("producto", Producto, Producto.columnas_serializadas()),
+    ]
+    filas = []
+    for tipo, modelo, columnas in fuentes:
+        orden = ORDEN_FUENTES[tipo]
+        consulta = (
+            db.session.query(modelo.cambio, *columnas)
+            .filter(despues_de(modelo.cambio, modelo.id, orden, ultimo), modelo.cambio <= confirmado)
+            .order_by(modelo.cambio, modelo.id)
+            .limit(limit + 1)
+        )
+        for fila in consulta:
+            datos = dict(zip(modelo.CAMPOS_SERIALIZADOS, fila[1:]))
+            filas.append(((fila.cambio, orden, fila.id), {
+                "tipo": tipo, "operacion": "upsert", "id": fila.id, "cambio": fila.cambio, "datos": datos
+            }))
+    orden = ORDEN_FUENTES["eliminacion"]
+    consulta = (
+        db.session.query(Eliminacion.cambio, Eliminacion.id, Eliminacion.tipo, Eliminacion.entidad_id)
+        .filter(
+            despues_de(Eliminacion.cambio, Eliminacion.id, orden, ultimo), Eliminacion.cambio <= confirmado
+        )
+        .order_by(Eliminacion.cambio, Eliminacion.id)
+        .limit(limit + 1)
+    )
+    for fila in consulta:
+        filas.append(((fila.cambio, orden, fila.id), {
+            "tipo": fila.tipo, "operacion": "delete", "id": fila.entidad_id, "cambio": fila.cambio
+        }))
+    filas.sort(key=lambda fila: fila[0])
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    if filas:
+        cambio, orden, fila_id = filas[-1][0]
+        next_token = encode_cursor("cambios", cambio, [orden, fila_id])
+    else:
+        next_token = token or encode_cursor("cambios", 0, [-1, 0])
+    return {
+        "resultados": [cambio for _, cambio in filas],
+        "next_token": next_token,
+        "has_more": has_more,
+    }
@@ -0,0 +1,124 @@
+"""
+Consultas y altas del catalogo que comparten la app WSGI (main.py) y la ASGI
+(asgi.py).
+
+Reciben la sesion como primer argumento: main.py pasa db.session y asgi.py
+la sesion sincronica de una AsyncSession (AsyncSession.run_sync), asi los
+filtros, la paginacion, las validaciones y la serializacion son las mismas en
+los dos modos y solo cambia como se espera a la base.
+"""
+import os
+from sqlalchemy import false
+from arbol import leer_padre_id, productos_en_rama, ruta_bajo, ubicar
+from models import Categoria, Producto
+from utils import get_fields, get_include, get_int_arg, paginate
+
+#maximo de productos embebidos por categoria con include=productos
+PRODUCTOS_POR_CATEGORIA = int(os.environ.get('PRODUCTOS_POR_CATEGORIA', 20))
+#campos que se pueden pedir con fields= en los GET de categorias
+CAMPOS_CATEGORIA = Categoria.CAMPOS_SERIALIZADOS + ("cantidad_productos",)
+
+def columnas_consulta(modelo, campos, ordenables, args):
+    """
+        columnas del SELECT para los campos pedidos con fields, mas el id y la
+        columna de orden que paginate necesita para armar el cursor
+    """
+    orden = (args.get("sort") or "id").lstrip("-")
+    extra = ("id", orden) if orden in ordenables else ("id",)
+    return modelo.columnas_serializadas(campos + extra)
+
+def filtros_producto(sesion, args):
+    """traduce productname, categoria_id, categoria_rama, precio_min y precio_max a condiciones WHERE"""
+    condiciones = []
+    name = args.get("productname")
+    if name:
+        #los titulos se guardan normalizados, asi el prefijo usa el indice de titulo
+        condiciones.append(
+            Producto.titulo.startswith(name.lower().capitalize(), autoescape=True)
+        )
+    categoria_id = get_int_arg(args, "categoria_id")
+    if categoria_id is not None:
+        condiciones.append(Producto.categoria_id == categoria_id)
+    #productos de la categoria o de cualquiera de sus subcategorias
+    rama_id = get_int_arg(args, "categoria_rama")
+    if rama_id is not None:
+        rama = ubicar(sesion, rama_id)
+        condiciones.append(productos_en_rama(rama) if rama is not None else false())
+    precio_min = get_int_arg(args, "precio_min")
+    if precio_min is not None:
+        condiciones.append(Producto.precio >= precio_min)
+    precio_max = get_int_arg(args, "precio_max")
+    if precio_max is not None:
+        condiciones.append(Producto.precio <= precio_max)
+    return condiciones
+
+def listar_categorias(sesion, args):
+    """pagina de categorias de GET /categorias (categoryname, include, fields, sort y paginacion)"""
+    #los productos solo se incluyen si se piden con include=productos
+    include = get_include(args, ["productos"])
+    campos = get_fields(args, CAMPOS_CATEGORIA)
+    ordenables = {"id": Categoria.id, "nombre": Categoria.nombre}
+    #Construir la consulta, solo con las columnas pedidas y filtrando en la base de datos
+    consulta = sesion.query(*columnas_consulta(Categoria, campos, ordenables, args))
+
+    #Validr si hay params en la url
+    name = args.get("categoryname")
+    if name:
+        #los nombres se guardan normalizados, asi el prefijo usa el indice unico de nombre
+        consulta = consulta.filter(
+            Categoria.nombre.startswith(name.lower().capitalize(), autoescape=True)
+        )
+    #devolver la pagina de categorias serializadas
+    return paginate(
+        consulta,
+        args,
+        ordenables,
+        Categoria.id,
+        lambda categorias: Categoria.serializar_lista(
+            categorias, "productos" in include, PRODUCTOS_POR_CATEGORIA, campos, sesion
+        )
+    )
+
+def listar_productos(sesion, args):
+    """pagina de productos de GET /productos (filtros, fields, sort y paginacion)"""
+    campos = get_fields(args, Producto.CAMPOS_SERIALIZADOS)
+    ordenables = {"id": Producto.id, "titulo": Producto.titulo, "precio": Producto.precio}
+    #Construir la consulta, solo con las columnas pedidas y filtrando en la base de datos
+    consulta = sesion.query(*columnas_consulta(Producto, campos, ordenables, args))
+
+    #Validr si hay params en la url
+    consulta = consulta.filter(*filtros_producto(sesion, args))
+    #devolver la pagina de productos serializados, por offset o por cursor
+    return paginate(
+        consulta,
+        args,
+        ordenables,
+        Producto.id,
+        lambda productos: Producto.serializar_filas(productos, campos)
+    )
+
+def leer_productos(sesion, ids):
+    """filas (columnas serializadas y version) de los productos con esos ids, con un solo IN"""
+    return sesion.query(*Producto.columnas_serializadas(), Producto.version).filter(Producto.id.in_(ids)).all()
+
+def resultado_por_ids(ids, por_id, campos):
+    """{"resultados", "no_encontrados"} en el orden de ids, con los productos serializados por_id"""
+    return {
+        "resultados": [
+            {campo: por_id[producto_id][campo] for campo in campos}
+            for producto_id in ids if producto_id in por_id
+        ],
+        "no_encontrados": [producto_id for producto_id in ids if producto_id not in por_id]
+    }
+
+def categoria_de_insumo(sesion, insumo):
+    """categoria del insumo (ya validado) sin agregar a la sesion, con su padre y ruta"""
+    categoria = Categoria.registrar_categoria(
+        insumo["nombre"],
+        insumo["descripcion"],
+        insumo["icono"]
+    )
+    #con padre_id la categoria se crea debajo de esa categoria, sin el queda como raiz
+    categoria.padre_id = leer_padre_id(insumo)
+    categoria.ruta = ruta_bajo(sesion, categoria.padre_id)
+    return categoria
@@ -0,0 +1,305 @@
+"""
+Comandos de consola del catalogo, ej: `flask catalog import productos.csv`
+"""
+import csv
+import functools
+import io
+import json
+import os
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+from models import db, cambio_pendiente, Categoria, Producto
+from facetas import reconstruir_resumen
+
+catalog_cli = AppGroup('catalog', help="Carga masiva del catalogo.")
+
+def setup_commands(app):
+    app.cli.add_command(catalog_cli)
+
+def leer_filas(archivo, formato):
+    """devuelve (numero_fila, fila) sin cargar el archivo en memoria, fila es None si no se puede leer"""
+    with open(archivo, newline="", encoding="utf-8") as entrada:
+        if formato == "csv":
+            for numero, fila in enumerate(csv.DictReader(entrada), 1):
+                yield numero, fila
+        else:
+            for numero, linea in enumerate(entrada, 1):
+                if not linea.strip():
+                    continue
+                try:
+                    fila = json.loads(linea)
+                except ValueError:
+                    fila = None
+                yield numero, fila if isinstance(fila, dict) else None
+
+def preparar_categoria(fila, categorias):
+    """devuelve (valores, error) con los valores normalizados de la fila"""
+    error = Categoria.validar_insumo(fila)
+    if error is not None:
+        return None, error
+    categoria = Categoria.registrar_categoria(fila["nombre"], fila["descripcion"], fila["icono"])
+    return {
+        "id": categorias.get(categoria.nombre),
+        "nombre": categoria.nombre,
+        "descripcion": categoria.descripcion,
+        "icono": categoria.icono
+    }, None
+
+def preparar_producto(fila, categorias, ids_categorias):
+    """
+        devuelve (valores, error) con los valores normalizados de la fila.
+        La categoria puede venir por nombre (columna categoria) o por categoria_id.
+    """
+    fila = dict(fila)
+    if fila.get("categoria") and not fila.get("categoria_id"):
+        categoria_id = categorias.get(str(fila["categoria"]).lower().capitalize())
+        if categoria_id is None:
+            return None, f"La categoria {fila['categoria']} no existe"
+        fila["categoria_id"] = categoria_id
+    #el CSV trae los numeros como texto, se convierten antes de validar los tipos
+    try:
+        for campo in ("precio", "categoria_id", "id"):
+            if fila.get(campo) not in (None, ""):
+                if isinstance(fila[campo], bool):
+                    raise ValueError(campo)
+                fila[campo] = int(fila[campo])
+    except (TypeError, ValueError):
+        return None, "precio, categoria_id e id deben ser numeros enteros"
+    error = Producto.validar_insumo(fila)
+    if error is not None:
+        return None, error
+    if fila["categoria_id"] not in ids_categorias:
+        return None, "La categoria no existe"
+    producto = Producto.registrar_producto(
+        fila["titulo"], fila["descripcion"], fila["precio"], fila["imagen"], fila["categoria_id"]
+    )
+    return {
+        "id": fila["id"] if fila.get("id") not in (None, "") else None,
+        "titulo": producto.titulo,
+        "descripcion": producto.descripcion,
+        "precio": producto.precio,
+        "imagen": producto.imagen,
+        "categoria_id": producto.categoria_id
+    }, None
+
+def insertar(tabla, filas):
+    """
+        inserta las filas usando la via rapida del dialecto:
+        COPY en PostgreSQL con psycopg2, un INSERT con VALUES multi-fila en MySQL
+        y SQLite, y executemany en el resto.
+    """
+    dialecto = db.engine.dialect
+    columnas = list(filas[0])
+    if dialecto.name == "postgresql" and dialecto.driver == "psycopg2":
+        #COPY no evalua los valores por defecto del modelo: el lote lleva la marca de la transaccion
+        cambio = cambio_pendiente(db.session.connection(), tabla)
+        ahora = datetime.utcnow()
+        filas = [dict(fila, cambio=cambio, updated_at=ahora) for fila in filas]
+        columnas = list(filas[0])
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        for fila in filas:
+            escritor.writerow(["\\N" if fila[c] is None else fila[c] for c in columnas])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {tabla.name} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    elif dialecto.name in ("mysql", "sqlite"):
+        db.session.execute(tabla.insert().values(filas))
+    else:
+        db.session.execute(tabla.insert(), filas)
+
+def actualizar(tabla, filas):
+    """actualiza por id con un executemany, incrementando la version de cada fila"""
+    columnas = [columna for columna in filas[0] if columna != "id"]
+    db.session.execute(
+        tabla.update()
+        .where(tabla.c.id == bindparam("_id"))
+        .values(dict({columna: bindparam(columna) for columna in columnas}, version=tabla.c.version + 1)),
+        [dict(fila, _id=fila["id"]) for fila in filas]
+    )
+
+def escribir_lote(tabla, lote, rechazar):
+    """
+        separa el lote en filas nuevas y existentes (upsert por id), lo escribe y hace commit.
+        Si el lote falla se reintenta fila por fila para rechazar solo las filas malas.
+        Devuelve las filas escritas.
+    """
+    existentes = set()
+    ids = [valores["id"] for _, valores in lote if valores["id"] is not None]
+    if ids:
+        existentes = {
+            fila_id for (fila_id,) in db.session.query(tabla.c.id).filter(tabla.c.id.in_(ids))
+        }
+
+    def escribir(filas):
+        nuevas = [valores for _, valores in filas if valores["id"] not in existentes]
+        #con id None la base de datos asigna el id
+        sin_id = [{k: v for k, v in valores.items() if k != "id"} for valores in nuevas if valores["id"] is None]
+        con_id = [valores for valores in nuevas if valores["id"] is not None]
+        actualizadas = [valores for _, valores in filas if valores["id"] in existentes]
+        if sin_id:
+            insertar(tabla, sin_id)
+        if con_id:
+            insertar(tabla, con_id)
+        if actualizadas:
+            actualizar(tabla, actualizadas)
+        db.session.commit()
+
+    try:
+        escribir(lote)
+        return [valores for _, valores in lote]
+    except Exception:
+        db.session.rollback()
+    escritas = []
+    for numero, valores in lote:
+        try:
+            escribir([(numero, valores)])
+            escritas.append(valores)
+        except Exception as error:
+            db.session.rollback()
+            rechazar(numero, valores, f"{error.args}")
+    return escritas
+
+@catalog_cli.command('import')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(['productos', 'categorias']), default='productos',
+              show_default=True, help="Tabla destino.")
+@click.option('--format', 'formato', type=click.Choice(['csv', 'ndjson']), default=None,
+              help="Por defecto se deduce de la extension del archivo.")
+@click.option('--batch-size', default=5000, show_default=True, help="Filas por lote y commit.")
+@click.option('--rejects', type=click.Path(dir_okay=False), default=None,
+              help="Archivo NDJSON con las filas rechazadas (por defecto <archivo>.rechazados.ndjson).")
+def importar_catalogo(archivo, kind, formato, batch_size, rejects):
+    """
+        Importa categorias o productos desde un CSV/NDJSON en streaming.
+
+        Las categorias se insertan o actualizan por nombre. Los productos pueden
+        indicar la categoria por nombre (columna categoria) o por categoria_id,
+        y se actualizan cuando traen un id que ya existe.
+    """
+    if formato is None:
+        formato = "ndjson" if archivo.endswith((".ndjson", ".jsonl")) else "csv"
+    if rejects is None:
+        rejects = archivo + ".rechazados.ndjson"
+    tabla = Categoria.__table__ if kind == "categorias" else Producto.__table__
+
+    #mapa nombre -> id de categorias, se construye una sola vez
+    categorias = dict(db.session.query(Categoria.nombre, Categoria.id))
+    ids_categorias = set(categorias.values())
+    #cada tipo recibe solo lo que usa: los productos tambien los ids para validar categoria_id
+    if kind == "categorias":
+        preparar = functools.partial(preparar_categoria, categorias=categorias)
+    else:
+        preparar = functools.partial(preparar_producto, categorias=categorias, ids_categorias=ids_categorias)
+    leidas = escritas = rechazadas = 0
+    ids_explicitos = False
+    categorias_afectadas = set()
+    productos_actualizados = set()
+    inicio = time.monotonic()
+
+    with open(rejects, "w", encoding="utf-8") as salida_rechazos:
+        def rechazar(numero, fila, error):
+            nonlocal rechazadas
+            rechazadas += 1
+            salida_rechazos.write(json.dumps({"fila": numero, "error": error, "datos": fila}) + "\n")
+
+        def procesar(lote):
+            nonlocal escritas, ids_explicitos
+            existian = {valores["id"] for _, valores in lote if valores["id"] is not None}
+            for valores in escribir_lote(tabla, lote, rechazar):
+                escritas += 1
+                if kind == "categorias":
+                    categorias_afectadas.add(valores["nombre"])
+                else:
+                    categorias_afectadas.add(valores["categoria_id"])
+                    if valores["id"] is not None:
+                        ids_explicitos = True
+                        if valores["id"] in existian:
+                            productos_actualizados.add(valores["id"])
+            if kind == "categorias":
+                #las categorias nuevas se agregan al mapa con una sola consulta por lote
+                nuevas = [valores["nombre"] for _, valores in lote if valores["id"] is None]
+                if nuevas:
+                    categorias.update(db.session.query(Categoria.nombre, Categoria.id)
+                                      .filter(Categoria.nombre.in_(nuevas)))
+                    ids_categorias.update(categorias.values())
+            transcurrido = time.monotonic() - inicio
+            click.echo(
+                f"{leidas} filas leidas, {escritas} escritas, {rechazadas} rechazadas "
+                f"({leidas / max(transcurrido, 1e-9):.0f} filas/s)"
+            )
+
+        lote = []
+        nombres_en_lote = {}
+        for numero, fila in leer_filas(archivo, formato):
+            leidas += 1
+            if fila is None:
+                rechazar(numero, None, "La fila no se pudo leer")
+                continue
+            valores, error = preparar(fila)
+            if error is not None:
+                rechazar(numero, fila, error)
+                continue
+            if kind == "categorias" and valores["id"] is None:
+                #una categoria nueva repetida en el lote se escribe una sola vez
+                if valores["nombre"] in nombres_en_lote:
+                    lote[nombres_en_lote[valores["nombre"]]] = (numero, valores)
+                    continue
+                nombres_en_lote[valores["nombre"]] = len(lote)
+            lote.append((numero, valores))
+            if len(lote) >= batch_size:
+                procesar(lote)
+                lote = []
+                nombres_en_lote = {}
+        if lote:
+            procesar(lote)
+
+    if ids_explicitos and db.engine.dialect.name == "postgresql":
+        #los ids explicitos no avanzan la secuencia de producto
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('producto', 'id'), "
+            "(SELECT COALESCE(MAX(id), 1) FROM producto))"
+        ))
+        db.session.commit()
+
+    if kind == "productos" and escritas:
+        #el import no ajusta el resumen por fila, se recalcula una vez al final
+        reconstruir_resumen(db.session)
+        db.session.commit()
+
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None and escritas:
+        if kind == "categorias":
+            etiquetas = [f"categoria:{categorias[nombre]}" for nombre in categorias_afectadas]
+        else:
+            etiquetas = [f"categoria:{categoria_id}" for categoria_id in categorias_afectadas]
+            etiquetas += [f"producto:{producto_id}" for producto_id in productos_actualizados]
+        response_cache.invalidate("productos", "categorias", *etiquetas)
+
+    transcurrido = time.monotonic() - inicio
+    click.echo(
+        f"Listo: {escritas} filas escritas y {rechazadas} rechazadas en {transcurrido:.1f}s "
+        f"({leidas / max(transcurrido, 1e-9):.0f} filas/s)"
+    )
+    if rechazadas:
+        click.echo(f"Filas rechazadas en {rejects}")
+    elif os.path.exists(rejects):
+        os.remove(rejects)
+
+@catalog_cli.command('rebuild-facets')
+def reconstruir_facetas():
+    """Recalcula el resumen de GET /productos/facets desde la tabla producto."""
+    inicio = time.monotonic()
+    reconstruir_resumen(db.session)
+    db.session.commit()
+    response_cache = current_app.extensions.get('response_cache')
+    if response_cache is not None:
+        response_cache.invalidate("productos")
+    click.echo(f"Resumen de facetas recalculado en {time.monotonic() - inicio:.1f}s")
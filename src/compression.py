@@ -0,0 +1,102 @@
+"""
+Compresion de respuestas gzip (y brotli si esta instalado) negociada con
+Accept-Encoding. brotli es opcional: pipenv install --categories "packages speedups"
+
+Las respuestas normales se comprimen al salir si superan COMPRESS_MIN_SIZE;
+las respuestas en streaming (ej: /productos/export) se comprimen por partes
+a medida que se generan. El cache de respuestas guarda los cuerpos ya
+comprimidos junto al ETag con compress_all(), asi un acierto no vuelve a
+comprimir.
+"""
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES_COMPRIMIBLES = {
+    "application/json", "application/x-ndjson", "text/csv", "text/html", "text/plain",
+}
+
+
+class ResponseCompression:
+    """negocia la codificacion y comprime las respuestas de la app"""
+
+    def __init__(self, app=None):
+        self.min_size = 500
+        self.level = 6
+        self.brotli_level = 5
+        self.encodings = ["gzip"]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.brotli_level = app.config.get('COMPRESS_BROTLI_LEVEL', 5)
+        #brotli comprime mas que gzip, si el cliente acepta ambos se prefiere
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        app.after_request(self.compress_response)
+        app.extensions['response_compression'] = self
+
+    def negotiate(self):
+        """codificacion a usar segun Accept-Encoding del request, o None"""
+        return request.accept_encodings.best_match(self.encodings)
+
+    def compressible(self, mimetype, size):
+        return mimetype in MIMETYPES_COMPRIMIBLES and size >= self.min_size
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_level)
+        return gzip.compress(data, compresslevel=self.level)
+
+    def compress_all(self, data):
+        """cuerpo comprimido en cada codificacion soportada, para guardarlo en el cache"""
+        return {encoding: self.compress(data, encoding) for encoding in self.encodings}
+
+    def compress_stream(self, chunks, encoding):
+        """comprime un iterable de partes sin juntarlo en memoria"""
+        if encoding == "br":
+            compresor = brotli.Compressor(quality=self.brotli_level)
+            procesar, terminar = compresor.process, compresor.finish
+        else:
+            #wbits 31: formato gzip
+            compresor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            procesar, terminar = compresor.compress, compresor.flush
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            datos = procesar(chunk)
+            if datos:
+                yield datos
+        yield terminar()
+
+    def compress_response(self, response):
+        if (
+            response.status_code != 200
+            or response.mimetype not in MIMETYPES_COMPRIMIBLES
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            #cada codificacion es una representacion distinta, con su propio ETag (como en el cache)
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
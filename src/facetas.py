@@ -0,0 +1,194 @@
+"""
+Facetas del catalogo (GET /productos/facets): productos por categoria e
+histograma de precios.
+
+Sin filtros se leen de ResumenFaceta, que las escrituras de productos ajustan
+en la misma transaccion (sumando y restando por categoria y por rango de
+RANGO_PRECIO), asi la consulta no recorre la tabla producto. Con filtros o
+texto se calculan con GROUP BY sobre los productos que cumplen los filtros.
+Si el resumen se desalinea (ej: escrituras fuera de la app) se reconstruye
+con `flask catalog rebuild-facets`.
+"""
+from collections import Counter
+from sqlalchemy import and_, event, literal, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm.attributes import get_history
+from models import db, Categoria, Producto, ResumenFaceta
+from busqueda import buscar_productos
+
+#ancho de los rangos de precio del resumen, los histogramas usan multiplos de este ancho
+RANGO_PRECIO = 100
+#valor de la faceta categoria para los productos sin categoria
+SIN_CATEGORIA = 0
+
+def inicio_rango(precio, ancho):
+    """inicio del rango de precio como expresion SQL, redondeando hacia abajo tambien con negativos"""
+    return precio - ((precio % ancho) + ancho) % ancho
+
+def contar_producto(deltas, categoria_id, precio, signo):
+    """suma signo a la categoria y al rango de precio del producto en deltas"""
+    deltas[("categoria", categoria_id or SIN_CATEGORIA)] += signo
+    deltas[("precio", int(precio) // RANGO_PRECIO * RANGO_PRECIO)] += signo
+    return deltas
+
+def cambio_de_productos(anteriores, nuevos):
+    """deltas del resumen al pasar de las filas (categoria_id, precio) anteriores a las nuevas"""
+    deltas = Counter()
+    for categoria_id, precio in anteriores:
+        contar_producto(deltas, categoria_id, precio, -1)
+    for categoria_id, precio in nuevos:
+        contar_producto(deltas, categoria_id, precio, 1)
+    return deltas
+
+#suma la cantidad a la fila (faceta, valor) o la crea, en una sola sentencia
+SUMAR_ON_CONFLICT = (
+    "INSERT INTO resumen_faceta (faceta, valor, cantidad) VALUES (:faceta, :valor, :cantidad) "
+    "ON CONFLICT (faceta, valor) DO UPDATE SET cantidad = resumen_faceta.cantidad + excluded.cantidad"
+)
+SUMAR_POR_DIALECTO = {
+    "postgresql": SUMAR_ON_CONFLICT,
+    "sqlite": SUMAR_ON_CONFLICT,
+    "mysql": (
+        "INSERT INTO resumen_faceta (faceta, valor, cantidad) VALUES (:faceta, :valor, :cantidad) "
+        "ON DUPLICATE KEY UPDATE cantidad = cantidad + VALUES(cantidad)"
+    ),
+}
+
+def nombre_dialecto(conexion):
+    """dialecto de la sesion (main.py pasa db.session) o de la conexion de los eventos del ORM"""
+    if isinstance(conexion, Connection):
+        return conexion.dialect.name
+    return conexion.get_bind().dialect.name
+
+def ajustar_resumen(conexion, deltas):
+    """aplica los deltas {(faceta, valor): cantidad} al resumen con un upsert, creando las filas que falten"""
+    #siempre en el mismo orden, dos transacciones no se bloquean en orden inverso
+    filas = [
+        {"faceta": faceta, "valor": valor, "cantidad": delta}
+        for (faceta, valor), delta in sorted(deltas.items()) if delta
+    ]
+    if filas:
+        conexion.execute(text(SUMAR_POR_DIALECTO[nombre_dialecto(conexion)]), filas)
+
+def ajustar_rangos_de_precio(conexion, condiciones, nuevo_precio):
+    """
+        mueve entre rangos los productos que cumplen las condiciones y pasan a nuevo_precio,
+        con un GROUP BY antes del UPDATE (no lee los productos uno a uno)
+    """
+    anterior = inicio_rango(Producto.__table__.c.precio, RANGO_PRECIO)
+    nuevo = inicio_rango(nuevo_precio, RANGO_PRECIO)
+    deltas = Counter()
+    for desde, hasta, cantidad in conexion.execute(
+        select([anterior, nuevo, db.func.count()]).where(and_(*condiciones)).group_by(anterior, nuevo)
+    ):
+        deltas[("precio", int(desde))] -= cantidad
+        deltas[("precio", int(hasta))] += cantidad
+    ajustar_resumen(conexion, deltas)
+
+def descontar_categoria(conexion, categoria_id, cantidad=None):
+    """
+        al borrar una categoria sus productos pasan a sin categoria (ON DELETE SET NULL);
+        cantidad son sus productos si ya se conocen (lo que devuelve soltar_productos),
+        si no se leen del resumen
+    """
+    tabla = ResumenFaceta.__table__
+    if cantidad is None:
+        cantidad = conexion.execute(
+            select([tabla.c.cantidad])
+            .where(and_(tabla.c.faceta == "categoria", tabla.c.valor == categoria_id))
+            .with_for_update()
+        ).scalar()
+    if cantidad:
+        ajustar_resumen(conexion, {("categoria", categoria_id): -cantidad, ("categoria", SIN_CATEGORIA): cantidad})
+
+def reconstruir_resumen(conexion):
+    """vuelve a calcular el resumen completo desde la tabla producto"""
+    tabla = ResumenFaceta.__table__
+    productos = Producto.__table__
+    categoria = db.func.coalesce(productos.c.categoria_id, SIN_CATEGORIA)
+    rango = inicio_rango(productos.c.precio, RANGO_PRECIO)
+    conexion.execute(tabla.delete())
+    for faceta, valor in (("categoria", categoria), ("precio", rango)):
+        conexion.execute(tabla.insert().from_select(
+            ["faceta", "valor", "cantidad"],
+            select([literal(faceta, db.String), valor, db.func.count()]).group_by(valor)
+        ))
+
+#las escrituras por el ORM (POST /productos, el admin) se cuentan en el flush
+@event.listens_for(Producto, "after_insert")
+def contar_insercion_orm(mapper, connection, target):
+    ajustar_resumen(connection, cambio_de_productos([], [(target.categoria_id, target.precio)]))
+
+@event.listens_for(Producto, "after_delete")
+def contar_eliminacion_orm(mapper, connection, target):
+    ajustar_resumen(connection, cambio_de_productos([(target.categoria_id, target.precio)], []))
+
+def valor_anterior(target, campo):
+    historia = get_history(target, campo)
+    return historia.deleted[0] if historia.deleted else getattr(target, campo)
+
+@event.listens_for(Producto, "after_update")
+def contar_modificacion_orm(mapper, connection, target):
+    ajustar_resumen(connection, cambio_de_productos(
+        [(valor_anterior(target, "categoria_id"), valor_anterior(target, "precio"))],
+        [(target.categoria_id, target.precio)]
+    ))
+
+@event.listens_for(Categoria, "after_delete")
+def descontar_categoria_orm(mapper, connection, target):
+    descontar_categoria(connection, target.id)
+
+def consultar_facetas(condiciones, texto, ancho):
+    """
+        {"total", "categorias", "precios", "bucket"} de los productos que cumplen las
+        condiciones y el texto; sin ninguno de los dos se leen del resumen
+    """
+    if not condiciones and not texto:
+        tabla = ResumenFaceta.__table__
+        por_categoria = (
+            db.session.query(tabla.c.valor, Categoria.nombre, tabla.c.cantidad)
+            .select_from(tabla)
+            .outerjoin(Categoria, Categoria.id == tabla.c.valor)
+            .filter(tabla.c.faceta == "categoria", tabla.c.cantidad > 0)
+        )
+        rango = inicio_rango(tabla.c.valor, ancho)
+        por_precio = (
+            db.session.query(rango, db.func.sum(tabla.c.cantidad))
+            .filter(tabla.c.faceta == "precio", tabla.c.cantidad > 0)
+            .group_by(rango)
+        )
+    else:
+        def filtrar(consulta):
+            consulta = consulta.select_from(Producto).filter(*condiciones)
+            if texto:
+                #la relevancia no importa para contar
+                consulta = buscar_productos(consulta, texto).order_by(None)
+            return consulta
+        categoria = db.func.coalesce(Producto.categoria_id, SIN_CATEGORIA)
+        por_categoria = (
+            filtrar(db.session.query(categoria, Categoria.nombre, db.func.count(Producto.id)))
+            .outerjoin(Categoria, Categoria.id == Producto.categoria_id)
+            .group_by(categoria, Categoria.nombre)
+        )
+        rango = inicio_rango(Producto.precio, ancho)
+        por_precio = filtrar(db.session.query(rango, db.func.count(Producto.id))).group_by(rango)
+    categorias = sorted(
+        (
+            {"categoria_id": categoria_id or None, "nombre": nombre, "cantidad": int(cantidad)}
+            for categoria_id, nombre, cantidad in por_categoria
+        ),
+        key=lambda faceta: (-faceta["cantidad"], faceta["categoria_id"] or 0)
+    )
+    precios = sorted(
+        (
+            {"desde": int(desde), "hasta": int(desde) + ancho, "cantidad": int(cantidad)}
+            for desde, cantidad in por_precio
+        ),
+        key=lambda rango: rango["desde"]
+    )
+    return {
+        "total": sum(faceta["cantidad"] for faceta in categorias),
+        "categorias": categorias,
+        "precios": precios,
+        "bucket": ancho,
+    }
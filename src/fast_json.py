@@ -0,0 +1,48 @@
+"""
+Codificacion JSON rapida: usa orjson si esta instalado y el json de la
+libreria estandar si no. Los endpoints de listas codifican directo a bytes
+con json_response; setup_json registra el mismo codificador para jsonify
+como app.json_encoder, el gancho que tiene Flask 1.x.
+
+orjson es opcional: pipenv install --categories "packages speedups"
+"""
+import json
+from flask import current_app
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """codifica obj directamente a bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_response(obj, status=200):
+    return current_app.response_class(dumps(obj), status=status, mimetype="application/json")
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+        el codificador de jsonify con orjson. Las fechas y los tipos que orjson no conoce
+        pasan por default() de Flask, asi la salida es la misma que con el json estandar
+    """
+
+    def encode(self, obj):
+        if self.indent is not None:
+            return super().encode(obj)
+        opciones = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opciones |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=opciones).decode("utf-8")
+
+
+def setup_json(app):
+    """jsonify usa orjson si esta instalado; sin orjson queda el codificador de Flask"""
+    if orjson is not None:
+        app.json_encoder = FastJSONEncoder
@@ -1,40 +1,272 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
+import csv
+import io
+import json
+import logging
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, stream_with_context
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Categoria, Producto
+from sqlalchemy import and_, case, literal, select, true
+from sqlalchemy.orm import load_only
+from cache import ResponseCache
+from compression import ResponseCompression
+from fast_json import dumps, json_response, setup_json
+from metrics import RequestMetrics
+from pool import pool_prometheus
+from replicas import ReadReplicas
+from utils import (
+    APIException, generate_sitemap, get_fields, get_ids, get_if_match, get_include, get_int_arg,
+    get_page_args, representation_etag, version_etag
+)
+from busqueda import buscar_productos, terminos
+from cambios import consultar_cambios, registrar_eliminaciones, soltar_productos
+from arbol import (
+    ancestros, bloquear_para_mover, descendientes, descendientes_de, ids_en_ruta, leer_padre_id,
+    mover_descendientes, ruta_para_mover, segmento, subir_hijos, tiene_hijos
+)
+from catalogo import (
+    CAMPOS_CATEGORIA, PRODUCTOS_POR_CATEGORIA, categoria_de_insumo, filtros_producto, leer_productos,
+    listar_categorias, listar_productos, resultado_por_ids
+)
+from facetas import (
+    RANGO_PRECIO, ajustar_rangos_de_precio, ajustar_resumen, cambio_de_productos, consultar_facetas,
+    descontar_categoria
+)
+from models import db, bloquear_escritura, es_entero, User, Categoria, Producto
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+MAX_BULK_BATCH_SIZE = 5000
+#ids por sentencia UPDATE en PATCH /productos/bulk
+BULK_UPDATE_CHUNK = 500
+CAMPOS_PRODUCTO = ("titulo", "descripcion", "precio", "imagen", "categoria_id")
+#campos que se pueden modificar con PUT /categorias/<id>
+CAMPOS_MODIFICABLES_CATEGORIA = ("nombre", "descripcion", "icono")
+#filas por fetchmany en GET /productos/export
+EXPORT_BATCH_SIZE = 1000
+#cambios por pagina en GET /changes
+CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 1000
+#ancho por defecto de los rangos del histograma de GET /productos/facets
+FACETS_PRICE_BUCKET = 1000
+
+#errores de escritura con su traceback, van a los handlers de logging configurados
+logger = logging.getLogger("shopfix.api")
+
+#extensiones sin app, create_app() las inicializa
+response_cache = ResponseCache()
+response_compression = ResponseCompression()
+request_metrics = RequestMetrics()
+read_replicas = ReadReplicas()
+api = Blueprint('api', __name__)
+
+def create_app(config=None):
+    """
+        crea la app con la configuracion de las variables de entorno (config la
+        sobreescribe). Flask-Admin y Flask-Migrate solo se importan si se usan:
+        con ENABLE_ADMIN=false los workers de la API no cargan el admin, y las
+        migraciones y comandos solo se registran al correr el CLI de flask
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    #cache de respuestas GET: memory (por proceso), redis (compartido) o none
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 60))
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+    #consultas que tarden mas de SLOW_QUERY_MS se registran con su sentencia
+    app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 200))
+    #filas por INSERT/commit en POST /productos/bulk
+    app.config['BULK_BATCH_SIZE'] = int(os.environ.get('BULK_BATCH_SIZE', 1000))
+    #compresion gzip/brotli de respuestas de al menos COMPRESS_MIN_SIZE bytes
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    app.config['COMPRESS_BROTLI_LEVEL'] = int(os.environ.get('COMPRESS_BROTLI_LEVEL', 5))
+    #pool de conexiones por worker (en SQLite solo aplica DB_POOL_PRE_PING)
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    #limite por sentencia en milisegundos, 0 sin limite (PostgreSQL; en MySQL solo SELECT)
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    #replicas de lectura opcionales, separadas por coma; los GET se reparten entre ellas
+    app.config['DB_REPLICA_CONNECTION_STRINGS'] = [
+        url.strip() for url in os.environ.get('DB_REPLICA_CONNECTION_STRINGS', '').split(',') if url.strip()
+    ]
+    #despues de escribir, el cliente lee del primario durante estos segundos
+    app.config['DB_REPLICA_STICKY_SECONDS'] = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+    app.config['DB_REPLICA_HEALTH_INTERVAL'] = int(os.environ.get('DB_REPLICA_HEALTH_INTERVAL', 10))
+    #maximo de ids por GET /productos?ids= y POST /productos/batch-get
+    app.config['MULTI_GET_MAX_IDS'] = int(os.environ.get('MULTI_GET_MAX_IDS', 100))
+    #el admin puede correr en un proceso aparte: ENABLE_ADMIN=false en la API y ENABLE_API=false en el admin
+    app.config['ENABLE_ADMIN'] = os.environ.get('ENABLE_ADMIN', 'true').lower() in ('1', 'true', 'yes')
+    app.config['ENABLE_API'] = os.environ.get('ENABLE_API', 'true').lower() in ('1', 'true', 'yes')
+    #el admin estima el total de filas en vez de contarlo a partir de este tamano
+    app.config['ADMIN_ESTIMATED_COUNT_THRESHOLD'] = int(os.environ.get('ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000))
+    app.config.update(config or {})
+
+    db.init_app(app)
+    read_replicas.init_app(app)
+    response_cache.init_app(app)
+    response_compression.init_app(app)
+    request_metrics.init_app(app)
+    request_metrics.add_collector(response_cache.prometheus)
+    request_metrics.add_collector(pool_prometheus)
+    if read_replicas.replicas:
+        request_metrics.add_collector(read_replicas.prometheus)
+    CORS(app)
+    setup_json(app)
+    app.register_error_handler(APIException, handle_invalid_usage)
+    if app.config['ENABLE_API']:
+        app.register_blueprint(api)
+    if app.config['ENABLE_ADMIN']:
+        from admin import setup_admin
+        setup_admin(app)
+    #flask db ... y flask catalog ...; el CLI de flask define FLASK_RUN_FROM_CLI
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        from commands import setup_commands
+        Migrate(app, db)
+        setup_commands(app)
+    return app
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
+
+def soporta_returning():
+    """True si el dialecto de la base de escritura admite UPDATE/DELETE ... RETURNING"""
+    return db.session.get_bind().dialect.implicit_returning
+
+def leer_bloqueando(consulta):
+    """
+        ejecuta la consulta de valores previos con FOR UPDATE: otra escritura de esas filas
+        espera al commit, asi dos escrituras no calculan sus cambios desde los mismos valores.
+        En SQLite, que no tiene FOR UPDATE, antes se toma el lock de escritura de la base
+    """
+    bloquear_escritura(db.session.connection())
+    return db.session.execute(consulta.with_for_update())
+
+def update_devolviendo_anteriores(tabla, valores, condiciones, columnas, cambian):
+    """
+        UPDATE ... RETURNING de los valores que ademas devuelve los valores previos de las
+        columnas en cambian como anterior_<columna>, en la misma sentencia: un self-join con
+        la fila bloqueada, UPDATE ... FROM (SELECT ... FOR UPDATE) AS anterior
+    """
+    sentencia = tabla.update().values(dict(valores, version=tabla.c.version + 1))
+    if not cambian:
+        return sentencia.where(and_(*condiciones)).returning(*columnas)
+    anterior = (
+        select([tabla.c.id] + [tabla.c[columna] for columna in cambian])
+        .where(and_(*condiciones)).with_for_update().alias("anterior")
+    )
+    return sentencia.where(tabla.c.id == anterior.c.id).returning(
+        *columnas, *[anterior.c[columna].label(f"anterior_{columna}") for columna in cambian]
+    )
+
+def actualizar_por_id(modelo, fila_id, valores, anteriores=(), versiones=None):
+    """
+        UPDATE ... WHERE id = ? de los valores, incrementando la version, y devuelve la
+        fila actualizada (columnas CAMPOS_SERIALIZADOS y version) con los valores previos
+        de las columnas en anteriores como anterior_<columna>, o None si no existe.
+        Con versiones (las de If-Match) el UPDATE es condicional: WHERE version IN (...),
+        si la version cambio tambien devuelve None.
+        Los anteriores que no estan en valores son los valores actuales. Con RETURNING es
+        una sola sentencia, tambien para los anteriores que cambian (update_devolviendo_anteriores);
+        sin RETURNING esos se leen antes con la fila bloqueada (leer_bloqueando) y la fila
+        se lee despues del UPDATE
+    """
+    tabla = modelo.__table__
+    columnas = [tabla.c[campo] for campo in modelo.CAMPOS_SERIALIZADOS] + [tabla.c.version]
+    columnas += [tabla.c[columna].label(f"anterior_{columna}") for columna in anteriores if columna not in valores]
+    cambian = [columna for columna in anteriores if columna in valores]
+    condiciones = [tabla.c.id == fila_id]
+    if versiones is not None:
+        condiciones.append(tabla.c.version.in_(versiones))
+    if not valores:
+        #sin cambios no se escribe ni cambia la version
+        return db.session.execute(select(columnas).where(and_(*condiciones))).first()
+    if soporta_returning():
+        return db.session.execute(update_devolviendo_anteriores(tabla, valores, condiciones, columnas, cambian)).first()
+    if cambian:
+        fila = leer_bloqueando(select([tabla.c[columna] for columna in cambian]).where(and_(*condiciones))).first()
+        if fila is None:
+            return None
+        columnas += [literal(previo).label(f"anterior_{columna}") for columna, previo in zip(cambian, fila)]
+    sentencia = tabla.update().where(and_(*condiciones)).values(dict(valores, version=tabla.c.version + 1))
+    if db.session.execute(sentencia).rowcount == 0:
+        return None
+    return db.session.execute(select(columnas).where(tabla.c.id == fila_id)).first()
+
+def categorias_que_existen(ids):
+    """los ids de ids que son categorias, con una sola consulta"""
+    if not ids:
+        return set()
+    return {categoria_id for (categoria_id,) in db.session.query(Categoria.id).filter(Categoria.id.in_(ids))}
+
+def version_actual(modelo, fila_id):
+    """version de la fila, o None si no existe"""
+    return db.session.query(modelo.version).filter(modelo.id == fila_id).scalar()
+
+def conflicto_de_version(modelo, fila_id, mensaje):
+    """
+        respuesta cuando un UPDATE con If-Match no encontro la fila: 412 con la version
+        actual como ETag si la fila existe pero cambio de version, 404 si no existe
+    """
+    version = version_actual(modelo, fila_id)
+    if version is None:
+        return jsonify({
+            "resultado": mensaje
+        }), 404
+    respuesta = jsonify({
+        "resultado": "El recurso fue modificado por otra solicitud, vuelva a consultarlo"
+    })
+    respuesta.set_etag(version_etag(version))
+    return respuesta, 412
+
+def borrar_por_id(modelo, fila_id, devolver=(), versiones=None):
+    """
+        DELETE ... WHERE id = ? y registra la eliminacion para GET /changes; devuelve la
+        fila borrada con las columnas en devolver (nombres o expresiones con label, vacia si no
+        se pide ninguna) o None si no existe.
+        Con versiones (las de If-Match) solo borra si la version no cambio, si no tambien devuelve None.
+        Sin RETURNING las columnas pedidas se leen antes de borrar, con la fila bloqueada
+    """
+    tabla = modelo.__table__
+    condiciones = [tabla.c.id == fila_id]
+    if versiones is not None:
+        condiciones.append(tabla.c.version.in_(versiones))
+    sentencia = tabla.delete().where(and_(*condiciones))
+    columnas = [tabla.c[columna] if isinstance(columna, str) else columna for columna in devolver]
+    if columnas and soporta_returning():
+        fila = db.session.execute(sentencia.returning(*columnas)).first()
+    else:
+        fila = ()
+        if columnas:
+            fila = leer_bloqueando(select(columnas).where(and_(*condiciones))).first()
+            if fila is None:
+                return None
+        if not db.session.execute(sentencia).rowcount:
+            fila = None
+    if fila is not None:
+        registrar_eliminaciones(db.session, tabla.name, [int(fila_id)])
+    return fila
 
 #======================================
 #endpoints Categorias
 #======================================
 #consulta y crear
-@app.route('/categorias', methods=['GET','POST'])
+@api.route('/categorias', methods=['GET','POST'])
+@response_cache.cached("categorias")
 def gestionar_categorias():
 
     """
@@ -43,112 +275,197 @@ def gestionar_categorias():
     """
     #Validando el methodo usado en la peticion
     if request.method == 'GET':
-        #Selecciona todos los resgistros de la tabla categoria y asiganrlo a una vairale
-        categorias = Categoria.query.all() #.all() para devolverlo como lista
-
-        #Validr si hay params en la url
-        name = request.args.get("categoryname")
-        if name is not None:
-            categorias_filtradas = filter(lambda categoria: name in categoria.nombre, categorias)
-        else:
-            categorias_filtradas = categorias
-        #Serializar la lista
-        categorias_serializadas=list(map(lambda categoria: categoria.serializar(), categorias))               
-        #devolver lista de categorias serializadas
-        return jsonify(categorias_serializadas), 200
+        #devolver la pagina de categorias serializadas (la misma consulta que la app ASGI)
+        return json_response(listar_categorias(db.session, request.args))
     else:
         #Crea una variable y asigna el diccionario de datos para crear la categoria
         insumo_categoria = request.json
-        if insumo_categoria is None:
-            return jsonify ({
-                "resultado": "No envio la informacion para crear la categoria"
-            }),400
-        if (
-            "nombre" not in insumo_categoria or 
-            "descripcion" not in insumo_categoria or 
-            "icono" not in insumo_categoria
-            ):
+        error = Categoria.validar_insumo(insumo_categoria)
+        if error is not None:
             return jsonify({
-                "resultado": "Debe indicar un nombre, descripcion e icono para crear la categoria"
+                "resultado": error
             }),400
-        #Validar que no venga vacio
-        if (
-            insumo_categoria["nombre"] == "" or
-            insumo_categoria["descripcion"] == "" or
-            insumo_categoria["icono"] == ""
-
-        ):
-            return jsonify({
-                "resultado": "Debe indicar un nombre e icono para crear la categoria"
-            })
-        nueva_categoria = Categoria.registrar_categoria(
-            insumo_categoria["nombre"],
-            insumo_categoria["descripcion"],
-            insumo_categoria["icono"]
-        )
+        #con padre_id la categoria se crea debajo de esa categoria, sin el queda como raiz
+        categoria = categoria_de_insumo(db.session, insumo_categoria)
         #agregar a la base de datos
-        db.session.add(nueva_categoria)
+        db.session.add(categoria)
         try:
             db.session.commit()
+            #las subcategorias de sus ancestros cambian
+            response_cache.invalidate(
+                "categorias", *[f"categoria:{ancestro}" for ancestro in ids_en_ruta(categoria.ruta)]
+            )
             #Si el commit es exitoso se devuelve la ifo de nueva categoria
-            return jsonify(nueva_categoria.serializar()),201
+            return jsonify(categoria.serializar(0)),201
         except Exception as error:
             db.session.rollback()
-            print(f"{error.args} {type(error)}")
+            logger.exception("No se pudo crear la categoria")
             return jsonify({
                 "resultado": f"{error.args}"
             }), 500
 
 #Consulta, edicion, borrar
-@app.route('/categorias/<categoria_id>', methods=['GET','PUT','DELETE'])
+@api.route('/categorias/<categoria_id>', methods=['GET','PUT','DELETE'])
+@response_cache.cached("categoria:{categoria_id}")
 def rud_categorias(categoria_id):
-    #Crear una vairable y asignar una cat en especifico
-    categoria = Categoria.query.get(categoria_id)
-    #Validar si la categoria existe
-    if isinstance(categoria, Categoria):
-        if request.method == 'GET':            
-            #devolver lista de categorias serializadas
-            return jsonify(categoria.serializar()), 200
-        elif request.method == 'PUT':
-            #recuperar diccionar del body del request
-            diccionario = request.json
-            #actualizar propiedades que vengan en el dicc
-            categoria.modificar_categoria(diccionario)
-            #guardar cambio en BD, hacer commit
+    if request.method == 'PUT':
+        #recuperar diccionar del body del request
+        diccionario = request.json or {}
+        valores = {campo: diccionario[campo] for campo in CAMPOS_MODIFICABLES_CATEGORIA if campo in diccionario}
+        #con padre_id se mueve la categoria con toda su rama (null la deja como raiz)
+        anterior = None
+        afectadas = []
+        if "padre_id" in diccionario:
+            padre_id = leer_padre_id(diccionario)
+            #las filas de la categoria y del padre con sus ancestros quedan bloqueadas hasta el commit,
+            #asi dos movimientos al mismo tiempo no arman un ciclo
             try:
-                db.session.commit()
-                #devolver la categoria serializada
-                return jsonify(categoria.serializar()), 200
-            except Exception as error:
+                anterior = bloquear_para_mover(db.session, categoria_id, padre_id)
+                if anterior is not None:
+                    valores["ruta"] = ruta_para_mover(db.session, anterior, padre_id)
+            except APIException:
                 db.session.rollback()
-                print(f"{error.args} {type(error)}")
-                return jsonify({
-                    "resultado": f"{error.args}"
-                }), 500
-        else:
-            #remover la categoria de  la BD, hacer commit, return 204
-            db.session.delete(categoria)
-            try:
-                db.session.commit()
-                #devolver delete exitoso
-                return jsonify({
-                    "resultado": "Se ha eliminado la categoria exitosamente"
-                }), 200
-            except Exception as error:
+                raise
+            if anterior is None:
                 db.session.rollback()
-                print(f"{error.args} {type(error)}")
                 return jsonify({
-                    "resultado": f"{error.args}"
-                }), 500
-    else:
+                    "resultado":"La categoria no existe"
+                }), 404
+            valores["padre_id"] = padre_id
+            #cambian las subcategorias de los ancestros de antes y de despues, y los ancestros de la rama
+            afectadas = ids_en_ruta(anterior.ruta) + ids_en_ruta(valores["ruta"])
+            if response_cache.backend is not None:
+                afectadas += [
+                    descendiente for (descendiente,) in
+                    db.session.query(Categoria.id).filter(descendientes_de(Categoria.ruta, anterior))
+                ]
+        #con If-Match solo se actualiza si la version no cambio (412 si cambio)
+        versiones = get_if_match(request.if_match)
+        #actualizar con un solo UPDATE ... WHERE id, si no hay fila la categoria no existe;
+        #al mover, otro UPDATE cambia la ruta de todos los descendientes
+        try:
+            categoria = actualizar_por_id(Categoria, categoria_id, valores, versiones=versiones)
+            if categoria is not None and anterior is not None and valores["ruta"] != anterior.ruta:
+                mover_descendientes(db.session, anterior, valores["ruta"] + segmento(anterior.id))
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("No se pudo modificar la categoria %s", categoria_id)
+            return jsonify({
+                "resultado": f"{error.args}"
+            }), 500
+        if categoria is None:
+            return conflicto_de_version(Categoria, categoria_id, "La categoria no existe")
+        response_cache.invalidate("categorias", f"categoria:{categoria_id}")
+        if anterior is not None:
+            #los productos de la rama quedan bajo otros ancestros (GET /productos?categoria_rama=)
+            response_cache.invalidate("productos", *[f"categoria:{afectada}" for afectada in afectadas])
+        #devolver la categoria serializada, con la nueva version en el ETag
+        respuesta = jsonify(Categoria.serializar_lista([categoria])[0])
+        respuesta.set_etag(representation_etag(categoria.version, respuesta.get_data()))
+        return respuesta, 200
+    if request.method == 'DELETE':
+        #remover la categoria de la BD con un solo DELETE ... WHERE id
+        #antes un UPDATE deja sus productos sin categoria con un numero de cambio nuevo (GET /changes),
+        #su rowcount descuenta la faceta, y si tenia hijos (se lee con el DELETE) sus subcategorias
+        #pasan a su padre con un UPDATE de la rama: a lo sumo 6 sentencias mas las del commit;
+        #los ids de productos y subcategorias solo se leen si hay cache, para invalidar sus respuestas
+        #con If-Match solo se borra si la version no cambio (412 si cambio)
+        versiones = get_if_match(request.if_match)
+        try:
+            afectadas = []
+            if response_cache.backend is not None:
+                afectadas = [
+                    f"producto:{producto_id}" for (producto_id,) in
+                    db.session.query(Producto.id).filter(Producto.categoria_id == categoria_id)
+                ]
+            soltados = soltar_productos(db.session, categoria_id)
+            borrada = borrar_por_id(
+                Categoria, categoria_id, devolver=("id", "ruta", "padre_id", tiene_hijos()), versiones=versiones
+            )
+            if borrada is None:
+                #sin categoria (o con otra version) los productos no se tocan
+                db.session.rollback()
+            else:
+                descontar_categoria(db.session, int(categoria_id), soltados)
+                afectadas += [f"categoria:{ancestro}" for ancestro in ids_en_ruta(borrada.ruta)]
+                if response_cache.backend is not None and borrada.tiene_hijos:
+                    afectadas += [
+                        f"categoria:{descendiente}" for (descendiente,) in
+                        db.session.query(Categoria.id).filter(descendientes_de(Categoria.ruta, borrada))
+                    ]
+                if borrada.tiene_hijos:
+                    subir_hijos(db.session, borrada)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("No se pudo borrar la categoria %s", categoria_id)
+            return jsonify({
+                "resultado": f"{error.args}"
+            }), 500
+        if borrada is None:
+            return conflicto_de_version(Categoria, categoria_id, "La categoria no existe")
+        response_cache.invalidate(
+            "categorias", f"categoria:{categoria_id}", "productos", *afectadas
+        )
+        #devolver delete exitoso
+        return jsonify({
+            "resultado": "Se ha eliminado la categoria exitosamente"
+        }), 200
+    #con fields= solo se cargan las columnas pedidas, el resto queda diferido
+    include = get_include(request.args, ["productos", "ancestros", "subcategorias"])
+    campos = get_fields(request.args, CAMPOS_CATEGORIA)
+    #Crear una vairable y asignar una cat en especifico
+    categoria = Categoria.query.options(
+        load_only("id", "version", "ruta", *[campo for campo in campos if campo in Categoria.CAMPOS_SERIALIZADOS])
+    ).get(categoria_id)
+    #Validar si la categoria existe
+    if categoria is None:
         return jsonify({
             "resultado":"La categoria no existe"
         }), 404
+    serializada = Categoria.serializar_lista(
+        [categoria], "productos" in include, PRODUCTOS_POR_CATEGORIA, campos
+    )[0]
+    #ancestros (de la raiz al padre) y subcategorias (toda la rama, por nivel) salen de la ruta
+    if "ancestros" in include:
+        serializada["ancestros"] = Categoria.serializar_lista(
+            ancestros(db.session, categoria), campos=Categoria.CAMPOS_SERIALIZADOS
+        )
+    if "subcategorias" in include:
+        serializada["subcategorias"] = Categoria.serializar_lista(
+            descendientes(db.session, categoria), campos=Categoria.CAMPOS_SERIALIZADOS
+        )
+    #devolver la categoria serializada; el ETag lleva la version y el hash del cuerpo,
+    #que cambia con los productos, ancestros y subcategorias aunque la version no cambie
+    respuesta = jsonify(serializada)
+    respuesta.set_etag(representation_etag(categoria.version, respuesta.get_data()))
+    return respuesta, 200
+
+#======================================
+#endpoint de cambios
+#======================================
+@api.route('/changes', methods=['GET'])
+def cambios():
+    """
+        cambios de categorias y productos desde el token since (sin since, desde el
+        principio), en paginas de limit. Cada resultado trae tipo, id, cambio y
+        operacion: upsert con la fila en datos, o delete. Al borrar una categoria sus
+        productos aparecen como cambiados, sin categoria (categoria_id null).
+        El cliente guarda next_token y lo envia como since en la siguiente consulta
+    """
+    limit = min(get_int_arg(request.args, "limit", CHANGES_PAGE_SIZE, minimum=1), MAX_CHANGES_PAGE_SIZE)
+    return json_response(consultar_cambios(request.args.get("since"), limit))
+
+#contadores de aciertos y fallos del cache de respuestas
+@api.route('/cache/stats', methods=['GET'])
+def estadisticas_cache():
+    return jsonify(response_cache.stats()), 200
 
 #======================================
 #endpoints Usuario
 #======================================
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
 def handle_hello():
 
     response_body = {
@@ -161,52 +478,56 @@ def handle_hello():
 #======================================
 #endpoints productos
 #======================================
+def productos_por_ids(ids, campos):
+    """
+        {"resultados", "no_encontrados"} de los productos con esos ids, en el orden pedido.
+        Con cache de respuestas se reutilizan las entradas de GET /productos/<id> y solo los
+        que faltan se leen con un solo IN, guardando sus entradas para las siguientes
+    """
+    por_id = {}
+    llaves = {}
+    if response_cache.backend is not None:
+        llaves = {producto_id: response_cache.key(f"/productos/{producto_id}") for producto_id in ids}
+        for producto_id, entrada in zip(ids, response_cache.get_many(list(llaves.values()))):
+            if entrada is not None:
+                por_id[producto_id] = json.loads(entrada["body"])
+        generacion = response_cache.backend.generation()
+    faltantes = [producto_id for producto_id in ids if producto_id not in por_id]
+    if faltantes:
+        filas = leer_productos(db.session, faltantes)
+        nuevas = []
+        for fila, serializado in zip(filas, Producto.serializar_filas(filas)):
+            por_id[fila.id] = serializado
+            if llaves:
+                #la misma respuesta que daria GET /productos/<id>, con el mismo ETag
+                respuesta = jsonify(serializado)
+                respuesta.set_etag(representation_etag(fila.version, respuesta.get_data()))
+                nuevas.append((llaves[fila.id], respuesta, [f"producto:{fila.id}"]))
+        if nuevas:
+            response_cache.store_many(nuevas, generacion)
+    return resultado_por_ids(ids, por_id, campos)
+
 #consulta y crear
-@app.route('/productos', methods=['GET','POST'])
+@api.route('/productos', methods=['GET','POST'])
+@response_cache.cached("productos")
 def chequear_producto():
     #Validando el methodo usado en la peticion
     if request.method == 'GET':
-        #Selecciona todos los resgistros de la tabla categoria y asiganrlo a una vairale
-        productos = Producto.query.all() #.all() para devolverlo como lista
-
-        #Validr si hay params en la url
-        name = request.args.get("productname")
-        if name is not None:
-            productos_filtrados = filter(lambda producto: name in producto.name, productos)
-        else:
-            productos_filtrados = productos
-        #Serializar la lista
-        productos_serializados=list(map(lambda producto: producto.serialize(), productos))               
-        #devolver lista de categorias serializadas
-        return jsonify(productos_serializados), 200
+        #con ids= se devuelven esos productos en vez de una pagina del listado
+        if "ids" in request.args:
+            campos = get_fields(request.args, Producto.CAMPOS_SERIALIZADOS)
+            ids = get_ids(request.args["ids"], current_app.config['MULTI_GET_MAX_IDS'])
+            return json_response(productos_por_ids(ids, campos))
+        #devolver la pagina de productos serializados, por offset o por cursor
+        return json_response(listar_productos(db.session, request.args))
     else:
-        #Crea una variable y asigna el diccionario de datos para crear la categoria
+        #Crea una variable y asigna el diccionario de datos para crear el producto
         insumo_producto = request.json
-        if insumo_producto is None:
-            return jsonify ({
-                "resultado": "No envio la informacion para crear el producto"
-            }),400
-        if (
-            "titulo" not in insumo_producto or 
-            "descripcion" not in insumo_producto or 
-            "precio" not in insumo_producto or
-            "imagen" not in insumo_producto or
-            "categoria_id" not in insumo_producto 
-            ):
+        error = Producto.validar_insumo(insumo_producto)
+        if error is not None:
             return jsonify({
-                "resultado": "Debe indicar un titulo, descripcion, precio, imagen y categoria para crear el producto"
+                "resultado": error
             }),400
-        #Validar que no venga vacio
-        if (
-            insumo_producto["titulo"] == "" or
-            insumo_producto["descripcion"] == "" or
-            insumo_producto["precio"] == "" or
-            insumo_producto["imagen"] == "" or
-            insumo_producto["categoria_id"] == "" 
-        ):
-            return jsonify({
-                "resultado": "Debe indicar un titulo, descripcion, precio, imagen y categoria para crear el producto"
-            })
         nuevo_producto = Producto.registrar_producto(
             insumo_producto["titulo"],
             insumo_producto["descripcion"],
@@ -218,87 +539,525 @@ def chequear_producto():
         db.session.add(nuevo_producto)
         try:
             db.session.commit()
+            #los conteos de productos de las categorias tambien cambian
+            response_cache.invalidate(
+                "productos", "categorias", f"categoria:{nuevo_producto.categoria_id}"
+            )
             #Si el commit es exitoso se devuelve la ifo de nueva categoria
             return jsonify(nuevo_producto.serialize()),201
         except Exception as error:
             db.session.rollback()
-            print(f"{error.args} {type(error)}")
+            logger.exception("No se pudo crear el producto")
             return jsonify({
                 "resultado": f"{error.args}"
             }), 500
 
+#varios productos por id, con los ids en el cuerpo
+@api.route('/productos/batch-get', methods=['POST'])
+def varios_productos():
+    """
+        devuelve los productos de los ids del cuerpo ({"ids": [3, 1, 2]}) en el mismo orden
+        y los ids que no existen en no_encontrados; acepta fields= como GET /productos
+    """
+    campos = get_fields(request.args, Producto.CAMPOS_SERIALIZADOS)
+    ids = get_ids((request.json or {}).get("ids"), current_app.config['MULTI_GET_MAX_IDS'])
+    return json_response(productos_por_ids(ids, campos))
+
+#busqueda de texto completo en titulo y descripcion
+@api.route('/productos/search', methods=['GET'])
+@response_cache.cached("productos")
+def buscar_producto():
+    """
+        devuelve los productos que contienen todas las palabras de q (la ultima
+        como prefijo), ordenados por relevancia y paginados por limit/offset
+    """
+    texto = request.args.get("q", "")
+    if not terminos(texto):
+        return jsonify({
+            "resultado": "Debe indicar el texto a buscar en el parametro q"
+        }), 400
+    campos = get_fields(request.args, Producto.CAMPOS_SERIALIZADOS)
+    consulta = db.session.query(*Producto.columnas_serializadas(campos))
+    categoria_id = get_int_arg(request.args, "categoria_id")
+    if categoria_id is not None:
+        consulta = consulta.filter(Producto.categoria_id == categoria_id)
+    limit, offset = get_page_args(request.args)
+    #se pide una fila de mas para saber si hay una pagina siguiente
+    productos = buscar_productos(consulta, texto).limit(limit + 1).offset(offset).all()
+    return json_response({
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if len(productos) > limit else None,
+        "resultados": Producto.serializar_filas(productos[:limit], campos)
+    })
+
+#conteos por categoria e histograma de precios para los filtros del catalogo
+@api.route('/productos/facets', methods=['GET'])
+@response_cache.cached("productos", "categorias")
+def facetas_productos():
+    """
+        cantidad de productos por categoria y por rango de precio (de bucket de ancho),
+        con los mismos filtros del listado y opcionalmente el texto q de la busqueda.
+        Sin filtros se responde desde el resumen que mantienen las escrituras
+    """
+    ancho = get_int_arg(request.args, "bucket", FACETS_PRICE_BUCKET, minimum=RANGO_PRECIO)
+    if ancho % RANGO_PRECIO:
+        return jsonify({
+            "resultado": f"El parametro bucket debe ser un multiplo de {RANGO_PRECIO}"
+        }), 400
+    texto = request.args.get("q")
+    if texto is not None and not terminos(texto):
+        return jsonify({
+            "resultado": "Debe indicar el texto a buscar en el parametro q"
+        }), 400
+    return json_response(consultar_facetas(filtros_producto(db.session, request.args), texto, ancho))
+
+#exportar el catalogo completo en streaming
+@api.route('/productos/export', methods=['GET'])
+def exportar_productos():
+    """
+        devuelve todos los productos (con los mismos filtros del listado) como NDJSON
+        o CSV. Las filas se leen como tuplas desde un cursor del lado del servidor en
+        lotes de EXPORT_BATCH_SIZE y se escriben a la respuesta a medida que llegan,
+        asi la memoria no crece con el tamaño del catalogo.
+    """
+    formato = request.args.get("format", "ndjson")
+    if formato not in ("ndjson", "csv"):
+        return jsonify({
+            "resultado": "El parametro format debe ser ndjson o csv"
+        }), 400
+    campos = get_fields(request.args, ("id",) + CAMPOS_PRODUCTO)
+    columnas = [Producto.__table__.c[campo] for campo in campos]
+    consulta = (
+        select(columnas)
+        .where(and_(true(), *filtros_producto(db.session, request.args)))
+        .order_by(Producto.id)
+    )
+
+    def filas():
+        #la sesion devuelve la replica elegida para el request, o el primario
+        conexion = db.session.get_bind().connect().execution_options(stream_results=True)
+        try:
+            resultado = conexion.execute(consulta)
+            while True:
+                lote = resultado.fetchmany(EXPORT_BATCH_SIZE)
+                if not lote:
+                    break
+                yield lote
+        finally:
+            conexion.close()
+
+    nombres = [columna.name for columna in columnas]
+    if formato == "csv":
+        def generar():
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(nombres)
+            for lote in filas():
+                escritor.writerows(lote)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        mimetype = "text/csv"
+    else:
+        def generar():
+            for lote in filas():
+                yield b"".join(
+                    dumps(dict(zip(nombres, fila))) + b"\n" for fila in lote
+                )
+        mimetype = "application/x-ndjson"
+    return Response(stream_with_context(generar()), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=productos.{formato}"
+    })
+
+#crear productos en lote desde un arreglo JSON o un stream NDJSON
+@api.route('/productos/bulk', methods=['POST'])
+def crear_productos_bulk():
+    """
+        valida cada fila con las mismas reglas de POST /productos, verifica las
+        categorias referenciadas con una sola consulta por lote (solo las que no se
+        han visto) e inserta por lotes de batch_size filas. Un lote que falla en la
+        base de datos se reintenta fila por fila, asi las filas buenas no se pierden.
+    """
+    batch_size = min(
+        get_int_arg(request.args, "batch_size", current_app.config['BULK_BATCH_SIZE'], minimum=1),
+        MAX_BULK_BATCH_SIZE
+    )
+    if request.mimetype == 'application/x-ndjson':
+        filas = leer_ndjson(request.stream)
+    else:
+        insumos = request.get_json(silent=True)
+        if not isinstance(insumos, list):
+            return jsonify({
+                "resultado": "Debe enviar un arreglo JSON o un stream NDJSON de productos"
+            }), 400
+        filas = enumerate(insumos, 1)
+
+    categorias_existentes = set()
+    categorias_revisadas = set()
+    categorias_afectadas = set()
+    errores = []
+    creados = 0
+    lote = []
+
+    def procesar_lote():
+        nonlocal creados
+        #verificar en una sola consulta las categorias del lote que aun no se conocen
+        nuevas = {insumo["categoria_id"] for _, insumo in lote} - categorias_revisadas
+        if nuevas:
+            categorias_existentes.update(categorias_que_existen(nuevas))
+            categorias_revisadas.update(nuevas)
+        filas_validas = []
+        for numero, insumo in lote:
+            if insumo["categoria_id"] not in categorias_existentes:
+                errores.append({"fila": numero, "resultado": "La categoria no existe"})
+                continue
+            producto = Producto.registrar_producto(
+                insumo["titulo"],
+                insumo["descripcion"],
+                insumo["precio"],
+                insumo["imagen"],
+                insumo["categoria_id"]
+            )
+            filas_validas.append((numero, {
+                "titulo": producto.titulo,
+                "descripcion": producto.descripcion,
+                "precio": producto.precio,
+                "imagen": producto.imagen,
+                "categoria_id": producto.categoria_id
+            }))
+        creados += insertar_lote(filas_validas, errores)
+        categorias_afectadas.update(fila["categoria_id"] for _, fila in filas_validas)
+        lote.clear()
+
+    for numero, insumo in filas:
+        if not isinstance(insumo, dict):
+            errores.append({"fila": numero, "resultado": "La fila debe ser un objeto JSON"})
+            continue
+        #los tipos de cada campo se validan aqui, una fila mala no llega a un lote
+        error = Producto.validar_insumo(insumo)
+        if error is not None:
+            errores.append({"fila": numero, "resultado": error})
+            continue
+        lote.append((numero, insumo))
+        if len(lote) >= batch_size:
+            procesar_lote()
+    if lote:
+        procesar_lote()
+
+    if creados:
+        response_cache.invalidate(
+            "productos", "categorias",
+            *[f"categoria:{categoria_id}" for categoria_id in categorias_afectadas]
+        )
+    errores.sort(key=lambda error: error["fila"])
+    if not errores:
+        status = 201
+    elif creados:
+        status = 207
+    else:
+        status = 400
+    return jsonify({
+        "creados": creados,
+        "errores": errores
+    }), status
+
+def leer_ndjson(stream):
+    """devuelve (numero_fila, insumo) por cada linea no vacia, insumo es None si no es JSON valido"""
+    for numero, linea in enumerate(stream, 1):
+        if not linea.strip():
+            continue
+        try:
+            yield numero, json.loads(linea)
+        except ValueError:
+            yield numero, None
+
+def insertar_lote(filas, errores):
+    """
+        inserta las filas con un solo INSERT multi-fila y un commit.
+        Si el lote falla se reintenta fila por fila para aislar las filas malas.
+    """
+    if not filas:
+        return 0
+    try:
+        db.session.execute(Producto.__table__.insert(), [fila for _, fila in filas])
+        ajustar_resumen(db.session, cambio_de_productos(
+            [], [(fila["categoria_id"], fila["precio"]) for _, fila in filas]
+        ))
+        db.session.commit()
+        return len(filas)
+    except Exception:
+        db.session.rollback()
+    creados = 0
+    for numero, fila in filas:
+        try:
+            db.session.execute(Producto.__table__.insert(), fila)
+            ajustar_resumen(db.session, cambio_de_productos([], [(fila["categoria_id"], fila["precio"])]))
+            db.session.commit()
+            creados += 1
+        except Exception as error:
+            db.session.rollback()
+            errores.append({"fila": numero, "resultado": f"{error.args}"})
+    return creados
+
+#modificar productos en lote con UPDATEs por conjunto, sin cargar objetos del ORM
+@api.route('/productos/bulk', methods=['PATCH'])
+def modificar_productos_bulk():
+    """
+        acepta una lista de cambios [{"id": 1, "precio": 10, ...}] o un filtro con un
+        ajuste de precio {"filtro": {"categoria_id": 2}, "ajuste": {"porcentaje": 10}}.
+        Todo se aplica en una sola transaccion.
+    """
+    insumo = request.get_json(silent=True)
+    try:
+        if isinstance(insumo, list):
+            actualizados, no_encontrados, afectados = actualizar_productos_por_id(insumo)
+        elif isinstance(insumo, dict) and "filtro" in insumo:
+            actualizados, afectados = ajustar_precios(insumo["filtro"], insumo.get("ajuste"))
+            no_encontrados = []
+        else:
+            return jsonify({
+                "resultado": "Debe enviar una lista de cambios o un filtro con un ajuste de precio"
+            }), 400
+        db.session.commit()
+    except APIException:
+        db.session.rollback()
+        raise
+    except Exception as error:
+        db.session.rollback()
+        logger.exception("No se pudieron modificar los productos en lote")
+        return jsonify({
+            "resultado": f"{error.args}"
+        }), 500
+    if afectados:
+        response_cache.invalidate(
+            "productos", "categorias",
+            *[f"producto:{producto_id}" for producto_id, _ in afectados],
+            *{f"categoria:{categoria_id}" for _, categoria_id in afectados}
+        )
+    return jsonify({
+        "actualizados": actualizados,
+        "no_encontrados": no_encontrados
+    }), 200
+
+def actualizar_productos_por_id(cambios):
+    """
+        agrupa los cambios por id y los aplica con un UPDATE ... SET campo = CASE id ... END
+        por cada bloque de ids. Devuelve (actualizados, no_encontrados, afectados)
+        donde afectados son pares (id, categoria_id) antes y despues del cambio.
+    """
+    tabla = Producto.__table__
+    por_id = {}
+    for cambio in cambios:
+        if not isinstance(cambio, dict) or "id" not in cambio:
+            raise APIException("Cada cambio debe ser un objeto con el id del producto")
+        desconocidos = set(cambio) - {"id"} - set(CAMPOS_PRODUCTO)
+        if desconocidos:
+            raise APIException(f"Campos no permitidos: {', '.join(sorted(desconocidos))}")
+        if not es_entero(cambio["id"]):
+            raise APIException("El id de cada cambio debe ser un numero entero")
+        producto_id = cambio["id"]
+        error = Producto.validar_campos(cambio)
+        if error is not None:
+            raise APIException(f"Producto {producto_id}: {error}")
+        campos = por_id.setdefault(producto_id, {})
+        campos.update((campo, valor) for campo, valor in cambio.items() if campo != "id")
+    #las categorias nuevas se verifican con una sola consulta
+    categorias = {campos["categoria_id"] for campos in por_id.values() if "categoria_id" in campos}
+    faltantes = categorias - categorias_que_existen(categorias)
+    if faltantes:
+        producto_id = next(
+            producto_id for producto_id, campos in por_id.items() if campos.get("categoria_id") in faltantes
+        )
+        raise APIException(f"Producto {producto_id}: la categoria {por_id[producto_id]['categoria_id']} no existe")
+
+    ids = list(por_id)
+    encontrados = set()
+    afectados = []
+    actualizados = 0
+    for inicio in range(0, len(ids), BULK_UPDATE_CHUNK):
+        bloque = ids[inicio:inicio + BULK_UPDATE_CHUNK]
+        anteriores = []
+        #las filas del bloque quedan bloqueadas hasta el commit, los valores previos no cambian
+        for producto_id, categoria_id, precio in leer_bloqueando(
+            select([tabla.c.id, tabla.c.categoria_id, tabla.c.precio]).where(tabla.c.id.in_(bloque))
+        ):
+            encontrados.add(producto_id)
+            anteriores.append((categoria_id, precio))
+            afectados.append((producto_id, categoria_id))
+            nueva_categoria = por_id[producto_id].get("categoria_id", categoria_id)
+            if nueva_categoria != categoria_id:
+                afectados.append((producto_id, nueva_categoria))
+        valores = {}
+        for campo in CAMPOS_PRODUCTO:
+            casos = {
+                producto_id: por_id[producto_id][campo]
+                for producto_id in bloque if campo in por_id[producto_id]
+            }
+            if casos:
+                valores[campo] = case(casos, value=tabla.c.id, else_=tabla.c[campo])
+        if valores:
+            #cada producto del bloque cambia de version, los If-Match anteriores ya no coinciden
+            valores["version"] = tabla.c.version + 1
+            resultado = db.session.execute(
+                tabla.update().where(tabla.c.id.in_(bloque)).values(valores)
+            )
+            actualizados += resultado.rowcount
+            if "precio" in valores or "categoria_id" in valores:
+                #el resumen de facetas se ajusta con los valores que quedaron en la base
+                nuevos = db.session.query(Producto.categoria_id, Producto.precio).filter(Producto.id.in_(bloque))
+                ajustar_resumen(db.session, cambio_de_productos(anteriores, nuevos))
+        else:
+            actualizados += len(encontrados.intersection(bloque))
+    return actualizados, [producto_id for producto_id in ids if producto_id not in encontrados], afectados
+
+def ajustar_precios(filtro, ajuste):
+    """
+        aplica un ajuste porcentual o absoluto al precio de los productos que cumplen
+        el filtro (ids, categoria_id, precio_min, precio_max) con un solo UPDATE.
+        Devuelve (actualizados, afectados).
+    """
+    tabla = Producto.__table__
+    if not isinstance(filtro, dict) or not filtro:
+        raise APIException("Debe indicar al menos un criterio en el filtro")
+    desconocidos = set(filtro) - {"ids", "categoria_id", "precio_min", "precio_max"}
+    if desconocidos:
+        raise APIException(f"Criterios de filtro no permitidos: {', '.join(sorted(desconocidos))}")
+    for criterio in ("categoria_id", "precio_min", "precio_max"):
+        if criterio in filtro and not es_entero(filtro[criterio]):
+            raise APIException(f"El criterio {criterio} debe ser un numero entero")
+    condiciones = []
+    if "ids" in filtro:
+        if not isinstance(filtro["ids"], list) or not all(es_entero(fila_id) for fila_id in filtro["ids"]):
+            raise APIException("El criterio ids debe ser una lista de numeros enteros")
+        condiciones.append(tabla.c.id.in_(filtro["ids"]))
+    if "categoria_id" in filtro:
+        condiciones.append(tabla.c.categoria_id == filtro["categoria_id"])
+    if "precio_min" in filtro:
+        condiciones.append(tabla.c.precio >= filtro["precio_min"])
+    if "precio_max" in filtro:
+        condiciones.append(tabla.c.precio <= filtro["precio_max"])
+
+    if not isinstance(ajuste, dict) or len(ajuste) != 1 or not (
+        (isinstance(ajuste.get("porcentaje"), (int, float)) and not isinstance(ajuste["porcentaje"], bool)) or
+        es_entero(ajuste.get("monto"))
+    ):
+        raise APIException(
+            "Debe indicar un ajuste con porcentaje (numero) o monto (entero)"
+        )
+    if "porcentaje" in ajuste:
+        nuevo_precio = db.func.round(tabla.c.precio * (100 + ajuste["porcentaje"]) / 100.0)
+    else:
+        nuevo_precio = tabla.c.precio + ajuste["monto"]
+
+    #los productos del filtro quedan bloqueados antes de contar sus rangos de precio
+    afectados = leer_bloqueando(select([tabla.c.id, tabla.c.categoria_id]).where(and_(*condiciones))).fetchall()
+    ajustar_rangos_de_precio(db.session, condiciones, nuevo_precio)
+    resultado = db.session.execute(
+        tabla.update().where(and_(*condiciones)).values(precio=nuevo_precio, version=tabla.c.version + 1)
+    )
+    return resultado.rowcount, afectados
+
 #Consulta, edicion, borrar
-@app.route('/productos/<producto_id>', methods=['GET','PATCH','DELETE'])
+@api.route('/productos/<producto_id>', methods=['GET','PATCH','DELETE'])
+@response_cache.cached("producto:{producto_id}")
 def rud_productos(producto_id):
+    if request.method == 'PATCH':
+        #recuperar diccionar del body del request
+        diccionario = request.json or {}
+        valores = {campo: diccionario[campo] for campo in CAMPOS_PRODUCTO if campo in diccionario}
+        #los campos se validan antes de escribir, el resumen de facetas usa el precio como numero
+        error = Producto.validar_campos(valores)
+        if error is None and "categoria_id" in valores and not categorias_que_existen({valores["categoria_id"]}):
+            error = "La categoria no existe"
+        if error is not None:
+            return jsonify({
+                "resultado": error
+            }), 400
+        #con If-Match solo se actualiza si la version no cambio (412 si cambio)
+        versiones = get_if_match(request.if_match)
+        #actualizar con un solo UPDATE ... WHERE id; la categoria anterior hace falta para el cache
+        #y con el precio anterior para el resumen de facetas (solo se leen antes si cambian y no hay RETURNING)
+        try:
+            producto = actualizar_por_id(
+                Producto, producto_id, valores, anteriores=("categoria_id", "precio"), versiones=versiones
+            )
+            if producto is not None:
+                ajustar_resumen(db.session, cambio_de_productos(
+                    [(producto.anterior_categoria_id, producto.anterior_precio)],
+                    [(producto.categoria_id, producto.precio)]
+                ))
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("No se pudo modificar el producto %s", producto_id)
+            return jsonify({
+                "resultado": f"{error.args}"
+            }), 500
+        if producto is None:
+            return conflicto_de_version(Producto, producto_id, "La producto no existe")
+        response_cache.invalidate(
+            "productos", f"producto:{producto_id}", "categorias",
+            f"categoria:{producto.anterior_categoria_id}", f"categoria:{producto.categoria_id}"
+        )
+        #devolver la producto serializada, con la nueva version en el ETag
+        respuesta = jsonify(Producto.serializar_filas([producto])[0])
+        respuesta.set_etag(representation_etag(producto.version, respuesta.get_data()))
+        return respuesta, 200
+    if request.method == 'DELETE':
+        #remover la producto de la BD con un solo DELETE ... WHERE id
+        #con If-Match solo se borra si la version no cambio (412 si cambio)
+        versiones = get_if_match(request.if_match)
+        try:
+            producto = borrar_por_id(
+                Producto, producto_id, devolver=("categoria_id", "precio"), versiones=versiones
+            )
+            if producto is not None:
+                ajustar_resumen(db.session, cambio_de_productos([(producto.categoria_id, producto.precio)], []))
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("No se pudo borrar el producto %s", producto_id)
+            return jsonify({
+                "resultado": f"{error.args}"
+            }), 500
+        if producto is None:
+            return conflicto_de_version(Producto, producto_id, "La producto no existe")
+        response_cache.invalidate(
+            "productos", f"producto:{producto_id}", "categorias",
+            f"categoria:{producto.categoria_id}"
+        )
+        #devolver delete exitoso
+        return jsonify({
+            "resultado": "Se ha eliminado la producto exitosamente"
+        }), 200
+    #con fields= solo se cargan las columnas pedidas, el resto queda diferido
+    campos = get_fields(request.args, Producto.CAMPOS_SERIALIZADOS)
     #Crear una vairable y asignar una cat en especifico
-    producto = Producto.query.get(producto_id)
+    producto = Producto.query.options(load_only(*campos, "version")).get(producto_id)
     #Validar si la producto existe
-    if isinstance(producto, Producto):
-        if request.method == 'GET':            
-            #devolver lista de productos serializadas
-            return jsonify(producto.serialize()), 200
-        elif request.method == 'PATCH':
-            #recuperar diccionar del body del request
-            diccionario = request.json
-            #actualizar propiedades que vengan en el dicc
-            producto.modificar_producto(diccionario)
-            #guardar cambio en BD, hacer commit
-            try:
-                db.session.commit()
-                #devolver la producto serializada
-                return jsonify(producto.serialize()), 200
-            except Exception as error:
-                db.session.rollback()
-                print(f"{error.args} {type(error)}")
-                return jsonify({
-                    "resultado": f"{error.args}"
-                }), 500
-        else:
-            #remover la producto de  la BD, hacer commit, return 204
-            db.session.delete(producto)
-            try:
-                db.session.commit()
-                #devolver delete exitoso
-                return jsonify({
-                    "resultado": "Se ha eliminado la producto exitosamente"
-                }), 200
-            except Exception as error:
-                db.session.rollback()
-                print(f"{error.args} {type(error)}")
-                return jsonify({
-                    "resultado": f"{error.args}"
-                }), 500
-    else:
+    if producto is None:
         return jsonify({
             "resultado":"La producto no existe"
         }), 404
+    #devolver el producto serializado; el ETag lleva la version y el hash del cuerpo (cambia con fields=)
+    respuesta = jsonify(producto.serialize(campos))
+    respuesta.set_etag(representation_etag(producto.version, respuesta.get_data()))
+    return respuesta, 200
 
 #======================================
 #endpoints productos
 #======================================
-@app.route('/users/register', methods=['POST'])
+@api.route('/users/register', methods=['POST'])
 def registar_usuario():
     if request.method == 'POST':
         insumo_usuario = request.json
-        if insumo_usuario is None:
-            return jsonify ({
-                "resultado": "No envio la informacion para crear el producto"
-            }),400
-        if (
-            "email" not in insumo_usuario or 
-            "password" not in insumo_usuario
-            ):
+        error = User.validar_insumo(insumo_usuario)
+        if error is not None:
             return jsonify({
-                "resultado": "Debe indicar un email y password"
+                "resultado": error
             }),400
-        #Validar que no venga vacio
-        if (
-            insumo_usuario["email"] == "" or
-            insumo_usuario["password"] == "" 
-        ):
-            return jsonify({
-                "resultado": "Debe indicar un email y password"
-            })
         nuevo_usuario = User.registro_usuario(
             insumo_usuario["email"],
             insumo_usuario["password"]
@@ -311,7 +1070,7 @@ def registar_usuario():
             return jsonify(nuevo_usuario.serialize()),201
         except Exception as error:
             db.session.rollback()
-            print(f"{error.args} {type(error)}")
+            logger.exception("No se pudo registrar el usuario")
             return jsonify({
                 "resultado": f"{error.args}"
             }), 500
@@ -320,4 +1079,4 @@ def registar_usuario():
 # this only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,152 @@
+"""
+Instrumentacion por request: cuenta sentencias SQL y tiempo en base de datos,
+agrega el header Server-Timing, registra las consultas lentas y expone
+histogramas en formato Prometheus en /metrics.
+
+Las metricas viven en memoria de cada proceso; con varios workers cada uno
+expone las suyas y Prometheus las agrega por instancia.
+"""
+import bisect
+import logging
+import threading
+import time
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("shopfix.sql")
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SENTENCIAS = (1, 2, 3, 5, 10, 20, 50, 100)
+#caracteres de la sentencia en el log de consultas lentas (los INSERT/UPDATE en lote son enormes)
+MAX_SENTENCIA_LOG = 500
+
+
+class Histogram:
+    """histograma acumulado por combinacion de etiquetas"""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            serie = self._series.get(label_values)
+            if serie is None:
+                serie = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            indice = bisect.bisect_left(self.buckets, value)
+            if indice < len(self.buckets):
+                serie[0][indice] += 1
+            serie[1] += 1
+            serie[2] += value
+
+    def render(self):
+        lineas = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for label_values, (conteos, total, suma) in series:
+                etiquetas = ",".join(
+                    f'{nombre}="{valor}"' for nombre, valor in zip(self.labels, label_values)
+                )
+                acumulado = 0
+                for limite, conteo in zip(self.buckets, conteos):
+                    acumulado += conteo
+                    lineas.append(f'{self.name}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                lineas.append(f'{self.name}_bucket{{{etiquetas},le="+Inf"}} {total}')
+                lineas.append(f"{self.name}_count{{{etiquetas}}} {total}")
+                lineas.append(f"{self.name}_sum{{{etiquetas}}} {suma}")
+        return "\n".join(lineas)
+
+
+class RequestMetrics:
+    """middleware de metricas, se engancha a los eventos del engine y a los hooks de Flask"""
+
+    def __init__(self, app=None):
+        self.duration = Histogram(
+            "shopfix_http_request_duration_seconds",
+            "Duracion de los requests HTTP.",
+            ("endpoint", "method", "status"), BUCKETS_SEGUNDOS
+        )
+        self.statements = Histogram(
+            "shopfix_http_request_sql_statements",
+            "Sentencias SQL ejecutadas por request.",
+            ("endpoint", "status"), BUCKETS_SENTENCIAS
+        )
+        self.db_time = Histogram(
+            "shopfix_http_request_sql_duration_seconds",
+            "Tiempo en base de datos por request.",
+            ("endpoint", "status"), BUCKETS_SEGUNDOS
+        )
+        self.histograms = [self.duration, self.statements, self.db_time]
+        self.collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_MS', 200)
+        #escucha todos los engines, incluidas las replicas de lectura
+        if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+            event.listen(Engine, "handle_error", handle_error)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        app.extensions['request_metrics'] = self
+
+    def start_request(self):
+        g.inicio_request = time.perf_counter()
+        g.sql_sentencias = 0
+        g.sql_segundos = 0.0
+
+    def finish_request(self, response):
+        if "inicio_request" not in g:
+            return response
+        total = time.perf_counter() - g.inicio_request
+        endpoint = request.endpoint or "desconocido"
+        status = str(response.status_code)
+        self.duration.observe(total, endpoint, request.method, status)
+        self.statements.observe(g.sql_sentencias, endpoint, status)
+        self.db_time.observe(g.sql_segundos, endpoint, status)
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={g.sql_segundos * 1000:.2f};desc="{g.sql_sentencias} sentencias", '
+            f"total;dur={total * 1000:.2f}"
+        )
+        return response
+
+    def add_collector(self, collector):
+        """registra una funcion que devuelve lineas extra en formato Prometheus"""
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def expose(self):
+        partes = [histograma.render() for histograma in self.histograms]
+        partes.extend(collector() for collector in self.collectors)
+        return Response("\n".join(partes) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_sentencia", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duracion = time.perf_counter() - conn.info["inicio_sentencia"].pop()
+    if has_request_context() and "sql_sentencias" in g:
+        g.sql_sentencias += 1
+        g.sql_segundos += duracion
+    limite = current_app.config.get('SLOW_QUERY_MS', 200) if has_app_context() else 200
+    if duracion * 1000 >= limite:
+        logger.warning("consulta lenta (%.1f ms): %s", duracion * 1000, statement[:MAX_SENTENCIA_LOG])
+
+def handle_error(context):
+    #la sentencia que fallo no llega a after_cursor_execute: se descarta su inicio, si no la pila
+    #crece en la conexion del pool y las siguientes se miden contra el inicio equivocado.
+    #Sin execution_context fallo al compilar, antes de before_cursor_execute
+    if context.connection is not None and context.execution_context is not None:
+        pila = context.connection.info.get("inicio_sentencia")
+        if pila:
+            pila.pop()
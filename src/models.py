@@ -1,13 +1,140 @@
-from flask_sqlalchemy import SQLAlchemy
+import secrets
+from datetime import datetime
+from sqlalchemy import DDL, event
+from sqlalchemy.engine import Engine
+from replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+#SQLAlchemy de Flask-SQLAlchemy con una sesion que puede leer de las replicas
+db = RoutingSQLAlchemy()
+
+class ContadorCambio(db.Model):
+    """
+        ultimo numero de cambio de categorias, productos y eliminaciones (GET /changes),
+        una sola fila. Las filas anteriores al feed quedan en el cambio 1
+    """
+    __tablename__ = "contador_cambio"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    valor = db.Column(db.BigInteger, nullable=False)
+
+event.listen(
+    ContadorCambio.__table__, "after_create",
+    DDL("INSERT INTO contador_cambio (id, valor) VALUES (1, 1)")
+)
+
+def tomar_cambios(conexion, cantidad=1):
+    """
+        reserva cantidad numeros de cambio en la transaccion de conexion y devuelve el primero.
+        El UPDATE bloquea la fila del contador hasta el commit, asi las transacciones
+        hacen commit en el orden de sus numeros; por eso solo se llama al confirmar
+        (confirmar_cambios), cuando la transaccion ya no espera otros locks
+    """
+    tabla = ContadorCambio.__table__
+    sentencia = tabla.update().where(tabla.c.id == 1).values(valor=tabla.c.valor + cantidad)
+    if conexion.dialect.implicit_returning:
+        ultimo = conexion.execute(sentencia.returning(tabla.c.valor)).scalar()
+    else:
+        conexion.execute(sentencia)
+        ultimo = conexion.execute(db.select([tabla.c.valor]).where(tabla.c.id == 1)).scalar()
+    return ultimo - cantidad + 1
+
+def cambio_pendiente(conexion, tabla=None):
+    """
+        marca de cambio de las filas de tabla que escribe la transaccion de conexion: un
+        numero negativo propio de la transaccion, que GET /changes no entrega. Al commit
+        confirmar_cambios la reemplaza por el numero de cambio de la transaccion en las
+        tablas registradas
+    """
+    pendiente = conexion.info.get("cambio_pendiente")
+    if pendiente is None:
+        pendiente = conexion.info["cambio_pendiente"] = (-1 - secrets.randbits(62), set())
+    if tabla is not None:
+        pendiente[1].add(tabla)
+    return pendiente[0]
+
+def siguiente_cambio(context):
+    """
+        cambio de la fila que escribe la sentencia: la marca de su transaccion, todas
+        sus filas quedan con el mismo numero y GET /changes desempata por id.
+        La tabla se registra despues de ejecutar, si la sentencia escribio filas
+    """
+    context.tabla_con_cambio = context.compiled.statement.table
+    return cambio_pendiente(context.connection)
+
+@event.listens_for(Engine, "after_cursor_execute")
+def registrar_tabla_con_cambio(conexion, cursor, statement, parameters, context, executemany):
+    #un UPDATE o DELETE sin filas no deja nada que numerar al confirmar
+    tabla = getattr(context, "tabla_con_cambio", None)
+    if tabla is not None and (executemany or cursor.rowcount != 0):
+        cambio_pendiente(conexion, tabla)
+
+@event.listens_for(Engine, "commit")
+def confirmar_cambios(conexion):
+    """
+        justo antes del commit toma un solo numero del contador y lo pone en las filas
+        marcadas por la transaccion. Las filas ya estan bloqueadas por la misma
+        transaccion, asi el lock del contador dura estas sentencias y el commit, no
+        la transaccion entera, y no se espera ningun otro lock teniendolo
+    """
+    marca, tablas = conexion.info.pop("cambio_pendiente", (None, ()))
+    if not tablas:
+        return
+    numero = tomar_cambios(conexion)
+    for tabla in sorted(tablas, key=lambda tabla: tabla.name):
+        conexion.execute(tabla.update().where(tabla.c.cambio == marca).values(cambio=numero))
+
+@event.listens_for(Engine, "rollback")
+def descartar_cambios(conexion):
+    #una conexion invalidada pierde su info con la conexion de la base
+    if not conexion.invalidated:
+        conexion.info.pop("cambio_pendiente", None)
+
+def bloquear_escritura(conexion):
+    """
+        SQLite no tiene FOR UPDATE y pysqlite abre la transaccion recien en la primera
+        escritura, asi una lectura anterior no queda protegida. Esto abre la transaccion
+        con BEGIN IMMEDIATE, que toma el lock de escritura de la base; en los demas
+        dialectos no hace nada (el FOR UPDATE de la lectura bloquea las filas)
+    """
+    if conexion.dialect.name == "sqlite" and not conexion.connection.connection.in_transaction:
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+def columna_cambio():
+    return db.Column(db.BigInteger, nullable=False, default=siguiente_cambio, onupdate=siguiente_cambio)
+
+def es_entero(valor):
+    """True si valor es un int de JSON (True/False no cuentan como numeros)"""
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+def columna_updated_at():
+    return db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+        server_default=db.func.current_timestamp()
+    )
 
 class Categoria(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(25), unique=True, nullable=False)
     descripcion = db.Column(db.String(80), nullable=False)
     icono = db.Column(db.String(80), nullable=False)
-    productos = db.relationship('Producto', lazy=True)
+    #categoria padre (None en las raices); ruta son los ids de sus ancestros, ver arbol.py
+    padre_id = db.Column(
+        db.Integer, db.ForeignKey('categoria.id', name='fk_categoria_padre_id_categoria', ondelete='SET NULL'),
+        nullable=True, index=True
+    )
+    ruta = db.Column(db.String(255), nullable=False, default="", server_default="", index=True)
+    #cada UPDATE la incrementa; va en el ETag de la categoria y se compara con If-Match
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    #fecha (UTC) y numero del ultimo cambio, para GET /changes
+    updated_at = columna_updated_at()
+    cambio = columna_cambio()
+    #al borrar la categoria la base pone categoria_id en NULL (ON DELETE SET NULL), el ORM no carga los productos
+    productos = db.relationship('Producto', lazy=True, backref='categoria', passive_deletes=True)
+
+    #columnas que devuelve serializar(), los listados las leen como tuplas
+    CAMPOS_SERIALIZADOS = ("id", "nombre", "descripcion", "icono", "padre_id")
+    __table_args__ = (db.Index('ix_categoria_cambio_id', 'cambio', 'id'),)
+    #el ORM (ej: el admin) tambien incrementa y verifica la version al guardar
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return '<Categoria %s>' % self.nombre
@@ -18,6 +145,26 @@ class Categoria(db.Model):
         self.descripcion = descripcion
         self.icono = icono
 
+    @staticmethod
+    def validar_insumo(insumo):
+        """devuelve el mensaje de error del insumo para crear una categoria, o None si es valido"""
+        if insumo is None:
+            return "No envio la informacion para crear la categoria"
+        if (
+            "nombre" not in insumo or
+            "descripcion" not in insumo or
+            "icono" not in insumo
+            ):
+            return "Debe indicar un nombre, descripcion e icono para crear la categoria"
+        #Validar que no venga vacio
+        if (
+            insumo["nombre"] == "" or
+            insumo["descripcion"] == "" or
+            insumo["icono"] == ""
+        ):
+            return "Debe indicar un nombre, descripcion e icono para crear la categoria"
+        return None
+
     @classmethod
     def registrar_categoria(cls, nombre, descripcion, icono):
         """
@@ -40,23 +187,107 @@ class Categoria(db.Model):
             self.icono = diccionario["icono"]
         return True
 
-    def serializar(self):
-        return{
+    def serializar(self, cantidad_productos, productos=None):
+        resultado = {
             "id": self.id,
             "nombre": self.nombre,
             "descripcion": self.descripcion,
             "icono": self.icono,
-            "productos_en_categoria": list(map(lambda x: x.serialize(), self.productos))
+            "padre_id": self.padre_id,
+            "cantidad_productos": cantidad_productos
         }
+        if productos is not None:
+            resultado["productos_en_categoria"] = list(map(lambda x: x.serialize(), productos))
+        return resultado
+
+    @classmethod
+    def columnas_serializadas(cls, campos=None):
+        """columnas de los campos pedidos (sin repetir), por defecto todas las serializadas"""
+        campos = cls.CAMPOS_SERIALIZADOS if campos is None else campos
+        return [getattr(cls, campo) for campo in dict.fromkeys(campos) if campo in cls.CAMPOS_SERIALIZADOS]
+
+    @classmethod
+    def serializar_lista(
+        cls, categorias, incluir_productos=False, productos_por_categoria=20, campos=None, sesion=None
+    ):
+        """
+            serializa varias categorias (instancias o tuplas de columnas_serializadas())
+            sin recorrer la relacion productos: los conteos salen de una sola consulta
+            agregada y, si se piden, los productos de una sola consulta IN limitada
+            por categoria, leidos como tuplas.
+            campos limita las llaves del resultado (CAMPOS_SERIALIZADOS y cantidad_productos);
+            si no incluye cantidad_productos no se cuenta. sesion es db.session si no se indica
+        """
+        campos = cls.CAMPOS_SERIALIZADOS + ("cantidad_productos",) if campos is None else campos
+        sesion = db.session if sesion is None else sesion
+        ids = [categoria.id for categoria in categorias]
+        cantidades = {}
+        productos = {}
+        if ids and "cantidad_productos" in campos:
+            cantidades = dict(
+                sesion.query(Producto.categoria_id, db.func.count(Producto.id))
+                .filter(Producto.categoria_id.in_(ids))
+                .group_by(Producto.categoria_id)
+                .all()
+            )
+        if ids and incluir_productos:
+            numerados = (
+                sesion.query(
+                    Producto.id.label("id"),
+                    db.func.row_number().over(
+                        partition_by=Producto.categoria_id,
+                        order_by=Producto.id
+                    ).label("posicion")
+                )
+                .filter(Producto.categoria_id.in_(ids))
+                .subquery()
+            )
+            consulta = (
+                sesion.query(*Producto.columnas_serializadas())
+                .join(numerados, Producto.id == numerados.c.id)
+                .filter(numerados.c.posicion <= productos_por_categoria)
+                .order_by(Producto.categoria_id, Producto.id)
+            )
+            for producto in Producto.serializar_filas(consulta):
+                productos.setdefault(producto["categoria_id"], []).append(producto)
+        resultado = []
+        for categoria in categorias:
+            serializada = {
+                campo: getattr(categoria, campo) for campo in campos if campo in cls.CAMPOS_SERIALIZADOS
+            }
+            if "cantidad_productos" in campos:
+                serializada["cantidad_productos"] = cantidades.get(categoria.id, 0)
+            if incluir_productos:
+                serializada["productos_en_categoria"] = productos.get(categoria.id, [])
+            resultado.append(serializada)
+        return resultado
 
 
 class Producto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    titulo = db.Column(db.String(50), unique=False, nullable=False)
+    titulo = db.Column(db.String(50), unique=False, nullable=False, index=True)
     descripcion = db.Column(db.String(100), unique=False, nullable=False)
     precio = db.Column(db.Integer, unique=False, nullable=False)
     imagen = db.Column(db.String(150), unique=False, nullable=True)
-    categoria_id = db.Column(db.Integer, db.ForeignKey(Categoria.id))
+    categoria_id = db.Column(
+        db.Integer,
+        db.ForeignKey(Categoria.id, name='fk_producto_categoria_id_categoria', ondelete='SET NULL'),
+        index=True
+    )
+    #cada UPDATE la incrementa; va en el ETag del producto y se compara con If-Match
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    #fecha (UTC) y numero del ultimo cambio, para GET /changes
+    updated_at = columna_updated_at()
+    cambio = columna_cambio()
+    #columnas que devuelve serialize(), los listados las leen como tuplas
+    CAMPOS_SERIALIZADOS = ("id", "titulo", "descripcion", "imagen", "precio", "categoria_id")
+    #(precio, id) sirve al orden por precio y a la paginacion por cursor, (cambio, id) a GET /changes
+    __table_args__ = (
+        db.Index('ix_producto_precio_id', 'precio', 'id'),
+        db.Index('ix_producto_cambio_id', 'cambio', 'id'),
+    )
+    #el ORM (ej: el admin) tambien incrementa y verifica la version al guardar
+    __mapper_args__ = {"version_id_col": version}
 
 
     def __init__(self, titulo, descripcion, precio, imagen, categoria_id):
@@ -70,6 +301,59 @@ class Producto(db.Model):
     def __repr__(self):
         return '<Producto %s>' % self.titulo
   
+    @staticmethod
+    def validar_insumo(insumo):
+        """devuelve el mensaje de error del insumo para crear un producto, o None si es valido"""
+        if insumo is None:
+            return "No envio la informacion para crear el producto"
+        if (
+            "titulo" not in insumo or
+            "descripcion" not in insumo or
+            "precio" not in insumo or
+            "imagen" not in insumo or
+            "categoria_id" not in insumo
+            ):
+            return "Debe indicar un titulo, descripcion, precio, imagen y categoria para crear el producto"
+        #Validar que no venga vacio
+        if (
+            insumo["titulo"] == "" or
+            insumo["descripcion"] == "" or
+            insumo["precio"] == "" or
+            insumo["imagen"] == "" or
+            insumo["categoria_id"] == ""
+        ):
+            return "Debe indicar un titulo, descripcion, precio, imagen y categoria para crear el producto"
+        #Validar los tipos antes de normalizar o escribir
+        return Producto.validar_campos(insumo)
+
+    @staticmethod
+    def validar_campos(valores):
+        """devuelve el mensaje de error de los campos presentes en valores (ej: los de un PATCH), o None si son validos"""
+        textos = [valores[campo] for campo in ("titulo", "descripcion") if campo in valores]
+        #la imagen es opcional (nullable), null la deja sin imagen
+        if valores.get("imagen") is not None:
+            textos.append(valores["imagen"])
+        if not all(isinstance(texto, str) for texto in textos):
+            return "El titulo, la descripcion y la imagen deben ser texto"
+        if "" in textos:
+            return "El titulo, la descripcion y la imagen no pueden estar vacios"
+        if "categoria_id" in valores and not es_entero(valores["categoria_id"]):
+            return "categoria_id debe ser un numero entero"
+        if "precio" in valores:
+            return Producto.validar_precio(valores["precio"])
+        return None
+
+    @staticmethod
+    def validar_precio(precio):
+        """devuelve el mensaje de error si el precio no es un numero entero, o None si es valido"""
+        if isinstance(precio, str):
+            precio = precio.strip()
+            if precio.lstrip("-").isdigit():
+                return None
+        elif es_entero(precio):
+            return None
+        return "El precio debe ser un numero entero"
+
     @classmethod
     def registrar_producto(cls,titulo, descripcion, precio, imagen, categoria_id):
         nuevo_producto= cls(
@@ -94,7 +378,27 @@ class Producto(db.Model):
             self.categoria_id = diccionario["categoria_id"]
         return True
 
-    def serialize(self):
+    @classmethod
+    def columnas_serializadas(cls, campos=None):
+        """columnas de los campos pedidos (sin repetir), por defecto todas las serializadas"""
+        campos = cls.CAMPOS_SERIALIZADOS if campos is None else campos
+        return [getattr(cls, campo) for campo in dict.fromkeys(campos)]
+
+    @classmethod
+    def serializar_filas(cls, filas, campos=None):
+        """
+            serializa tuplas de columnas_serializadas() sin crear objetos del ORM.
+            Con campos solo se devuelven esas llaves (las filas pueden traer columnas de mas)
+        """
+        if campos is None or campos == cls.CAMPOS_SERIALIZADOS:
+            campos = cls.CAMPOS_SERIALIZADOS
+            return [dict(zip(campos, fila)) for fila in filas]
+        return [{campo: getattr(fila, campo) for campo in campos} for fila in filas]
+
+    def serialize(self, campos=None):
+        if campos is not None:
+            #solo los campos pedidos, sin tocar las columnas diferidas
+            return {campo: getattr(self, campo) for campo in campos}
         return {
             "id": self.id,
             "titulo": self.titulo,
@@ -104,6 +408,33 @@ class Producto(db.Model):
             "categoria_id": self.categoria_id
         }
 
+class Eliminacion(db.Model):
+    """registro (tombstone) de una categoria o producto borrado, para GET /changes"""
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    entidad_id = db.Column(db.Integer, nullable=False)
+    eliminado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    cambio = db.Column(db.BigInteger, nullable=False, default=siguiente_cambio)
+    __table_args__ = (db.Index('ix_eliminacion_cambio_id', 'cambio', 'id'),)
+
+    def __repr__(self):
+        return '<Eliminacion %s %s>' % (self.tipo, self.entidad_id)
+
+class ResumenFaceta(db.Model):
+    """
+        conteo de productos por categoria (faceta "categoria", valor = categoria_id,
+        0 sin categoria) y por rango de precio (faceta "precio", valor = inicio del rango),
+        lo mantienen las escrituras de productos para GET /productos/facets
+    """
+    __tablename__ = "resumen_faceta"
+    faceta = db.Column(db.String(20), primary_key=True)
+    valor = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<ResumenFaceta %s %s>' % (self.faceta, self.valor)
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -118,8 +449,26 @@ class User(db.Model):
     def __repr__(self):
         return '<User %s>' % self.email
 
+    @staticmethod
+    def validar_insumo(insumo):
+        """devuelve el mensaje de error del insumo para registrar un usuario, o None si es valido"""
+        if insumo is None:
+            return "No envio la informacion para crear el producto"
+        if (
+            "email" not in insumo or 
+            "password" not in insumo
+            ):
+            return "Debe indicar un email y password"
+        #Validar que no venga vacio
+        if (
+            insumo["email"] == "" or
+            insumo["password"] == "" 
+        ):
+            return "Debe indicar un email y password"
+        return None
+
     @classmethod
-    def registro_usuario(cls,email,password,is_admin):
+    def registro_usuario(cls,email,password,is_admin=False):
         nuevo_usuario =cls(
             email.lower(),
             password,
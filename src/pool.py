@@ -0,0 +1,139 @@
+"""
+Pool de conexiones configurable por variables de entorno (DB_POOL_SIZE,
+DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING y
+DB_STATEMENT_TIMEOUT_MS) y metricas de espera y saturacion de cada pool.
+
+SQLite no usa QueuePool (Flask-SQLAlchemy usa NullPool para archivos), asi
+que ahi solo aplica pre-ping; sus conexiones activan las llaves foraneas para
+que se cumplan los ON DELETE.
+"""
+import threading
+import time
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
+from metrics import BUCKETS_SEGUNDOS, Histogram
+
+ESPERA = Histogram(
+    "shopfix_db_pool_checkout_wait_seconds",
+    "Espera para obtener una conexion del pool.",
+    ("pool",), BUCKETS_SEGUNDOS
+)
+#nombre -> engine; se lee engine.pool al exponer porque dispose() crea un pool nuevo
+ENGINES = {}
+TIMEOUTS = {}
+_lock = threading.Lock()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool que mide cuanto espera cada checkout"""
+    nombre = "primario"
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            with _lock:
+                TIMEOUTS[self.nombre] = TIMEOUTS.get(self.nombre, 0) + 1
+            raise
+        finally:
+            ESPERA.observe(time.perf_counter() - inicio, self.nombre)
+
+    def recreate(self):
+        pool = QueuePool.recreate(self)
+        pool.nombre = self.nombre
+        return pool
+
+
+def engine_options(sa_url, config):
+    """opciones de create_engine segun la configuracion y el dialecto de la url"""
+    opciones = {"pool_pre_ping": config.get('DB_POOL_PRE_PING', True)}
+    if sa_url.drivername.startswith("sqlite"):
+        return opciones
+    opciones.update({
+        "poolclass": MeteredQueuePool,
+        "pool_size": config.get('DB_POOL_SIZE', 5),
+        "max_overflow": config.get('DB_MAX_OVERFLOW', 10),
+        "pool_timeout": config.get('DB_POOL_TIMEOUT', 30),
+        "pool_recycle": config.get('DB_POOL_RECYCLE', 1800),
+    })
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout and sa_url.drivername.startswith("postgresql"):
+        opciones["connect_args"] = {"options": f"-c statement_timeout={int(timeout)}"}
+    return opciones
+
+
+def activar_llaves_foraneas(dbapi_connection, connection_record):
+    """SQLite ignora las llaves foraneas (y su ON DELETE) si no se activan en cada conexion"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    cursor.close()
+
+
+def create_pooled_engine(sa_url, opciones, config, nombre):
+    """
+        crea el engine con las opciones de engine_options() ya aplicadas, agrega el
+        limite por sentencia de MySQL, activa las llaves foraneas de SQLite y
+        registra el pool para las metricas
+    """
+    engine = create_engine(sa_url, **opciones)
+    timeout = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout and engine.dialect.name == "mysql":
+        #MySQL solo limita los SELECT, con max_execution_time por sesion
+        @event.listens_for(engine, "connect")
+        def limitar_sentencias(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET SESSION max_execution_time = {int(timeout)}")
+            cursor.close()
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", activar_llaves_foraneas)
+    if isinstance(engine.pool, MeteredQueuePool):
+        engine.pool.nombre = nombre
+        with _lock:
+            ENGINES[nombre] = engine
+    return engine
+
+
+def dispose_engines(app):
+    """
+        descarta las conexiones heredadas al hacer fork (gunicorn post_fork), cada
+        worker abre las suyas; close=False no las cierra porque siguen siendo del padre
+    """
+    with app.app_context():
+        app.extensions['sqlalchemy'].db.get_engine(app).dispose(close=False)
+    replicas = app.extensions.get('read_replicas')
+    if replicas is not None:
+        for replica in replicas.replicas:
+            replica.engine.dispose(close=False)
+
+
+def pool_prometheus():
+    """espera, timeouts y ocupacion de cada pool en formato Prometheus"""
+    lineas = [ESPERA.render()]
+    metricas = [
+        ("shopfix_db_pool_timeouts_total", "counter", "Checkouts que agotaron DB_POOL_TIMEOUT."),
+        ("shopfix_db_pool_size", "gauge", "Conexiones permanentes del pool."),
+        ("shopfix_db_pool_checked_out", "gauge", "Conexiones en uso."),
+        ("shopfix_db_pool_overflow", "gauge", "Conexiones abiertas por encima de pool_size."),
+        ("shopfix_db_pool_saturation", "gauge", "Conexiones en uso sobre pool_size + max_overflow."),
+    ]
+    with _lock:
+        engines = sorted(ENGINES.items())
+        timeouts = dict(TIMEOUTS)
+    valores = {nombre: [] for nombre, _, _ in metricas}
+    for nombre, engine in engines:
+        pool = engine.pool
+        capacidad = pool.size() + max(pool._max_overflow, 0)
+        etiqueta = f'{{pool="{nombre}"}}'
+        valores["shopfix_db_pool_timeouts_total"].append(f"{etiqueta} {timeouts.get(nombre, 0)}")
+        valores["shopfix_db_pool_size"].append(f"{etiqueta} {pool.size()}")
+        valores["shopfix_db_pool_checked_out"].append(f"{etiqueta} {pool.checkedout()}")
+        valores["shopfix_db_pool_overflow"].append(f"{etiqueta} {max(pool.overflow(), 0)}")
+        valores["shopfix_db_pool_saturation"].append(
+            f"{etiqueta} {pool.checkedout() / capacidad if capacidad else 0:.3f}"
+        )
+    for nombre, tipo, ayuda in metricas:
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        lineas.extend(f"{nombre}{valor}" for valor in valores[nombre])
+    return "\n".join(lineas)
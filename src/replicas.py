@@ -0,0 +1,173 @@
+"""
+Replicas de lectura opcionales (DB_REPLICA_CONNECTION_STRINGS).
+
+Los GET se atienden con una replica elegida por round robin; las escrituras
+y los GET de un cliente que escribio hace menos de DB_REPLICA_STICKY_SECONDS
+(leer lo propio, marcado con una cookie) usan el primario. Las replicas que
+fallan el chequeo de salud, o un query, quedan fuera hasta el siguiente
+chequeo exitoso; sin replicas sanas todo va al primario.
+"""
+import logging
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.engine.url import make_url
+from pool import create_pooled_engine, engine_options
+
+logger = logging.getLogger("shopfix.db")
+
+COOKIE_PRIMARIO = "shopfix_primario"
+METODOS_LECTURA = ("GET", "HEAD")
+METODOS_ESCRITURA = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class ReplicaSession(SignallingSession):
+    """sesion que usa la replica elegida para el request, si hay una"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        #SQLAlchemy 1.4 pasa argumentos de mas (ej: bind) que la sesion de Flask-SQLAlchemy no acepta
+        if not self._flushing and has_request_context():
+            replica = g.get("replica")
+            if replica is not None:
+                return replica.engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=ReplicaSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        #las opciones del pool van antes que los valores por defecto de Flask-SQLAlchemy
+        for opcion, valor in engine_options(sa_url, app.config).items():
+            options.setdefault(opcion, valor)
+        return SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        #el primario usa el mismo pool configurable y medido que las replicas
+        return create_pooled_engine(sa_url, engine_opts, self.get_app().config, "primario")
+
+
+class Replica:
+    def __init__(self, numero, engine):
+        self.numero = numero
+        self.engine = engine
+        self.sana = True
+        self.revisada = 0.0
+
+
+class ReadReplicas:
+    """elige la base de cada request y vigila la salud de las replicas"""
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self.sticky_seconds = 5
+        self.health_interval = 10
+        self.destinos = {"replica": 0, "primario": 0}
+        self._siguiente = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+        self.health_interval = app.config.get('DB_REPLICA_HEALTH_INTERVAL', 10)
+        self.replicas = []
+        for numero, url in enumerate(app.config.get('DB_REPLICA_CONNECTION_STRINGS') or []):
+            sa_url = make_url(url)
+            opciones = dict(
+                engine_options(sa_url, app.config), **(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+            )
+            engine = create_pooled_engine(sa_url, opciones, app.config, f"replica{numero}")
+            replica = Replica(numero, engine)
+            event.listen(replica.engine, "handle_error", self._on_error(replica))
+            self.replicas.append(replica)
+        if self.replicas:
+            app.before_request(self.route_request)
+            app.after_request(self.mark_write)
+        app.extensions['read_replicas'] = self
+
+    def _on_error(self, replica):
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(replica, context.original_exception)
+        return handle_error
+
+    def mark_down(self, replica, error):
+        if replica.sana:
+            logger.warning("replica %s fuera de servicio: %s", replica.numero, error)
+        replica.sana = False
+        replica.revisada = time.monotonic()
+
+    def check(self, replica):
+        """SELECT 1 contra la replica, actualiza su estado"""
+        try:
+            with replica.engine.connect() as conexion:
+                conexion.execute(text("SELECT 1"))
+        except Exception as error:
+            self.mark_down(replica, error)
+            return False
+        if not replica.sana:
+            logger.warning("replica %s de vuelta en servicio", replica.numero)
+        replica.sana = True
+        replica.revisada = time.monotonic()
+        return True
+
+    def choose(self):
+        """siguiente replica sana por round robin, o None para usar el primario"""
+        with self._lock:
+            inicio = self._siguiente
+            self._siguiente = (self._siguiente + 1) % len(self.replicas)
+        for paso in range(len(self.replicas)):
+            replica = self.replicas[(inicio + paso) % len(self.replicas)]
+            if time.monotonic() - replica.revisada >= self.health_interval:
+                if self.check(replica):
+                    return replica
+            elif replica.sana:
+                return replica
+        return None
+
+    def reads_own_writes(self):
+        """True si el cliente escribio hace menos de sticky_seconds"""
+        try:
+            return float(request.cookies.get(COOKIE_PRIMARIO, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def route_request(self):
+        replica = None
+        if request.method in METODOS_LECTURA and not self.reads_own_writes():
+            replica = self.choose()
+        g.replica = replica
+        with self._lock:
+            self.destinos["replica" if replica is not None else "primario"] += 1
+
+    def mark_write(self, response):
+        if request.method in METODOS_ESCRITURA and response.status_code < 400:
+            response.set_cookie(
+                COOKIE_PRIMARIO, str(time.time() + self.sticky_seconds),
+                max_age=self.sticky_seconds, httponly=True, samesite="Lax"
+            )
+        return response
+
+    def prometheus(self):
+        """estado de las replicas y requests por destino en formato Prometheus"""
+        lineas = [
+            "# HELP shopfix_db_replica_up 1 si la replica paso el ultimo chequeo de salud.",
+            "# TYPE shopfix_db_replica_up gauge",
+        ]
+        lineas.extend(
+            f'shopfix_db_replica_up{{replica="{replica.numero}"}} {int(replica.sana)}'
+            for replica in self.replicas
+        )
+        lineas.extend([
+            "# HELP shopfix_db_requests_total Requests por base de datos usada.",
+            "# TYPE shopfix_db_requests_total counter",
+        ])
+        lineas.extend(
+            f'shopfix_db_requests_total{{destino="{destino}"}} {cantidad}'
+            for destino, cantidad in sorted(self.destinos.items())
+        )
+        return "\n".join(lineas)
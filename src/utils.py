@@ -1,4 +1,10 @@
+import base64
+import hashlib
+import json
+import re
+from decimal import Decimal
 from flask import jsonify, url_for
+from sqlalchemy import tuple_
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +21,198 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def get_int_arg(args, name, default=None, minimum=None):
+    """lee un parametro entero de la url, devuelve default si no viene"""
+    value = args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException(f"El parametro {name} debe ser un numero entero")
+    if minimum is not None and value < minimum:
+        raise APIException(f"El parametro {name} debe ser mayor o igual a {minimum}")
+    return value
+
+def get_page_args(args):
+    """devuelve (limit, offset) acotando limit a MAX_PAGE_SIZE"""
+    limit = get_int_arg(args, "limit", DEFAULT_PAGE_SIZE, minimum=1)
+    offset = get_int_arg(args, "offset", 0, minimum=0)
+    return min(limit, MAX_PAGE_SIZE), offset
+
+def get_include(args, allowed):
+    """devuelve el conjunto de relaciones pedidas en el parametro include (ej: include=productos)"""
+    include = set(filter(None, (args.get("include") or "").split(",")))
+    if not include <= set(allowed):
+        raise APIException(
+            f"El parametro include debe ser uno de: {', '.join(sorted(allowed))}"
+        )
+    return include
+
+def get_fields(args, allowed):
+    """
+        devuelve los campos pedidos en el parametro fields (ej: fields=id,titulo),
+        en el orden de allowed; sin el parametro devuelve todos los campos
+    """
+    fields = set(filter(None, (args.get("fields") or "").split(",")))
+    if not fields:
+        return tuple(allowed)
+    if not fields <= set(allowed):
+        raise APIException(
+            f"El parametro fields debe contener solo: {', '.join(allowed)}"
+        )
+    return tuple(field for field in allowed if field in fields)
+
+def get_ids(value, maximum):
+    """
+        ids pedidos como texto separado por coma (ej: ids=3,1,2) o como lista JSON de enteros,
+        sin repetir y en el orden pedido, hasta maximum
+    """
+    if isinstance(value, str):
+        try:
+            value = [int(id) for id in filter(None, (part.strip() for part in value.split(",")))]
+        except ValueError:
+            raise APIException("El parametro ids debe ser una lista de numeros enteros separados por coma")
+    if not isinstance(value, list) or any(isinstance(id, bool) or not isinstance(id, int) for id in value):
+        raise APIException("ids debe ser una lista de numeros enteros")
+    ids = list(dict.fromkeys(value))
+    if not ids:
+        raise APIException("Debe indicar al menos un id")
+    if len(ids) > maximum:
+        raise APIException(f"Puede pedir hasta {maximum} ids")
+    return ids
+
+def version_etag(version):
+    """ETag de un recurso con columna version, el que se compara con If-Match"""
+    return f"v{version}"
+
+def representation_etag(version, body):
+    """
+        ETag de la respuesta de un recurso con columna version: la version y un hash del cuerpo
+        (ej: v3-1a2b3c4d5e6f7a8b). El hash cambia con fields=, include= y los datos derivados
+        que no cambian la version (ej: cantidad_productos), asi un If-None-Match no recibe 304
+        de otra representacion; If-Match solo compara la version (get_if_match)
+    """
+    return f"{version_etag(version)}-{hashlib.sha1(body).hexdigest()[:16]}"
+
+def get_if_match(if_match):
+    """
+        versiones aceptadas por el encabezado If-Match (request.if_match), o None si no
+        viene o es *. Lo que sigue a la version (el hash de representation_etag y la
+        codificacion que agrega el cache, ej: v3-1a2b3c4d5e6f7a8b-gzip) se ignora;
+        un ETag que no es de una version no coincide con ninguna
+    """
+    if not if_match or if_match.star_tag:
+        return None
+    versiones = set()
+    for etag in if_match.as_set():
+        coincidencia = re.fullmatch(r"v(\d+)(-\w+)*", etag)
+        if coincidencia:
+            versiones.add(int(coincidencia.group(1)))
+    return versiones
+
+def get_sort(args, columns):
+    """
+        lee el parametro sort (ej: "precio" o "-precio") y devuelve
+        (sort, columna, descendente) validando que la columna sea ordenable
+    """
+    sort = args.get("sort") or "id"
+    name = sort.lstrip("-")
+    if name not in columns:
+        raise APIException(
+            f"El parametro sort debe ser uno de: {', '.join(sorted(columns))}"
+        )
+    return sort, columns[name], sort.startswith("-")
+
+def encode_cursor(sort, value, last_id):
+    """codifica la ultima llave (sort_key, id) vista en un cursor opaco"""
+    raw = json.dumps([sort, value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def is_column_value(value, column):
+    """True si value (leido de JSON) es un escalar del tipo de la columna"""
+    if value is None or isinstance(value, (bool, list, dict)):
+        return False
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return True
+    if python_type in (float, Decimal):
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+def decode_cursor(cursor, sort, column=None):
+    """
+        devuelve (sort_key, id) del cursor, validando que sea del mismo orden; con column
+        valida ademas que sort_key sea de su tipo y el id un entero, asi un cursor alterado
+        es un 400 y no llega a la comparacion por llave en la base
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise APIException("El parametro cursor no es valido")
+    if cursor_sort != sort:
+        raise APIException("El cursor no corresponde al orden solicitado")
+    if column is not None and not (
+        isinstance(last_id, int) and not isinstance(last_id, bool) and is_column_value(value, column)
+    ):
+        raise APIException("El parametro cursor no es valido")
+    return value, last_id
+
+def paginate(query, args, columns, tiebreaker, serializer):
+    """
+        ordena y pagina la consulta segun los parametros sort, limit, offset y cursor.
+        Sin cursor se pagina por limit/offset y se incluye el total de registros.
+        Con cursor se pagina por llave: se filtra (sort_key, id) despues de la ultima
+        fila vista, asi cualquier pagina cuesta lo mismo que la primera usando el indice.
+        En ambos casos next_cursor permite pedir la pagina siguiente.
+        serializer recibe la lista completa de la pagina, asi puede
+        cargar datos relacionados en lote.
+    """
+    sort, column, descending = get_sort(args, columns)
+    limit, offset = get_page_args(args)
+    page = {"limit": limit}
+
+    order = [column.desc() if descending else column.asc()]
+    if column is not tiebreaker:
+        order.append(tiebreaker.desc() if descending else tiebreaker.asc())
+    query = query.order_by(*order)
+
+    cursor = args.get("cursor")
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort, column)
+        if column is tiebreaker:
+            key, last_key = tiebreaker, last_id
+        else:
+            key, last_key = tuple_(column, tiebreaker), tuple_(value, last_id)
+        query = query.filter(key < last_key if descending else key > last_key)
+    else:
+        page["total"] = query.order_by(None).count()
+        page["offset"] = offset
+        query = query.offset(offset)
+
+    #se pide una fila de mas para saber si hay una pagina siguiente
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(sort, getattr(last, column.key), getattr(last, tiebreaker.key))
+    page["next_cursor"] = next_cursor
+    page["resultados"] = serializer(items)
+    return page
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
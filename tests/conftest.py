@@ -0,0 +1,130 @@
+"""
+Fixtures de las pruebas: la app de create_app() sobre un SQLite temporal,
+sin cache de respuestas ni admin, con las tablas de db.create_all().
+Las pruebas que piden app_con_cache la usan con el cache en memoria.
+
+    pipenv run test
+"""
+import os
+import re
+import sys
+import pytest
+from sqlalchemy import event
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "src"))
+
+from main import create_app, response_cache  # noqa: E402
+from models import db, Categoria, Producto, Eliminacion, ResumenFaceta, User  # noqa: E402
+
+#tablas que se vacian despues de cada prueba, las hijas primero
+TABLAS = [Producto, Categoria, Eliminacion, ResumenFaceta, User]
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    archivo = tmp_path_factory.mktemp("shopfix") / "pruebas.db"
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{archivo}",
+        "CACHE_BACKEND": "none",
+        "ENABLE_ADMIN": False,
+        "SLOW_QUERY_MS": 60000,
+        "TESTING": True,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def app_con_cache(app, base):
+    """la app con CACHE_BACKEND=memory, con el cache vacio y los contadores en cero"""
+    app.config["CACHE_BACKEND"] = "memory"
+    response_cache.init_app(app)
+    response_cache.hits = response_cache.misses = 0
+    yield app
+    app.config["CACHE_BACKEND"] = "none"
+    response_cache.init_app(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def base(app):
+    """la sesion de la app; al terminar la prueba se borran las filas que dejo"""
+    yield db.session
+    db.session.rollback()
+    for modelo in TABLAS:
+        db.session.query(modelo).delete()
+    db.session.commit()
+
+
+def sembrar_productos(cantidad, precio=lambda i: i, categoria=lambda i: None, lote=10000):
+    """inserta cantidad productos en lotes de INSERT, sin pasar por el ORM; precio y categoria reciben el numero de fila"""
+    for inicio in range(0, cantidad, lote):
+        db.session.execute(Producto.__table__.insert(), [
+            {
+                "titulo": f"Producto {i}",
+                "descripcion": f"descripcion {i}",
+                "precio": precio(i),
+                "imagen": f"https://img.example.com/{i}.png",
+                "categoria_id": categoria(i),
+            }
+            for i in range(inicio, min(inicio + lote, cantidad))
+        ])
+    db.session.commit()
+
+
+def sembrar_categorias(cantidad):
+    """crea cantidad categorias y devuelve sus ids"""
+    db.session.execute(Categoria.__table__.insert(), [
+        {"nombre": f"Categoria {i}", "descripcion": f"descripcion {i}", "icono": f"icono-{i}"}
+        for i in range(cantidad)
+    ])
+    db.session.commit()
+    return [categoria_id for (categoria_id,) in db.session.query(Categoria.id).order_by(Categoria.id)]
+
+
+def columnas_leidas(client, url, tabla):
+    """respuesta del GET a url y las columnas de tabla que leen sus SELECT ... FROM tabla"""
+    columnas = set()
+
+    def leer(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(f"SELECT {tabla}."):
+            seleccion = statement.split("FROM")[0]
+            columnas.update(re.findall(rf"\b{tabla}\.(\w+) AS", seleccion))
+
+    event.listen(db.engine, "before_cursor_execute", leer)
+    try:
+        respuesta = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", leer)
+    return respuesta, columnas
+
+
+def sentencias_ejecutadas(funcion):
+    """resultado de funcion() y las sentencias SQL que ejecuto"""
+    sentencias = []
+
+    def guardar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", guardar)
+    try:
+        resultado = funcion()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", guardar)
+    return resultado, sentencias
+
+
+def antes_de_confirmar(sentencias):
+    """las sentencias de la escritura, sin las que numeran el cambio al confirmar (models.confirmar_cambios)"""
+    fin = next(
+        (posicion for posicion, sentencia in enumerate(sentencias) if sentencia.startswith("UPDATE contador_cambio")),
+        len(sentencias)
+    )
+    return sentencias[:fin]
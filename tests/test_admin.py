@@ -0,0 +1,100 @@
+"""
+Vistas del admin (admin.py): sin busqueda ni filtros cuentan solo hasta el
+umbral y consultan el conteo estimado unicamente si la tabla lo supera; la
+busqueda es por prefijo con conteo exacto y la pagina siguiente va por cursor
+(uno alterado vuelve a OFFSET).
+"""
+import html
+import re
+import pytest
+from sqlalchemy import event
+from admin import setup_admin, ScalableModelView
+from conftest import sembrar_productos
+from models import db, Producto
+from utils import encode_cursor
+
+
+@pytest.fixture(scope="module")
+def admin(app):
+    return setup_admin(app)
+
+
+@pytest.fixture
+def vista(admin, base, monkeypatch):
+    """la vista de productos con umbral de 5 filas y paginas de 3"""
+    monkeypatch.setattr(ScalableModelView, "estimated_count_threshold", 5)
+    vista = next(vista for vista in admin._views if getattr(vista, "model", None) is Producto)
+    monkeypatch.setattr(vista, "page_size", 3)
+    yield vista
+    #las vistas cargan los productos en la sesion compartida de las pruebas
+    db.session.expunge_all()
+
+
+def pagina(client, url):
+    """html del GET a url y las sentencias SQL que ejecuto"""
+    sentencias = []
+
+    def guardar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", guardar)
+    try:
+        respuesta = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", guardar)
+    assert respuesta.status_code == 200
+    return respuesta.get_data(as_text=True), sentencias
+
+
+def titulos(texto):
+    return re.findall(r"Producto \d+", texto)
+
+
+def test_bajo_el_umbral_no_estima(client, vista):
+    sembrar_productos(5)
+    texto, sentencias = pagina(client, "/admin/producto/")
+    #el conteo acotado es el total: no hay COUNT(*) completo ni MAX(rowid)
+    assert len(sentencias) == 2
+    assert "LIMIT" in sentencias[0] and sentencias[0].startswith("SELECT count(*)")
+    assert not any("max(rowid)" in sentencia for sentencia in sentencias)
+    assert "(estimado)" not in texto
+    #paginador numerado con las 2 paginas
+    assert re.search(r'href="/admin/producto/\?page=1[^"]*">2</a>', texto)
+    assert titulos(texto) == ["Producto 0", "Producto 1", "Producto 2"]
+
+
+def test_sobre_el_umbral_estima(client, vista):
+    sembrar_productos(8)
+    texto, sentencias = pagina(client, "/admin/producto/")
+    assert len(sentencias) == 3
+    assert any("max(rowid)" in sentencia for sentencia in sentencias)
+    assert "~8 registros (estimado)" in texto
+    assert ">2</a>" not in texto
+
+
+def test_busqueda_cuenta_exacto(client, vista):
+    sembrar_productos(8)
+    texto, sentencias = pagina(client, "/admin/producto/?search=producto+1")
+    assert not any("max(rowid)" in sentencia for sentencia in sentencias)
+    assert "(estimado)" not in texto
+    #prefijo por rango sobre el titulo, no LIKE
+    assert not any("LIKE" in sentencia for sentencia in sentencias)
+    assert titulos(texto) == ["Producto 1"]
+
+
+def test_pagina_siguiente_por_cursor(client, vista):
+    sembrar_productos(8)
+    texto, _ = pagina(client, "/admin/producto/")
+    siguiente = html.unescape(re.search(r'href="([^"]*cursor=[^"]*)"', texto).group(1))
+    texto, sentencias = pagina(client, siguiente)
+    assert titulos(texto) == ["Producto 3", "Producto 4", "Producto 5"]
+    #la llave reemplaza al OFFSET (SQLite igual escribe OFFSET 0)
+    assert "WHERE producto.id > ?" in sentencias[-1]
+
+
+def test_cursor_alterado_vuelve_a_offset(client, vista):
+    sembrar_productos(8)
+    #el cursor tiene la forma correcta pero el id no es un numero
+    texto, sentencias = pagina(client, f"/admin/producto/?page=1&cursor={encode_cursor('id:asc', 'x', 'x')}")
+    assert titulos(texto) == ["Producto 3", "Producto 4", "Producto 5"]
+    assert not any("WHERE producto.id >" in sentencia for sentencia in sentencias)
@@ -0,0 +1,66 @@
+"""
+Modo ASGI (asgi.py) sobre la misma base de las pruebas: los listados y las
+altas devuelven lo mismo que la app WSGI, y asgi:application se crea al
+pedirla con la configuracion de las variables de entorno.
+"""
+import pytest
+from conftest import sembrar_categorias, sembrar_productos
+from models import Producto
+
+pytest.importorskip("starlette")
+pytest.importorskip("aiosqlite")
+from starlette.applications import Starlette  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+import asgi  # noqa: E402
+
+
+@pytest.fixture
+def cliente_asgi(app, base):
+    aplicacion = asgi.create_asgi_app({
+        "DB_CONNECTION_STRING": app.config["SQLALCHEMY_DATABASE_URI"], "CACHE_BACKEND": "none"
+    })
+    with TestClient(aplicacion) as cliente:
+        yield cliente
+
+
+def test_listados_como_la_app_wsgi(cliente_asgi, client):
+    ids = sembrar_categorias(2)
+    sembrar_productos(5, categoria=lambda i: ids[i % 2])
+    for url in ("/productos?limit=3", f"/productos?categoria_id={ids[0]}", "/categorias", "/productos?ids=2,1,99"):
+        respuesta = cliente_asgi.get(url)
+        assert respuesta.status_code == 200
+        assert respuesta.json() == client.get(url).get_json()
+    #el siguiente cursor del listado asincronico sirve igual
+    siguiente = cliente_asgi.get("/productos?limit=3").json()["next_cursor"]
+    assert len(cliente_asgi.get(f"/productos?limit=3&cursor={siguiente}").json()["resultados"]) == 2
+
+
+def test_alta_y_errores(cliente_asgi, client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    respuesta = cliente_asgi.post("/productos", json={
+        "titulo": "nuevo", "descripcion": "d", "precio": 10, "imagen": None, "categoria_id": categoria_id
+    })
+    assert respuesta.status_code == 201
+    assert respuesta.json()["titulo"] == "Nuevo"
+    #el commit de la sesion asincronica tambien numera el cambio (GET /changes)
+    assert base.query(Producto.titulo, Producto.cambio > 0).one() == ("Nuevo", True)
+    respuesta = cliente_asgi.post("/productos", json={"titulo": "sin precio"})
+    assert respuesta.status_code == 400
+    assert respuesta.json() == client.post("/productos", json={"titulo": "sin precio"}).get_json()
+    #un parametro invalido es el mismo 400 de APIException
+    respuesta = cliente_asgi.get("/productos?limit=abc")
+    assert respuesta.status_code == 400
+    assert respuesta.json() == client.get("/productos?limit=abc").get_json()
+
+
+def test_application_se_crea_al_pedirla(app, monkeypatch):
+    monkeypatch.setenv("DB_CONNECTION_STRING", app.config["SQLALCHEMY_DATABASE_URI"])
+    monkeypatch.setenv("CACHE_BACKEND", "none")
+    monkeypatch.delattr(asgi, "application", raising=False)
+    aplicacion = asgi.application
+    assert isinstance(aplicacion, Starlette)
+    assert aplicacion.state.config["DB_CONNECTION_STRING"] == app.config["SQLALCHEMY_DATABASE_URI"]
+    #la segunda vez ya es un atributo del modulo
+    assert asgi.application is aplicacion
+    with pytest.raises(AttributeError):
+        asgi.otra_app
@@ -0,0 +1,138 @@
+"""
+Busqueda de texto completo: en bases de db.create_all() el indice sale del DDL
+de busqueda.py, sin cargar las migraciones en los workers de la app. En SQLite
+(FTS5) se prueban el orden por relevancia, el filtro por categoria, la
+paginacion y el prefijo de la ultima palabra; la expresion de PostgreSQL, MySQL
+y el LIKE de los demas dialectos se compilan sin base.
+"""
+import subprocess
+import sys
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.dialects.oracle import dialect as oracle
+import busqueda
+from conftest import RAIZ, sembrar_categorias, sembrar_productos
+from models import db, Producto
+
+
+def crear(*productos):
+    """inserta (titulo, descripcion, categoria_id) y devuelve sus ids en el mismo orden"""
+    ids = []
+    for titulo, descripcion, categoria_id in productos:
+        ids.append(db.session.execute(Producto.__table__.insert().values(
+            titulo=titulo, descripcion=descripcion, precio=100, imagen=None, categoria_id=categoria_id
+        )).inserted_primary_key[0])
+    db.session.commit()
+    return ids
+
+
+def buscar(client, consulta):
+    respuesta = client.get(f"/productos/search?{consulta}")
+    assert respuesta.status_code == 200
+    return respuesta.get_json()
+
+
+def ids_de(pagina):
+    return [producto["id"] for producto in pagina["resultados"]]
+
+
+def test_la_app_no_carga_las_migraciones():
+    salida = subprocess.run(
+        [sys.executable, "-c", "import sys, main; print(sorted({'alembic', 'mako'} & set(sys.modules)))"],
+        cwd=f"{RAIZ}/src", capture_output=True, text=True, check=True
+    ).stdout
+    assert salida.strip() == "[]"
+
+
+def test_busca_en_el_indice_de_create_all(client, base):
+    sembrar_productos(20)
+    #los triggers mantienen el indice al modificar un producto
+    assert client.patch("/productos/3", json={"titulo": "Zapatilla roja"}).status_code == 200
+    respuesta = client.get("/productos/search?q=zapat")
+    assert respuesta.status_code == 200
+    assert [producto["id"] for producto in respuesta.get_json()["resultados"]] == [3]
+
+
+def test_ordena_por_relevancia(client, base):
+    en_descripcion, en_titulo, _ = crear(
+        ("Pantalon", "combina con la camisa azul", None),
+        ("Camisa azul", "de algodon", None),
+        ("Gorra", "de lana", None),
+    )
+    #el titulo pesa mas que la descripcion
+    assert ids_de(buscar(client, "q=camisa")) == [en_titulo, en_descripcion]
+    #con la misma relevancia desempata el id
+    mismos = crear(("Bufanda", "roja", None), ("Bufanda", "roja", None))
+    assert ids_de(buscar(client, "q=bufanda")) == sorted(mismos)
+
+
+def test_filtra_por_categoria(client, base):
+    ropa, calzado = sembrar_categorias(2)
+    camisa, zapato, sin_categoria = crear(
+        ("Camisa roja", "d", ropa), ("Zapato rojo", "d", calzado), ("Camisa verde", "d", None)
+    )
+    assert ids_de(buscar(client, "q=camisa")) == [camisa, sin_categoria]
+    assert ids_de(buscar(client, f"q=camisa&categoria_id={ropa}")) == [camisa]
+    assert ids_de(buscar(client, f"q=camisa&categoria_id={calzado}")) == []
+    assert ids_de(buscar(client, f"q=rojo&categoria_id={calzado}")) == [zapato]
+
+
+def test_pagina_los_resultados(client, base):
+    ids = crear(*[(f"Camisa {i}", "d", None) for i in range(5)])
+    crear(("Pantalon", "d", None))
+    vistos = []
+    consulta = "q=camisa&limit=2"
+    offset = 0
+    while offset is not None:
+        pagina = buscar(client, f"{consulta}&offset={offset}")
+        assert pagina["limit"] == 2 and pagina["offset"] == offset
+        assert len(pagina["resultados"]) <= 2
+        vistos += ids_de(pagina)
+        offset = pagina["next_offset"]
+    #cada producto una sola vez, en el orden de la consulta sin paginar
+    assert vistos == ids_de(buscar(client, "q=camisa")) and sorted(vistos) == ids
+    #la ultima pagina completa no anuncia otra
+    assert buscar(client, f"{consulta}&offset=3")["next_offset"] is None
+
+
+def test_varias_palabras_y_prefijo(client, base):
+    azul, roja, pantalon = crear(
+        ("Camisa azul", "d", None), ("Camisa roja", "d", None), ("Pantalon azul", "camisa aparte", None)
+    )
+    #todas las palabras deben aparecer, en titulo o descripcion y en cualquier orden
+    assert ids_de(buscar(client, "q=camisa azul")) == [azul, pantalon]
+    assert ids_de(buscar(client, "q=azul camisa")) == [azul, pantalon]
+    #solo la ultima palabra es prefijo
+    assert ids_de(buscar(client, "q=camisa ro")) == [roja]
+    assert ids_de(buscar(client, "q=cam roja")) == []
+    #mayusculas y signos no cambian la busqueda ni llegan como sintaxis de FTS5
+    assert ids_de(buscar(client, 'q=CAMISA, "azul*')) == [azul, pantalon]
+    assert ids_de(buscar(client, "q=camisa OR pantalon")) == []
+
+
+@pytest.mark.parametrize("consulta", ["", "q=", "q=%20%20", "q=*%22()-", "q=!"])
+def test_sin_texto_es_400(client, base, consulta):
+    respuesta = client.get(f"/productos/search?{consulta}")
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"resultado": "Debe indicar el texto a buscar en el parametro q"}
+
+
+@pytest.mark.parametrize("dialecto, esperado", [
+    (postgresql.dialect(), ["@@ to_tsquery('simple', %(to_tsquery_1)s)", "ts_rank("]),
+    (mysql.dialect(), ["MATCH (producto.titulo, producto.descripcion) AGAINST (%s IN BOOLEAN MODE)"]),
+    (oracle(), ["LIKE '%' || :titulo_1 || '%'", "LIKE '%' || :titulo_2 || '%'"]),
+])
+def test_expresion_de_cada_dialecto(monkeypatch, dialecto, esperado):
+    monkeypatch.setattr(busqueda, "db", SimpleNamespace(engine=SimpleNamespace(dialect=dialecto), func=db.func))
+    consulta = busqueda.buscar_productos(db.session.query(Producto.id), "Camisa az")
+    compilada = consulta.statement.compile(dialect=dialecto)
+    for fragmento in esperado:
+        assert fragmento in str(compilada)
+    parametros = list(compilada.params.values())
+    if dialecto.name == "postgresql":
+        assert "camisa & az:*" in parametros
+    elif dialecto.name == "mysql":
+        assert "+camisa +az*" in parametros
+    else:
+        assert {"camisa", "az"} <= set(parametros)
@@ -0,0 +1,191 @@
+"""
+Cache de respuestas: en la app (app_con_cache) los aciertos responden con el
+mismo ETag y 304, las escrituras invalidan solo las etiquetas que tocan y
+/cache/stats cuenta aciertos y fallos; LRUBackend respeta su maximo de entradas,
+el TTL y la generacion. Con replicas de lectura el cliente que acaba de escribir
+no recibe una entrada llenada desde una replica atrasada, y lo leido de una
+replica no se guarda mientras la invalidacion es reciente.
+"""
+import time
+import pytest
+from flask import Flask, g, jsonify, request
+import cache as modulo_cache
+from cache import LRUBackend, RedisBackend, ResponseCache
+from conftest import sembrar_productos
+from replicas import COOKIE_PRIMARIO
+
+
+class ReplicaAtrasada:
+    """como ReadReplicas: los GET van a la replica salvo que el cliente haya escrito hace poco"""
+
+    def __init__(self, app):
+        self.replicas = ["replica"]
+        app.extensions['read_replicas'] = self
+        app.before_request(self.route_request)
+
+    def reads_own_writes(self):
+        return float(request.cookies.get(COOKIE_PRIMARIO, 0)) > time.time()
+
+    def route_request(self):
+        g.replica = None if self.reads_own_writes() else self.replicas[0]
+
+
+@pytest.fixture(params=["memory", "redis"])
+def tienda(request, monkeypatch):
+    app = Flask(__name__)
+    app.config.update(
+        CACHE_BACKEND=request.param, CACHE_REDIS_URL="redis://localhost/0",
+        DB_REPLICA_CONNECTION_STRINGS=["replica"], DB_REPLICA_STICKY_SECONDS=1
+    )
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        monkeypatch.setattr(
+            RedisBackend, "from_url",
+            classmethod(lambda cls, url, ttl=60, invalidation_window=0: cls(
+                fakeredis.FakeRedis(), ttl, invalidation_window=invalidation_window
+            ))
+        )
+    ReplicaAtrasada(app)
+    cache = ResponseCache(app)
+    #la replica todavia no tiene las escrituras del primario
+    datos = {"primario": 1, "replica": 1}
+
+    @app.route('/dato')
+    @cache.cached("dato")
+    def leer():
+        return jsonify(valor=datos["primario"] if g.replica is None else datos["replica"])
+
+    def escribir(valor):
+        datos["primario"] = valor
+        cache.invalidate("dato")
+
+    return app.test_client(), escribir, datos
+
+
+def leer_como(client, escritor):
+    if escritor:
+        client.set_cookie("localhost", COOKIE_PRIMARIO, str(time.time() + 1))
+    else:
+        client.delete_cookie("localhost", COOKIE_PRIMARIO)
+    return client.get("/dato").get_json()["valor"]
+
+
+def test_quien_escribio_lee_su_escritura(tienda):
+    client, escribir, _ = tienda
+    assert leer_como(client, escritor=False) == 1
+    escribir(2)
+    #otro cliente lee la replica atrasada: esa respuesta no queda en el cache
+    assert leer_como(client, escritor=False) == 1
+    assert leer_como(client, escritor=True) == 2
+
+
+def test_la_replica_se_cachea_pasada_la_ventana(tienda):
+    client, escribir, datos = tienda
+    escribir(2)
+    datos["replica"] = 2
+    time.sleep(1.1)
+    assert leer_como(client, escritor=False) == 2
+    #la entrada quedo guardada: la replica cambia y el cache sigue respondiendo
+    datos["replica"] = 3
+    assert leer_como(client, escritor=False) == 2
+
+
+def test_redis_no_guarda_lo_invalidado_durante_el_guardado():
+    fakeredis = pytest.importorskip("fakeredis")
+    servidor = fakeredis.FakeServer()
+    backend = RedisBackend(fakeredis.FakeRedis(server=servidor))
+    otro_worker = RedisBackend(fakeredis.FakeRedis(server=servidor))
+    generacion = backend.generation()
+    pipeline = backend.client.pipeline
+
+    def pipeline_con_invalidacion(*args, **kwargs):
+        #otro worker invalida despues de leer la generacion y antes del EXEC
+        pipe = pipeline(*args, **kwargs)
+        multi = pipe.multi
+
+        def invalidar_y_multi():
+            otro_worker.invalidate(["dato"])
+            multi()
+
+        pipe.multi = invalidar_y_multi
+        return pipe
+
+    backend.client.pipeline = pipeline_con_invalidacion
+    backend.set_many([("dato:1", {"valor": 1}, ["dato"])], generacion)
+    assert backend.get("dato:1") is None
+    #sin invalidacion en el medio se guarda
+    backend.client.pipeline = pipeline
+    backend.set_many([("dato:1", {"valor": 2}, ["dato"])], backend.generation())
+    assert backend.get("dato:1") == {"valor": 2}
+
+
+def test_acierto_con_etag_y_304(app_con_cache, client):
+    sembrar_productos(1)
+    primera = client.get("/productos/1")
+    segunda = client.get("/productos/1")
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.headers["ETag"] == primera.headers["ETag"]
+    assert segunda.get_data() == primera.get_data()
+    assert client.get("/productos/1", headers={"If-None-Match": primera.headers["ETag"]}).status_code == 304
+    assert client.get("/cache/stats").get_json() == {"hits": 2, "misses": 1, "entradas": 1}
+
+
+def test_escritura_invalida_solo_sus_etiquetas(app_con_cache, client):
+    sembrar_productos(2)
+    for url in ("/productos/1", "/productos/2", "/productos"):
+        client.get(url)
+    assert client.get("/cache/stats").get_json()["entradas"] == 3
+    assert client.patch("/productos/1", json={"precio": 50}).status_code == 200
+    #se borran producto:1 y el listado (productos), no producto:2
+    assert client.get("/cache/stats").get_json()["entradas"] == 1
+    assert client.get("/productos/1").get_json()["precio"] == 50
+    assert [producto["precio"] for producto in client.get("/productos").get_json()["resultados"]] == [50, 1]
+    antes = client.get("/cache/stats").get_json()["hits"]
+    client.get("/productos/2")
+    assert client.get("/cache/stats").get_json()["hits"] == antes + 1
+
+
+def test_errores_no_se_cachean(app_con_cache, client):
+    assert client.get("/productos/99").status_code == 404
+    assert client.get("/cache/stats").get_json()["entradas"] == 0
+
+
+def test_lru_respeta_el_maximo_de_entradas():
+    backend = LRUBackend(max_entries=2)
+    backend.set("a", 1, ["x"], backend.generation())
+    backend.set("b", 2, ["x"], backend.generation())
+    #leer a la deja como la mas reciente, c desplaza a b
+    assert backend.get("a") == 1
+    backend.set("c", 3, ["y"], backend.generation())
+    assert backend.get_many(["a", "b", "c"]) == [1, None, 3]
+    assert len(backend) == 2
+    #la etiqueta ya no apunta a la entrada desplazada
+    backend.invalidate(["x"])
+    assert backend.get_many(["a", "c"]) == [None, 3]
+
+
+def test_lru_vence_por_ttl(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr(modulo_cache.time, "monotonic", lambda: ahora[0])
+    backend = LRUBackend(ttl=60)
+    backend.set("a", 1, ["x"], backend.generation())
+    ahora[0] += 59
+    assert backend.get("a") == 1
+    ahora[0] += 2
+    assert backend.get("a") is None
+    assert len(backend) == 0
+
+
+def test_lru_no_guarda_con_una_generacion_vieja():
+    backend = LRUBackend()
+    generacion = backend.generation()
+    #una escritura invalida mientras se generaba la respuesta
+    backend.invalidate(["otra"])
+    assert backend.generation() == generacion + 1
+    backend.set("a", 1, ["x"], generacion)
+    assert backend.get("a") is None
+    backend.set("a", 1, ["x"], backend.generation())
+    assert backend.get("a") == 1
+    backend.clear()
+    assert backend.generation() == generacion + 2
+    assert backend.get("a") is None
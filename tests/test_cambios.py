@@ -0,0 +1,134 @@
+"""
+GET /changes entrega los cambios hasta el contador confirmado: una transaccion
+que tomo un numero y sigue abierta no queda detras del token de un cliente.
+Toda escritura toma el contador una sola vez, al confirmar y despues de sus
+filas, asi no lo tiene durante la transaccion (en SQLite no se nota, se revisa
+el orden de las sentencias).
+"""
+import pytest
+from sqlalchemy import event
+from conftest import sembrar_categorias, sembrar_productos
+from models import db, Categoria, Eliminacion, Producto
+
+
+def cambios(client, token=None):
+    respuesta = client.get("/changes" + (f"?since={token}" if token else ""))
+    assert respuesta.status_code == 200
+    return respuesta.get_json()
+
+
+def test_transaccion_abierta_durante_la_consulta(client, base):
+    sembrar_productos(3)
+    pagina = cambios(client)
+    assert len(pagina["resultados"]) == 3
+    token = pagina["next_token"]
+
+    with db.engine.connect() as conexion:
+        transaccion = conexion.begin()
+        conexion.execute(Producto.__table__.insert(), {
+            "titulo": "Abierta", "descripcion": "sin commit", "precio": 1, "imagen": "https://img.example.com/a.png"
+        })
+        #el cliente consulta mientras la transaccion tiene su numero de cambio y no hizo commit
+        pagina = cambios(client, token)
+        assert pagina["resultados"] == []
+        token = pagina["next_token"]
+        transaccion.commit()
+
+    pagina = cambios(client, token)
+    assert [cambio["datos"]["titulo"] for cambio in pagina["resultados"]] == ["Abierta"]
+
+
+def test_borrar_categoria_cambia_sus_productos(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(3, categoria=lambda i: categoria_id if i < 2 else None)
+    token = cambios(client)["next_token"]
+    assert client.delete(f"/categorias/{categoria_id}").status_code == 200
+    pagina = cambios(client, token)
+    assert sorted(
+        (cambio["tipo"], cambio["id"], cambio["operacion"]) for cambio in pagina["resultados"]
+    ) == [("categoria", categoria_id, "delete"), ("producto", 1, "upsert"), ("producto", 2, "upsert")]
+    assert all(
+        cambio["datos"]["categoria_id"] is None for cambio in pagina["resultados"] if cambio["tipo"] == "producto"
+    )
+    assert dict(base.query(Producto.id, Producto.version)) == {1: 2, 2: 2, 3: 1}
+
+
+def sentencias_de(escribir):
+    """sentencias SQL que ejecuta escribir()"""
+    sentencias = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", registrar)
+    try:
+        escribir()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", registrar)
+    return sentencias
+
+
+def numera_filas(sentencia):
+    return sentencia.startswith("UPDATE") and sentencia.endswith(".cambio = ?")
+
+
+def confirmacion(sentencias):
+    """
+        revisa que el contador se tome una sola vez y despues de todas las escrituras de
+        la transaccion; devuelve las tablas que se numeran al confirmar
+    """
+    tomas = [posicion for posicion, sentencia in enumerate(sentencias) if "contador_cambio" in sentencia]
+    assert tomas and sentencias[tomas[0]].startswith("UPDATE contador_cambio")
+    assert sum(sentencia.startswith("UPDATE contador_cambio") for sentencia in sentencias) == 1
+    #despues del contador no se escribe ni se bloquea nada mas que la numeracion de las filas marcadas
+    for sentencia in sentencias[tomas[0] + 1:]:
+        if sentencia.startswith(("UPDATE", "DELETE", "INSERT")) or "FOR UPDATE" in sentencia:
+            assert numera_filas(sentencia), sentencia
+    return sorted(sentencia.split()[1] for sentencia in sentencias if numera_filas(sentencia))
+
+
+@pytest.mark.parametrize("escribir", [
+    lambda client, categoria_id: client.patch("/productos/1", json={"precio": 5}),
+    lambda client, categoria_id: client.delete("/productos/1"),
+    lambda client, categoria_id: client.patch("/productos/bulk", json=[{"id": 1, "precio": 5}]),
+    lambda client, categoria_id: client.patch(
+        "/productos/bulk", json={"filtro": {"ids": [1]}, "ajuste": {"monto": 5}}
+    ),
+    lambda client, categoria_id: client.put(f"/categorias/{categoria_id}", json={"nombre": "Otra"}),
+    lambda client, categoria_id: client.delete(f"/categorias/{categoria_id}"),
+], ids=["patch", "delete", "bulk", "filtro", "put categoria", "delete categoria"])
+def test_el_contador_se_toma_al_confirmar(client, base, escribir):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(2, categoria=lambda i: categoria_id)
+    token = cambios(client)["next_token"]
+    respuestas = []
+    sentencias = sentencias_de(lambda: respuestas.append(escribir(client, categoria_id)))
+    assert respuestas[0].status_code == 200
+    confirmacion(sentencias)
+    #todas las filas de la transaccion llevan el mismo numero, ninguna queda marcada
+    pagina = cambios(client, token)
+    assert pagina["resultados"] and len({cambio["cambio"] for cambio in pagina["resultados"]}) == 1
+    for modelo in (Categoria, Producto, Eliminacion):
+        assert base.query(modelo).filter(modelo.cambio < 0).count() == 0
+
+
+def test_borrar_por_el_orm_toma_el_contador_al_confirmar(base):
+    sembrar_productos(1)
+
+    def borrar():
+        base.delete(base.query(Producto).get(1))
+        base.commit()
+
+    sentencias = sentencias_de(borrar)
+    escrituras = [sentencia for sentencia in sentencias if sentencia.startswith(("UPDATE", "DELETE", "INSERT"))]
+    assert escrituras[0].startswith("DELETE FROM producto")
+    assert confirmacion(sentencias) == ["eliminacion"]
+
+
+def test_rollback_descarta_la_marca(base):
+    sembrar_productos(1)
+    base.execute(Producto.__table__.update().values(precio=7))
+    base.rollback()
+    #la transaccion siguiente no escribe, no toma el contador
+    sentencias = sentencias_de(lambda: (base.query(Producto).count(), base.commit()))
+    assert not any("contador_cambio" in sentencia for sentencia in sentencias)
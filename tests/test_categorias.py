@@ -0,0 +1,293 @@
+"""
+GET /categorias serializa las categorias en lote (Categoria.serializar_lista):
+la cantidad de sentencias SQL por request no crece con la cantidad de categorias.
+DELETE /categorias/<id> borra con un solo DELETE y la base deja sus productos sin
+categoria (ON DELETE SET NULL); sus subcategorias pasan a su padre, con una
+cantidad fija de sentencias que no depende de sus productos ni hijos. PUT y
+DELETE comparan If-Match con la version de la categoria; el ETag del GET
+cambia tambien con los datos derivados, asi un If-None-Match viejo no da 304.
+PUT con padre_id mueve la rama completa (arbol.py) y GET /productos?categoria_rama=
+lista los productos de una categoria y sus subcategorias. Con fields= los GET
+leen y devuelven solo las columnas pedidas (400 si alguna no existe).
+"""
+import threading
+import time
+import pytest
+from sqlalchemy import event
+from arbol import ids_en_ruta, segmento
+from conftest import (
+    antes_de_confirmar, columnas_leidas, sembrar_categorias, sembrar_productos, sentencias_ejecutadas
+)
+from models import db, Categoria, Producto
+
+
+def sentencias_de(client, url):
+    """sentencias SQL que ejecuta el GET a url"""
+    sentencias = []
+
+    def contar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", contar)
+    try:
+        respuesta = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", contar)
+    assert respuesta.status_code == 200
+    return len(sentencias), respuesta.get_json()
+
+
+@pytest.mark.parametrize("consulta", ["", "include=productos", "fields=id,nombre"])
+def test_sentencias_constantes(client, base, consulta):
+    cantidades = []
+    for categorias in (5, 50):
+        base.rollback()
+        base.execute("DELETE FROM producto")
+        base.execute("DELETE FROM categoria")
+        base.commit()
+        ids = sembrar_categorias(categorias)
+        sembrar_productos(3 * categorias, categoria=lambda i: ids[i % categorias])
+        sentencias, pagina = sentencias_de(client, f"/categorias?limit=200&{consulta}")
+        assert len(pagina["resultados"]) == categorias
+        if "include=productos" in consulta:
+            assert all(len(categoria["productos_en_categoria"]) == 3 for categoria in pagina["resultados"])
+        cantidades.append(sentencias)
+    assert cantidades[0] == cantidades[1]
+
+
+def crear_categoria(client, nombre, padre_id=None):
+    respuesta = client.post("/categorias", json={
+        "nombre": nombre, "descripcion": "d", "icono": "icono", "padre_id": padre_id
+    })
+    assert respuesta.status_code == 201
+    return respuesta.get_json()["id"]
+
+
+def test_borrar_categoria(client, base):
+    raiz = crear_categoria(client, "Raiz")
+    media = crear_categoria(client, "Media", raiz)
+    hoja = crear_categoria(client, "Hoja", media)
+    sembrar_productos(4, categoria=lambda i: [raiz, media][i % 2])
+    assert client.delete(f"/categorias/{media}").status_code == 200
+    assert client.delete(f"/categorias/{media}").status_code == 404
+    assert base.query(Categoria.padre_id).filter_by(id=hoja).scalar() == raiz
+    assert sorted(
+        (categoria_id or 0) for (categoria_id,) in base.query(Producto.categoria_id)
+    ) == [0, 0, raiz, raiz]
+
+
+@pytest.mark.parametrize("productos,hijos", [(0, 0), (3, 1), (30, 10)])
+def test_borrar_categoria_sentencias_acotadas(client, base, productos, hijos):
+    raiz = crear_categoria(client, "Raiz")
+    media = crear_categoria(client, "Media", raiz)
+    for hijo in range(hijos):
+        crear_categoria(client, f"Hoja {hijo}", media)
+    sembrar_productos(productos, categoria=lambda i: media)
+    respuesta, sentencias = sentencias_ejecutadas(lambda: client.delete(f"/categorias/{media}"))
+    assert respuesta.status_code == 200
+    escritura = antes_de_confirmar(sentencias)
+    #soltar productos, leer la fila (SQLite no tiene RETURNING), DELETE y registrar la eliminacion
+    assert [sentencia.split()[0] for sentencia in escritura[:4]] == ["UPDATE", "SELECT", "DELETE", "INSERT"]
+    assert "AS tiene_hijos" in escritura[1]
+    #la faceta usa el rowcount del UPDATE y la rama solo se mueve si hay hijos
+    assert len(escritura) == 4 + bool(productos) + bool(hijos)
+    assert not any(sentencia.startswith("SELECT resumen_faceta") for sentencia in escritura)
+    #al confirmar un numero de cambio y solo las tablas que se escribieron
+    tablas = 1 + bool(productos) + bool(hijos)
+    assert len(sentencias) - len(escritura) == 2 + tablas
+    assert base.query(db.func.count(Categoria.id)).filter_by(padre_id=raiz).scalar() == hijos
+    #el resumen de facetas coincide con contar los productos
+    resumen, contadas = (client.get(url).get_json() for url in ("/productos/facets", "/productos/facets?precio_min=0"))
+    assert resumen["categorias"] == contadas["categorias"]
+
+
+def test_put_y_delete_con_if_match(client, base):
+    categoria_id = crear_categoria(client, "Ropa")
+    etag = client.get(f"/categorias/{categoria_id}").headers["ETag"]
+    assert etag.startswith('"v1-')
+    respuesta = client.put(f"/categorias/{categoria_id}", json={"nombre": "Calzado"}, headers={"If-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["ETag"].startswith('"v2-')
+    #otra escritura con la version vieja no pisa la anterior
+    respuesta = client.put(f"/categorias/{categoria_id}", json={"nombre": "Bolsos"}, headers={"If-Match": etag})
+    assert respuesta.status_code == 412
+    assert respuesta.headers["ETag"] == '"v2"'
+    assert client.delete(f"/categorias/{categoria_id}", headers={"If-Match": etag}).status_code == 412
+    assert base.query(Categoria.nombre).filter_by(id=categoria_id).scalar() == "Calzado"
+    assert client.delete(f"/categorias/{categoria_id}", headers={"If-Match": '"v2"'}).status_code == 200
+    respuesta = client.put(f"/categorias/{categoria_id}", json={"nombre": "Bolsos"}, headers={"If-Match": '"v2"'})
+    assert respuesta.status_code == 404
+
+
+def test_etag_del_get_cambia_con_los_datos_derivados(app_con_cache, client):
+    categoria_id = crear_categoria(client, "Ropa")
+    url = f"/categorias/{categoria_id}"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    #un producto nuevo cambia cantidad_productos pero no la version de la categoria
+    assert client.post("/productos", json={
+        "titulo": "camisa", "descripcion": "d", "precio": 100,
+        "imagen": "https://img.example.com/p.png", "categoria_id": categoria_id
+    }).status_code == 201
+    respuesta = client.get(url, headers={"If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()["cantidad_productos"] == 1
+    assert respuesta.headers["ETag"].startswith('"v1-')
+    assert respuesta.headers["ETag"] != etag
+    #cada fields= es otra representacion, con su propio ETag
+    parcial = client.get(f"{url}?fields=id,nombre", headers={"If-None-Match": respuesta.headers["ETag"]})
+    assert parcial.status_code == 200
+    assert parcial.headers["ETag"] != respuesta.headers["ETag"]
+    #el If-Match sigue comparando solo la version
+    assert client.put(url, json={"icono": "otro"}, headers={"If-Match": parcial.headers["ETag"]}).status_code == 200
+
+
+def arbol(client):
+    """raiz > media > hoja > punta, y otra raiz aparte"""
+    raiz = crear_categoria(client, "Raiz")
+    media = crear_categoria(client, "Media", raiz)
+    hoja = crear_categoria(client, "Hoja", media)
+    punta = crear_categoria(client, "Punta", hoja)
+    otra = crear_categoria(client, "Otra")
+    return raiz, media, hoja, punta, otra
+
+
+def nombres(categorias):
+    return [categoria["nombre"] for categoria in categorias]
+
+
+def test_ancestros_y_subcategorias(client, base):
+    raiz, media, hoja, punta, otra = arbol(client)
+    categoria = client.get(f"/categorias/{hoja}?include=ancestros,subcategorias").get_json()
+    assert categoria["padre_id"] == media
+    assert nombres(categoria["ancestros"]) == ["Raiz", "Media"]
+    assert nombres(categoria["subcategorias"]) == ["Punta"]
+    #toda la rama, por nivel
+    assert nombres(client.get(f"/categorias/{raiz}?include=subcategorias").get_json()["subcategorias"]) == [
+        "Media", "Hoja", "Punta"
+    ]
+    assert client.get(f"/categorias/{otra}?include=ancestros").get_json()["ancestros"] == []
+    assert "subcategorias" not in client.get(f"/categorias/{raiz}").get_json()
+
+
+def test_mover_rama(client, base):
+    raiz, media, hoja, punta, otra = arbol(client)
+    respuesta = client.put(f"/categorias/{media}", json={"padre_id": otra})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()["padre_id"] == otra
+    #las rutas de toda la rama quedan bajo la nueva raiz
+    rutas = dict(base.query(Categoria.id, Categoria.ruta))
+    assert rutas[media] == segmento(otra)
+    assert rutas[hoja] == segmento(otra) + segmento(media)
+    assert rutas[punta] == segmento(otra) + segmento(media) + segmento(hoja)
+    assert rutas[raiz] == ""
+    punta_json = client.get(f"/categorias/{punta}?include=ancestros").get_json()
+    assert nombres(punta_json["ancestros"]) == ["Otra", "Media", "Hoja"]
+    assert client.get(f"/categorias/{raiz}?include=subcategorias").get_json()["subcategorias"] == []
+    #con null la rama queda como raiz
+    assert client.put(f"/categorias/{media}", json={"padre_id": None}).status_code == 200
+    assert nombres(client.get(f"/categorias/{punta}?include=ancestros").get_json()["ancestros"]) == [
+        "Media", "Hoja"
+    ]
+
+
+@pytest.mark.parametrize("destino, mensaje", [
+    ("media", "Una categoria no se puede mover debajo de si misma"),
+    ("punta", "Una categoria no se puede mover debajo de si misma"),
+    (999, "La categoria padre no existe"),
+    ("texto", "padre_id debe ser un numero entero o null"),
+])
+def test_no_se_mueve_debajo_de_su_rama(client, base, destino, mensaje):
+    raiz, media, hoja, punta, otra = arbol(client)
+    padre_id = {"media": media, "punta": punta}.get(destino, destino)
+    antes = dict(base.query(Categoria.id, Categoria.ruta))
+    respuesta = client.put(f"/categorias/{media}", json={"padre_id": padre_id})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"message": mensaje}
+    base.expire_all()
+    assert dict(base.query(Categoria.id, Categoria.ruta)) == antes
+
+
+def test_movimientos_cruzados_no_arman_un_ciclo(client, base):
+    """x pasa debajo de y1 mientras y pasa debajo de x1: el segundo tiene que ver al primero"""
+    x = crear_categoria(client, "X")
+    x1 = crear_categoria(client, "X1", x)
+    y = crear_categoria(client, "Y")
+    y1 = crear_categoria(client, "Y1", y)
+    primera = threading.current_thread()
+    llego = threading.Event()
+    respuestas = []
+    hilo = threading.Thread(target=lambda: respuestas.append(client.put(f"/categorias/{y}", json={"padre_id": x1})))
+
+    def intercalar(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is not primera:
+            llego.set()
+        elif statement.startswith("UPDATE categoria") and not hilo.is_alive() and not respuestas:
+            #la primera ya valido el movimiento: la segunda empieza antes de que escriba
+            hilo.start()
+            assert llego.wait(5)
+            time.sleep(0.2)
+
+    event.listen(db.engine, "before_cursor_execute", intercalar)
+    try:
+        assert client.put(f"/categorias/{x}", json={"padre_id": y1}).status_code == 200
+        hilo.join(10)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", intercalar)
+    assert [respuesta.status_code for respuesta in respuestas] == [400]
+    assert respuestas[0].get_json() == {"message": "Una categoria no se puede mover debajo de si misma"}
+    #ninguna categoria quedo entre sus propios ancestros
+    base.expire_all()
+    rutas = dict(base.query(Categoria.id, Categoria.ruta))
+    assert rutas[x] == segmento(y) + segmento(y1)
+    assert all(categoria_id not in ids_en_ruta(ruta) for categoria_id, ruta in rutas.items())
+
+
+def test_listar_productos_de_una_rama(client, base):
+    raiz, media, hoja, punta, otra = arbol(client)
+    #un producto en cada categoria: Producto 0 en raiz ... Producto 4 en otra
+    ids = [raiz, media, hoja, punta, otra]
+    sembrar_productos(5, categoria=lambda i: ids[i])
+
+    def rama(categoria_id):
+        pagina = client.get(f"/productos?categoria_rama={categoria_id}").get_json()
+        return sorted(producto["titulo"] for producto in pagina["resultados"])
+
+    assert rama(media) == ["Producto 1", "Producto 2", "Producto 3"]
+    assert rama(raiz) == ["Producto 0", "Producto 1", "Producto 2", "Producto 3"]
+    assert rama(999) == []
+    #al mover la rama sus productos pasan a la rama del nuevo padre
+    assert client.put(f"/categorias/{hoja}", json={"padre_id": otra}).status_code == 200
+    assert rama(raiz) == ["Producto 0", "Producto 1"]
+    assert rama(otra) == ["Producto 2", "Producto 3", "Producto 4"]
+
+
+@pytest.mark.parametrize("url, leidas, campos", [
+    #el listado lee ademas el id y la columna de orden para el cursor
+    ("/categorias?fields=icono", {"id", "icono"}, ["icono"]),
+    ("/categorias?fields=icono,nombre&sort=nombre", {"id", "nombre", "icono"}, ["nombre", "icono"]),
+    ("/categorias?fields=cantidad_productos", {"id"}, ["cantidad_productos"]),
+    #el detalle lee ademas la version para el ETag y la ruta para ancestros y subcategorias
+    ("/categorias/{id}?fields=icono,nombre", {"id", "nombre", "icono", "ruta", "version"}, ["nombre", "icono"]),
+])
+def test_fields_lee_y_devuelve_solo_lo_pedido(client, base, url, leidas, campos):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(2, categoria=lambda i: categoria_id)
+    respuesta, columnas = columnas_leidas(client, url.format(id=categoria_id), "categoria")
+    assert respuesta.status_code == 200
+    assert columnas == leidas
+    cuerpo = respuesta.get_json()
+    for serializada in cuerpo.get("resultados", [cuerpo]):
+        assert set(serializada) == set(campos)
+    if "cantidad_productos" in campos:
+        assert cuerpo["resultados"][0]["cantidad_productos"] == 2
+
+
+@pytest.mark.parametrize("url", ["/categorias?fields=nombre,ruta", "/categorias/{id}?fields=version"])
+def test_fields_desconocido_es_400(client, base, url):
+    (categoria_id,) = sembrar_categorias(1)
+    respuesta = client.get(url.format(id=categoria_id))
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["message"] == (
+        "El parametro fields debe contener solo: " + ", ".join(Categoria.CAMPOS_SERIALIZADOS + ("cantidad_productos",))
+    )
@@ -0,0 +1,160 @@
+"""
+flask catalog import y rebuild-facets (commands.py) con el runner de la app:
+lotes con un commit cada uno, un solo INSERT multi-fila por lote en SQLite,
+categorias por nombre, upsert por id, el archivo de rechazados y el progreso.
+"""
+import csv
+import json
+import pytest
+from commands import setup_commands
+from conftest import sembrar_categorias, sembrar_productos, sentencias_ejecutadas
+from facetas import ajustar_resumen
+from models import db, Categoria, Producto
+
+
+@pytest.fixture(scope="module")
+def runner(app):
+    setup_commands(app)
+    return app.test_cli_runner()
+
+
+def importar(runner, archivo, *opciones):
+    """salida del comando y las sentencias SQL que ejecuto"""
+    resultado, sentencias = sentencias_ejecutadas(
+        lambda: runner.invoke(args=["catalog", "import", str(archivo), *opciones])
+    )
+    assert resultado.exit_code == 0, resultado.output
+    return resultado.output, sentencias
+
+
+def escribir_ndjson(archivo, filas):
+    archivo.write_text("".join((fila if isinstance(fila, str) else json.dumps(fila)) + "\n" for fila in filas))
+    return archivo
+
+
+def producto(i, **campos):
+    return dict({
+        "titulo": f"producto {i}", "descripcion": "d", "precio": 100 * i,
+        "imagen": "https://img.example.com/p.png"
+    }, **campos)
+
+
+def facetas(client, consulta=""):
+    datos = client.get(f"/productos/facets?{consulta}").get_json()
+    return datos["categorias"], datos["precios"]
+
+
+def test_importar_categorias_csv(runner, base, tmp_path):
+    archivo = tmp_path / "categorias.csv"
+    with open(archivo, "w", newline="") as salida:
+        escritor = csv.DictWriter(salida, ["nombre", "descripcion", "icono"])
+        escritor.writeheader()
+        escritor.writerows([
+            {"nombre": "ropa", "descripcion": "primera", "icono": "i"},
+            {"nombre": "Calzado", "descripcion": "d", "icono": "i"},
+            #repetida en el lote: se escribe una sola vez, con la ultima fila
+            {"nombre": "Ropa", "descripcion": "segunda", "icono": "i"},
+        ])
+    salida, _ = importar(runner, archivo, "--kind", "categorias")
+    assert "Listo: 2 filas escritas y 0 rechazadas" in salida
+    assert dict(base.query(Categoria.nombre, Categoria.descripcion)) == {"Ropa": "segunda", "Calzado": "d"}
+    #sin rechazos no queda el archivo de rechazados
+    assert not (tmp_path / "categorias.csv.rechazados.ndjson").exists()
+    #otra importacion actualiza por nombre
+    escribir_ndjson(tmp_path / "otra.ndjson", [{"nombre": "ropa", "descripcion": "tercera", "icono": "i"}])
+    importar(runner, tmp_path / "otra.ndjson", "--kind", "categorias")
+    assert base.query(Categoria.descripcion, Categoria.version).filter_by(nombre="Ropa").one() == ("tercera", 2)
+    assert base.query(Categoria).count() == 2
+
+
+def test_importar_productos_por_lotes(runner, client, base, tmp_path):
+    ropa, calzado = sembrar_categorias(2)
+    base.query(Categoria).filter_by(id=calzado).update({"nombre": "Calzado"})
+    base.commit()
+    archivo = escribir_ndjson(tmp_path / "productos.ndjson", [
+        producto(1, categoria="calzado"),
+        producto(2, categoria_id=ropa),
+        producto(3, categoria="no existe"),
+        "{no es json",
+        producto(4, categoria_id=ropa, precio="abc"),
+        producto(5, categoria_id=str(calzado), precio="500"),
+        producto(6, categoria_id=ropa + 100),
+        producto(7, categoria_id=ropa),
+    ])
+    salida, sentencias = importar(runner, archivo, "--batch-size", "2")
+    #un INSERT multi-fila por lote: (1, 2), (5, 7)
+    inserciones = [sentencia for sentencia in sentencias if sentencia.startswith("INSERT INTO producto")]
+    assert len(inserciones) == 2
+    assert all(sentencia.count("VALUES") == 1 and "), (" in sentencia for sentencia in inserciones)
+    #una linea de progreso por lote y el total al final
+    lineas = salida.splitlines()
+    assert lineas[0].startswith("2 filas leidas, 2 escritas, 0 rechazadas")
+    assert lineas[1].startswith("8 filas leidas, 4 escritas, 4 rechazadas")
+    assert lineas[2].startswith("Listo: 4 filas escritas y 4 rechazadas")
+    rechazos = tmp_path / "productos.ndjson.rechazados.ndjson"
+    assert lineas[3] == f"Filas rechazadas en {rechazos}"
+    rechazadas = [json.loads(linea) for linea in rechazos.read_text().splitlines()]
+    assert [(fila["fila"], fila["error"]) for fila in rechazadas] == [
+        (3, "La categoria no existe no existe"),
+        (4, "La fila no se pudo leer"),
+        (5, "precio, categoria_id e id deben ser numeros enteros"),
+        (7, "La categoria no existe"),
+    ]
+    assert rechazadas[0]["datos"]["titulo"] == "producto 3"
+    assert rechazadas[1]["datos"] is None
+    assert sorted(base.query(Producto.titulo, Producto.precio, Producto.categoria_id)) == [
+        ("Producto 1", 100, calzado), ("Producto 2", 200, ropa),
+        ("Producto 5", 500, calzado), ("Producto 7", 700, ropa),
+    ]
+    #el resumen de facetas se recalcula al final del import
+    assert facetas(client) == facetas(client, "precio_min=0")
+
+
+def test_importar_productos_actualiza_por_id(runner, base, tmp_path):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(2, categoria=lambda i: categoria_id)
+    existente, _ = sorted(producto_id for (producto_id,) in base.query(Producto.id))
+    archivo = escribir_ndjson(tmp_path / "productos.ndjson", [
+        producto(1, id=existente, categoria_id=categoria_id, titulo="actualizado"),
+        producto(2, id=existente + 100, categoria_id=categoria_id, titulo="nuevo con id"),
+        producto(3, categoria_id=categoria_id, titulo="nuevo"),
+    ])
+    salida, sentencias = importar(runner, archivo)
+    assert "Listo: 3 filas escritas y 0 rechazadas" in salida
+    assert base.query(Producto.titulo, Producto.version).filter_by(id=existente).one() == ("Actualizado", 2)
+    assert base.query(Producto.titulo).filter_by(id=existente + 100).scalar() == "Nuevo con id"
+    assert base.query(Producto).count() == 4
+    #las filas con id existente van en un UPDATE, las nuevas con y sin id en un INSERT cada grupo
+    assert sum(
+        sentencia.startswith("UPDATE producto") and sentencia.endswith("WHERE producto.id = ?")
+        for sentencia in sentencias
+    ) == 1
+    assert sum(sentencia.startswith("INSERT INTO producto") for sentencia in sentencias) == 2
+
+
+def test_lote_malo_se_reintenta_por_fila(runner, base, tmp_path):
+    (categoria_id,) = sembrar_categorias(1)
+    #el id repetido en el lote recien falla en la base
+    archivo = escribir_ndjson(tmp_path / "productos.ndjson", [
+        producto(1, id=50, categoria_id=categoria_id),
+        producto(2, id=50, categoria_id=categoria_id),
+        producto(3, categoria_id=categoria_id),
+    ])
+    rechazos = tmp_path / "rechazos.ndjson"
+    salida, _ = importar(runner, archivo, "--rejects", str(rechazos))
+    assert "Listo: 2 filas escritas y 1 rechazadas" in salida
+    (rechazada,) = [json.loads(linea) for linea in rechazos.read_text().splitlines()]
+    assert rechazada["fila"] == 2 and "UNIQUE" in rechazada["error"]
+    assert sorted(titulo for (titulo,) in base.query(Producto.titulo)) == ["Producto 1", "Producto 3"]
+
+
+def test_rebuild_facets(runner, client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(5, precio=lambda i: 300 * i, categoria=lambda i: categoria_id)
+    ajustar_resumen(db.session, {("categoria", categoria_id): 7, ("precio", 0): -3})
+    db.session.commit()
+    assert facetas(client) != facetas(client, "precio_min=0")
+    resultado = runner.invoke(args=["catalog", "rebuild-facets"])
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output.startswith("Resumen de facetas recalculado en")
+    assert facetas(client) == facetas(client, "precio_min=0")
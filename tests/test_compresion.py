@@ -0,0 +1,80 @@
+"""
+Compresion negociada con Accept-Encoding: solo desde COMPRESS_MIN_SIZE, con un
+ETag por codificacion, desde el cache sin recomprimir y por partes en streaming.
+"""
+import gzip
+import pytest
+from conftest import sembrar_productos
+from compression import brotli
+from main import response_compression
+
+
+@pytest.fixture
+def sin_minimo(monkeypatch):
+    monkeypatch.setattr(response_compression, "min_size", 1)
+
+
+def test_negocia_la_codificacion(client, base):
+    sembrar_productos(50)
+    identidad = client.get("/productos")
+    assert "Content-Encoding" not in identidad.headers
+    comprimida = client.get("/productos", headers={"Accept-Encoding": "gzip"})
+    assert comprimida.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in comprimida.headers["Vary"]
+    assert gzip.decompress(comprimida.get_data()) == identidad.get_data()
+    preferida = client.get("/productos", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+    if brotli is not None:
+        assert preferida.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(preferida.get_data()) == identidad.get_data()
+    else:
+        assert preferida.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in client.get("/productos", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_respuestas_chicas_sin_comprimir(client, base, monkeypatch):
+    sembrar_productos(1)
+    respuesta = client.get("/productos/1", headers={"Accept-Encoding": "gzip"})
+    assert len(respuesta.get_data()) < response_compression.min_size
+    assert "Content-Encoding" not in respuesta.headers
+    monkeypatch.setattr(response_compression, "min_size", 1)
+    assert client.get("/productos/1", headers={"Accept-Encoding": "gzip"}).headers["Content-Encoding"] == "gzip"
+
+
+def test_etag_por_codificacion(client, base, sin_minimo):
+    sembrar_productos(1)
+    etag = client.get("/productos/1").headers["ETag"]
+    respuesta = client.get("/productos/1", headers={"Accept-Encoding": "gzip"})
+    assert respuesta.headers["ETag"] == etag[:-1] + '-gzip"'
+    #If-Match sigue aceptando el ETag de la representacion comprimida
+    assert client.patch(
+        "/productos/1", json={"precio": 3}, headers={"If-Match": respuesta.headers["ETag"]}
+    ).status_code == 200
+
+
+def test_cache_guarda_los_cuerpos_comprimidos(app_con_cache, client, sin_minimo, monkeypatch):
+    sembrar_productos(1)
+    primera = client.get("/productos/1", headers={"Accept-Encoding": "gzip"})
+    #un acierto no vuelve a comprimir
+    monkeypatch.setattr(response_compression, "compress", None)
+    segunda = client.get("/productos/1", headers={"Accept-Encoding": "gzip"})
+    assert client.get("/cache/stats").get_json()["hits"] == 1
+    assert segunda.headers["Content-Encoding"] == "gzip"
+    assert segunda.get_data() == primera.get_data()
+    assert segunda.headers["ETag"] == primera.headers["ETag"]
+    assert client.get(
+        "/productos/1", headers={"Accept-Encoding": "gzip", "If-None-Match": primera.headers["ETag"]}
+    ).status_code == 304
+    #la misma entrada sirve la representacion sin comprimir con su propio ETag
+    identidad = client.get("/productos/1")
+    assert gzip.decompress(primera.get_data()) == identidad.get_data()
+    assert identidad.headers["ETag"] == primera.headers["ETag"].replace('-gzip"', '"')
+
+
+def test_export_comprimido_por_partes(client, base):
+    sembrar_productos(3000)
+    identidad = client.get("/productos/export?format=ndjson").get_data()
+    respuesta = client.get("/productos/export?format=ndjson", headers={"Accept-Encoding": "gzip"})
+    assert respuesta.is_streamed
+    assert respuesta.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in respuesta.headers
+    assert gzip.decompress(respuesta.get_data()) == identidad
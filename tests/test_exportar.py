@@ -0,0 +1,70 @@
+"""
+GET /productos/export escribe la respuesta por lotes de EXPORT_BATCH_SIZE
+filas leidos con fetchmany, sin objetos del ORM, asi la memoria no crece con
+el tamano del catalogo.
+"""
+import tracemalloc
+import pytest
+from sqlalchemy.engine import ResultProxy
+import main
+from conftest import sembrar_productos
+from models import db
+
+
+@pytest.fixture
+def lotes_chicos(monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 100)
+
+
+@pytest.fixture
+def fetchmany_contados(monkeypatch):
+    llamadas = []
+    original = ResultProxy.fetchmany
+
+    def fetchmany(self, size=None):
+        filas = original(self, size)
+        llamadas.append(len(filas))
+        return filas
+
+    monkeypatch.setattr(ResultProxy, "fetchmany", fetchmany)
+    return llamadas
+
+
+@pytest.mark.parametrize("formato", ["ndjson", "csv"])
+def test_exporta_por_lotes(client, base, lotes_chicos, fetchmany_contados, formato):
+    sembrar_productos(1050)
+    respuesta = client.get(f"/productos/export?format={formato}")
+    assert respuesta.status_code == 200
+    assert respuesta.is_streamed
+    #el cliente de pruebas lee el primer trozo al armar la respuesta, el resto sigue en la base
+    assert len(fetchmany_contados) <= 1
+    lineas = 0
+    for trozo in respuesta.response:
+        lineas += trozo.count(b"\n" if isinstance(trozo, bytes) else "\n")
+        assert len(db.session.identity_map) == 0
+    respuesta.close()
+    assert fetchmany_contados == [100] * 10 + [50, 0]
+    #csv agrega la fila de encabezados
+    assert lineas == 1050 + (formato == "csv")
+
+
+def memoria_maxima(client, url):
+    """bytes maximos reservados por Python mientras se consume la respuesta"""
+    tracemalloc.start()
+    try:
+        respuesta = client.get(url)
+        for _ in respuesta.response:
+            pass
+        respuesta.close()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_memoria_no_crece_con_el_catalogo(client, base):
+    sembrar_productos(2000)
+    chico = memoria_maxima(client, "/productos/export")
+    sembrar_productos(38000)
+    grande = memoria_maxima(client, "/productos/export")
+    #20 veces mas filas: si se cargaran todas la memoria creceria en la misma proporcion
+    assert grande < chico * 2
@@ -0,0 +1,101 @@
+"""
+ResumenFaceta: las escrituras de productos lo ajustan con un upsert, y
+GET /productos/facets sin filtros (el resumen) coincide con el GROUP BY,
+tambien con dos escrituras del mismo producto al mismo tiempo.
+"""
+import threading
+import time
+import pytest
+from sqlalchemy import event
+from conftest import sembrar_categorias, sembrar_productos
+from facetas import RANGO_PRECIO, ajustar_resumen, reconstruir_resumen
+from models import db, ResumenFaceta
+
+
+def facetas(client, consulta=""):
+    respuesta = client.get(f"/productos/facets?{consulta}")
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    return datos["categorias"], datos["precios"]
+
+
+def test_upsert_crea_y_suma(base):
+    with db.engine.connect() as conexion:
+        ajustar_resumen(conexion, {("precio", 700): 2, ("categoria", 9): 1})
+        ajustar_resumen(conexion, {("precio", 700): 3, ("categoria", 9): -1, ("categoria", 8): 0})
+    assert dict(base.query(ResumenFaceta.faceta, ResumenFaceta.valor).all()) == {"precio": 700, "categoria": 9}
+    assert base.query(ResumenFaceta.cantidad).filter_by(faceta="precio", valor=700).scalar() == 5
+    assert base.query(ResumenFaceta.cantidad).filter_by(faceta="categoria", valor=9).scalar() == 0
+
+
+def test_resumen_coincide_con_group_by(client, base):
+    primera, segunda = sembrar_categorias(2)
+    reconstruir_resumen(base)
+    base.commit()
+    ids = []
+    for i in range(6):
+        respuesta = client.post("/productos", json={
+            "titulo": f"Producto {i}", "descripcion": "d", "precio": 150 * i,
+            "imagen": "https://img.example.com/p.png", "categoria_id": primera if i % 2 else segunda
+        })
+        assert respuesta.status_code == 201
+        ids.append(respuesta.get_json()["id"])
+    assert client.patch(f"/productos/{ids[0]}", json={"precio": 950, "categoria_id": primera}).status_code == 200
+    assert client.delete(f"/productos/{ids[1]}").status_code == 200
+    #precio >= 0 no filtra nada pero obliga al GROUP BY sobre producto
+    assert facetas(client) == facetas(client, "precio_min=0")
+
+
+def test_precio_invalido_no_llega_a_escribir(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    producto = {
+        "titulo": "Producto", "descripcion": "d", "precio": 100,
+        "imagen": "https://img.example.com/p.png", "categoria_id": categoria_id
+    }
+    respuesta = client.post("/productos", json=dict(producto, precio="abc"))
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"resultado": "El precio debe ser un numero entero"}
+    producto_id = client.post("/productos", json=producto).get_json()["id"]
+    antes = facetas(client)
+    respuesta = client.patch(f"/productos/{producto_id}", json={"precio": "abc"})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"resultado": "El precio debe ser un numero entero"}
+    respuesta = client.patch("/productos/bulk", json=[{"id": producto_id, "precio": 1.5}])
+    assert respuesta.status_code == 400
+    assert client.get(f"/productos/{producto_id}").get_json()["precio"] == 100
+    assert facetas(client) == antes
+
+
+@pytest.mark.parametrize("segunda", [
+    lambda client: client.patch("/productos/1", json={"precio": 250}),
+    lambda client: client.patch("/productos/bulk", json=[{"id": 1, "precio": 250}]),
+    lambda client: client.patch("/productos/bulk", json={"filtro": {"ids": [1]}, "ajuste": {"monto": 250}}),
+    lambda client: client.delete("/productos/1"),
+], ids=["patch", "bulk", "filtro", "delete"])
+def test_escrituras_intercaladas(client, base, segunda):
+    sembrar_productos(2)
+    reconstruir_resumen(base)
+    base.commit()
+    primera = threading.current_thread()
+    llego = threading.Event()
+    respuestas = []
+    hilo = threading.Thread(target=lambda: respuestas.append(segunda(client)))
+
+    def intercalar(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is not primera:
+            llego.set()
+        elif statement.startswith("UPDATE producto") and not hilo.is_alive() and not respuestas:
+            #la primera ya leyo los valores previos: la segunda empieza antes de su UPDATE
+            hilo.start()
+            assert llego.wait(5)
+            time.sleep(0.2)
+
+    event.listen(db.engine, "before_cursor_execute", intercalar)
+    try:
+        assert client.patch("/productos/1", json={"precio": 150}).status_code == 200
+        hilo.join(10)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", intercalar)
+    assert [respuesta.status_code for respuesta in respuestas] == [200]
+    #con rangos del ancho del resumen, la segunda escritura no descuenta el precio que ya cambio
+    assert facetas(client, f"bucket={RANGO_PRECIO}") == facetas(client, f"bucket={RANGO_PRECIO}&precio_min=0")
@@ -0,0 +1,33 @@
+"""
+Con orjson instalado jsonify usa FastJSONEncoder (app.json_encoder, Flask 1.x)
+y devuelve lo mismo que el codificador de Flask, fechas incluidas.
+"""
+import datetime
+import json
+import uuid
+import pytest
+from flask import jsonify
+from flask.json import JSONEncoder
+from fast_json import FastJSONEncoder, dumps
+
+pytest.importorskip("orjson")
+
+
+def test_jsonify_usa_orjson_con_la_salida_de_flask(app, monkeypatch):
+    assert app.json_encoder is FastJSONEncoder
+    datos = {
+        "titulo": "ñandú", "precio": 10, "fecha": datetime.datetime(2026, 10, 18, 12, 30),
+        "id": uuid.UUID(int=1), "lista": [1.5, None, True],
+    }
+    with app.test_request_context():
+        rapido = jsonify(datos).get_data()
+        monkeypatch.setattr(app, "json_encoder", JSONEncoder)
+        estandar = jsonify(datos).get_data()
+    assert json.loads(rapido) == json.loads(estandar)
+    assert json.loads(rapido)["fecha"] == "Sun, 18 Oct 2026 12:30:00 GMT"
+    #las llaves ordenadas como JSON_SORT_KEYS
+    assert list(json.loads(rapido)) == sorted(datos)
+
+
+def test_dumps_a_bytes():
+    assert json.loads(dumps({"a": [1, "ñ"]})) == {"a": [1, "ñ"]}
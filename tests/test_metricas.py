@@ -0,0 +1,105 @@
+"""
+Medicion de sentencias SQL (metrics.py): una sentencia que falla no deja su
+inicio en la conexion y el log de consultas lentas recorta la sentencia.
+El pool (pool.py) toma sus opciones de la configuracion segun el dialecto y
+/metrics expone la espera, los timeouts y la ocupacion de cada MeteredQueuePool.
+"""
+import logging
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, TimeoutError
+import pool
+from metrics import MAX_SENTENCIA_LOG
+from models import db
+
+
+def test_sentencia_que_falla_no_deja_inicio(app):
+    with db.engine.connect() as conexion:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conexion.execute("SELECT * FROM tabla_que_no_existe")
+        assert conexion.info.get("inicio_sentencia") == []
+        conexion.execute("SELECT 1")
+        assert conexion.info["inicio_sentencia"] == []
+
+
+def test_consulta_lenta_recorta_la_sentencia(app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, "SLOW_QUERY_MS", 0)
+    sentencia = "SELECT 1" + " + 1" * 500
+    with caplog.at_level(logging.WARNING, logger="shopfix.sql"):
+        db.session.execute(sentencia)
+    db.session.rollback()
+    registro = caplog.records[-1].getMessage()
+    assert registro.endswith(sentencia[:MAX_SENTENCIA_LOG])
+    assert len(registro) < MAX_SENTENCIA_LOG + 50
+
+
+@pytest.mark.parametrize("url, esperado", [
+    ("sqlite:///shopfix.db", {"pool_pre_ping": False}),
+    ("mysql+pymysql://localhost/shopfix", {
+        "pool_pre_ping": False, "poolclass": pool.MeteredQueuePool, "pool_size": 3,
+        "max_overflow": 7, "pool_timeout": 2, "pool_recycle": 60,
+    }),
+    ("postgresql://localhost/shopfix", {
+        "pool_pre_ping": False, "poolclass": pool.MeteredQueuePool, "pool_size": 3,
+        "max_overflow": 7, "pool_timeout": 2, "pool_recycle": 60,
+        "connect_args": {"options": "-c statement_timeout=1500"},
+    }),
+])
+def test_engine_options_segun_la_configuracion(url, esperado):
+    config = {
+        "DB_POOL_SIZE": 3, "DB_MAX_OVERFLOW": 7, "DB_POOL_TIMEOUT": 2, "DB_POOL_RECYCLE": 60,
+        "DB_POOL_PRE_PING": False, "DB_STATEMENT_TIMEOUT_MS": 1500,
+    }
+    assert pool.engine_options(make_url(url), config) == esperado
+
+
+def test_engine_options_por_defecto(app):
+    #los valores de create_app() sin variables de entorno
+    assert pool.engine_options(make_url("postgresql://localhost/shopfix"), app.config) == {
+        "pool_pre_ping": True, "poolclass": pool.MeteredQueuePool, "pool_size": 5,
+        "max_overflow": 10, "pool_timeout": 30, "pool_recycle": 1800,
+    }
+
+
+def lineas_del_pool(client, nombre):
+    """lineas de /metrics con la etiqueta pool=nombre"""
+    texto = client.get("/metrics").get_data(as_text=True)
+    return {
+        linea.rsplit(" ", 1)[0]: linea.rsplit(" ", 1)[1]
+        for linea in texto.splitlines() if f'pool="{nombre}"' in linea
+    }
+
+
+def test_metricas_del_pool(client, tmp_path):
+    opciones = {"poolclass": pool.MeteredQueuePool, "pool_size": 2, "max_overflow": 1, "pool_timeout": 0.05}
+    engine = pool.create_pooled_engine(make_url(f"sqlite:///{tmp_path / 'pool.db'}"), opciones, {}, "prueba")
+    conexiones = []
+    try:
+        conexiones = [engine.connect() for _ in range(2)]
+        lineas = lineas_del_pool(client, "prueba")
+        assert lineas['shopfix_db_pool_size{pool="prueba"}'] == "2"
+        assert lineas['shopfix_db_pool_checked_out{pool="prueba"}'] == "2"
+        assert lineas['shopfix_db_pool_overflow{pool="prueba"}'] == "0"
+        assert lineas['shopfix_db_pool_saturation{pool="prueba"}'] == "0.667"
+        assert lineas['shopfix_db_pool_timeouts_total{pool="prueba"}'] == "0"
+        assert lineas['shopfix_db_pool_checkout_wait_seconds_count{pool="prueba"}'] == "2"
+        #la tercera usa el overflow y la cuarta agota pool_timeout
+        conexiones.append(engine.connect())
+        with pytest.raises(TimeoutError):
+            engine.connect()
+        lineas = lineas_del_pool(client, "prueba")
+        assert lineas['shopfix_db_pool_overflow{pool="prueba"}'] == "1"
+        assert lineas['shopfix_db_pool_saturation{pool="prueba"}'] == "1.000"
+        assert lineas['shopfix_db_pool_timeouts_total{pool="prueba"}'] == "1"
+        assert lineas['shopfix_db_pool_checkout_wait_seconds_count{pool="prueba"}'] == "4"
+        assert float(lineas['shopfix_db_pool_checkout_wait_seconds_sum{pool="prueba"}']) >= 0.05
+    finally:
+        for conexion in conexiones:
+            conexion.close()
+        engine.dispose()
+        with pool._lock:
+            pool.ENGINES.pop("prueba", None)
+            pool.TIMEOUTS.pop("prueba", None)
+        with pool.ESPERA._lock:
+            pool.ESPERA._series.pop(("prueba",), None)
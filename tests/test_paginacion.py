@@ -0,0 +1,113 @@
+"""
+Paginacion por cursor de GET /productos (utils.paginate) sobre 100k productos:
+cada recorrido por cursor entrega todas las filas una sola vez, en orden,
+tambien con empates en el precio, y las paginas no se corren si se insertan
+filas antes del cursor. Un cursor alterado, tambien con valores de otro tipo
+que la llave, es un 400.
+"""
+import pytest
+from conftest import sembrar_productos
+from models import db, Producto
+from utils import encode_cursor
+
+PRODUCTOS = 100000
+#100 productos por precio, los empates se desempatan por id
+PRECIOS = 1000
+
+
+@pytest.fixture(scope="module")
+def catalogo(app):
+    sembrar_productos(PRODUCTOS, precio=lambda i: (i * 7) % PRECIOS)
+    filas = db.session.query(Producto.id, Producto.precio).all()
+    assert len(filas) == PRODUCTOS
+    yield [(fila.id, fila.precio) for fila in filas]
+    db.session.query(Producto).delete()
+    db.session.commit()
+
+
+def recorrer(client, consulta):
+    """(id, precio) de todas las paginas siguiendo next_cursor desde la primera"""
+    filas = []
+    url = f"/productos?{consulta}&limit=200&fields=id,precio"
+    cursor = None
+    while True:
+        respuesta = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert respuesta.status_code == 200
+        pagina = respuesta.get_json()
+        assert len(pagina["resultados"]) <= 200
+        filas.extend((producto["id"], producto["precio"]) for producto in pagina["resultados"])
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            return filas
+
+
+def test_cursor_por_id_entrega_todo_en_orden(client, catalogo):
+    filas = recorrer(client, "sort=id")
+    assert filas == sorted(catalogo)
+
+
+def test_cursor_por_precio_con_empates(client, catalogo):
+    filas = recorrer(client, "sort=precio")
+    assert len(set(filas)) == PRODUCTOS
+    assert filas == sorted(catalogo, key=lambda fila: (fila[1], fila[0]))
+
+
+def test_cursor_por_precio_descendente(client, catalogo):
+    filas = recorrer(client, "sort=-precio")
+    assert filas == sorted(catalogo, key=lambda fila: (fila[1], fila[0]), reverse=True)
+
+
+def test_cursor_estable_con_inserciones_anteriores(client, catalogo):
+    primera = client.get("/productos?sort=precio&limit=50&offset=0").get_json()
+    cursor = primera["next_cursor"]
+    segunda = client.get(f"/productos?sort=precio&limit=50&cursor={cursor}").get_json()
+    #un producto nuevo que queda antes del cursor corre las paginas por offset, no las del cursor
+    nuevo = Producto.registrar_producto("Nuevo", "antes del cursor", -1, "img", None)
+    db.session.add(nuevo)
+    db.session.commit()
+    try:
+        assert client.get(f"/productos?sort=precio&limit=50&cursor={cursor}").get_json() == segunda
+        por_offset = client.get("/productos?sort=precio&limit=50&offset=50").get_json()
+        assert por_offset["resultados"] != segunda["resultados"]
+    finally:
+        db.session.delete(nuevo)
+        db.session.commit()
+
+
+@pytest.mark.parametrize("cursor", ["basura", "e30", "W10"])
+def test_cursor_invalido(client, catalogo, cursor):
+    respuesta = client.get(f"/productos?sort=precio&cursor={cursor}")
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["message"] == "El parametro cursor no es valido"
+
+
+@pytest.mark.parametrize("sort, valor, ultimo_id", [
+    ("precio", 10, "x"),
+    ("precio", 10, 1.5),
+    ("precio", 10, True),
+    ("precio", "x", 1),
+    ("precio", [10], 1),
+    ("precio", {"a": 1}, 1),
+    ("precio", None, 1),
+    ("titulo", 10, 1),
+    ("id", "1", "1"),
+])
+def test_cursor_con_tipos_alterados(client, catalogo, sort, valor, ultimo_id):
+    #el cursor tiene la forma correcta pero sus valores no son del tipo de la llave
+    cursor = encode_cursor(sort, valor, ultimo_id)
+    respuesta = client.get(f"/productos?sort={sort}&cursor={cursor}")
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["message"] == "El parametro cursor no es valido"
+
+
+def test_cursor_armado_con_tipos_correctos(client, catalogo):
+    cursor = encode_cursor("titulo", "Producto 5", 6)
+    pagina = client.get(f"/productos?sort=titulo&limit=1&cursor={cursor}").get_json()
+    assert pagina["resultados"][0]["titulo"] > "Producto 5"
+
+
+def test_cursor_de_otro_orden(client, catalogo):
+    cursor = client.get("/productos?sort=id&limit=10").get_json()["next_cursor"]
+    respuesta = client.get(f"/productos?sort=precio&cursor={cursor}")
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["message"] == "El cursor no corresponde al orden solicitado"
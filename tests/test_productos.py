@@ -0,0 +1,357 @@
+"""
+Escrituras de productos en lote: POST /productos/bulk (arreglo JSON o NDJSON)
+valida cada fila y reporta las malas sin abortar los lotes que ya hicieron
+commit (imagen puede ser null, como en POST y PATCH de un producto), y
+PATCH /productos/bulk rechaza con 400 un cambio o filtro mal formado sin
+escribir nada. Los errores de escritura van al log con su traceback.
+PATCH y DELETE de un producto comparan If-Match con su version (412 si cambio);
+el PATCH es un UPDATE condicional que devuelve los valores previos sin leerlos
+antes, salvo los que cambian en un dialecto sin RETURNING.
+GET /productos?ids= y POST /productos/batch-get devuelven los productos en el
+orden pedido, sin repetir, con los ids que no existen en no_encontrados.
+Con fields= los GET leen y devuelven solo las columnas pedidas (400 si alguna
+no existe).
+"""
+import json
+import pytest
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from conftest import (
+    antes_de_confirmar, columnas_leidas, sembrar_categorias, sembrar_productos, sentencias_ejecutadas
+)
+from main import update_devolviendo_anteriores
+from models import db, Producto
+
+
+def producto(categoria_id, **campos):
+    return dict({
+        "titulo": "producto", "descripcion": "d", "precio": 100,
+        "imagen": "https://img.example.com/p.png", "categoria_id": categoria_id
+    }, **campos)
+
+
+def test_bulk_reporta_las_filas_malas(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    filas = [
+        producto(categoria_id, titulo="bueno 1"),
+        producto(categoria_id, titulo=5),
+        producto(categoria_id, descripcion=["d"]),
+        producto(categoria_id, imagen=5),
+        producto(True, titulo="booleano"),
+        producto("1", titulo="texto"),
+        producto(categoria_id, precio="abc"),
+        producto(categoria_id + 100, titulo="sin categoria"),
+        "no es un objeto",
+        producto(categoria_id, titulo="bueno 2"),
+    ]
+    #lotes de 2 filas: las malas caen en lotes distintos, antes y despues de commits
+    respuesta = client.post("/productos/bulk?batch_size=2", json=filas)
+    assert respuesta.status_code == 207
+    cuerpo = respuesta.get_json()
+    assert cuerpo["creados"] == 2
+    assert [error["fila"] for error in cuerpo["errores"]] == [2, 3, 4, 5, 6, 7, 8, 9]
+    assert cuerpo["errores"][0]["resultado"] == "El titulo, la descripcion y la imagen deben ser texto"
+    assert cuerpo["errores"][3]["resultado"] == "categoria_id debe ser un numero entero"
+    assert cuerpo["errores"][6]["resultado"] == "La categoria no existe"
+    assert sorted(titulo for (titulo,) in base.query(Producto.titulo)) == ["Bueno 1", "Bueno 2"]
+
+
+def test_bulk_ndjson(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    lineas = [
+        json.dumps(producto(categoria_id, titulo="bueno 1")),
+        "",
+        "{no es json",
+        json.dumps(producto(categoria_id, titulo=5)),
+        json.dumps(producto(categoria_id, titulo="bueno 2", imagen=None)),
+    ]
+    respuesta = client.post(
+        "/productos/bulk?batch_size=1", data="\n".join(lineas) + "\n", content_type="application/x-ndjson"
+    )
+    assert respuesta.status_code == 207
+    cuerpo = respuesta.get_json()
+    assert cuerpo["creados"] == 2
+    #las filas son las lineas del stream, las vacias se saltan pero cuentan
+    assert [error["fila"] for error in cuerpo["errores"]] == [3, 4]
+    assert cuerpo["errores"][0]["resultado"] == "La fila debe ser un objeto JSON"
+    assert sorted(base.query(Producto.titulo, Producto.imagen)) == [
+        ("Bueno 1", "https://img.example.com/p.png"), ("Bueno 2", None)
+    ]
+
+
+def test_imagen_null(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    respuesta = client.post("/productos", json=producto(categoria_id, imagen=None))
+    assert respuesta.status_code == 201
+    producto_id = respuesta.get_json()["id"]
+    assert client.get(f"/productos/{producto_id}").get_json()["imagen"] is None
+    assert client.patch(f"/productos/{producto_id}", json={"imagen": "https://img.example.com/q.png"}).status_code == 200
+    respuesta = client.patch(f"/productos/{producto_id}", json={"imagen": None})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()["imagen"] is None
+    assert base.query(Producto.imagen).filter_by(id=producto_id).scalar() is None
+    #otro tipo sigue siendo un error
+    assert client.patch(f"/productos/{producto_id}", json={"imagen": 5}).status_code == 400
+
+
+def test_bulk_todas_malas_es_400(client, base):
+    (categoria_id,) = sembrar_categorias(1)
+    respuesta = client.post("/productos/bulk", json=[producto(categoria_id, titulo=1)])
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["creados"] == 0
+    assert base.query(Producto).count() == 0
+
+
+@pytest.mark.parametrize("cambio, mensaje", [
+    ({"id": "1", "precio": 5}, "El id de cada cambio debe ser un numero entero"),
+    ({"id": 1, "categoria_id": "abc"}, "Producto 1: categoria_id debe ser un numero entero"),
+    ({"id": 1, "categoria_id": 999}, "Producto 1: la categoria 999 no existe"),
+    ({"id": 1, "titulo": None}, "Producto 1: El titulo, la descripcion y la imagen deben ser texto"),
+    ({"id": 1, "imagen": ""}, "Producto 1: El titulo, la descripcion y la imagen no pueden estar vacios"),
+    ({"id": 1, "precio": True}, "Producto 1: El precio debe ser un numero entero"),
+])
+def test_bulk_patch_rechaza_el_cambio_malo(client, base, cambio, mensaje):
+    sembrar_productos(2)
+    respuesta = client.patch("/productos/bulk", json=[{"id": 2, "precio": 7}, cambio])
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"message": mensaje}
+    #nada se escribe, tampoco el cambio bueno
+    assert dict(base.query(Producto.id, Producto.precio)) == {1: 0, 2: 1}
+
+
+@pytest.mark.parametrize("insumo, mensaje", [
+    ({"filtro": {"precio_min": "10"}, "ajuste": {"monto": 1}}, "El criterio precio_min debe ser un numero entero"),
+    ({"filtro": {"precio_max": None}, "ajuste": {"monto": 1}}, "El criterio precio_max debe ser un numero entero"),
+    ({"filtro": {"categoria_id": 1.5}, "ajuste": {"monto": 1}}, "El criterio categoria_id debe ser un numero entero"),
+    ({"filtro": {"ids": [1, "2"]}, "ajuste": {"monto": 1}}, "El criterio ids debe ser una lista de numeros enteros"),
+    ({"filtro": {"ids": [1]}, "ajuste": {"porcentaje": True}},
+     "Debe indicar un ajuste con porcentaje (numero) o monto (entero)"),
+])
+def test_bulk_patch_rechaza_el_filtro_malo(client, base, insumo, mensaje):
+    sembrar_productos(2)
+    respuesta = client.patch("/productos/bulk", json=insumo)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"message": mensaje}
+    assert dict(base.query(Producto.id, Producto.precio)) == {1: 0, 2: 1}
+
+
+def test_error_al_borrar_va_al_log(client, base, monkeypatch, capsys, caplog):
+    sembrar_productos(1)
+
+    def fallar():
+        raise RuntimeError("sin conexion")
+
+    monkeypatch.setattr(db.session, "commit", fallar)
+    respuesta = client.delete("/productos/1")
+    assert respuesta.status_code == 500
+    (registro,) = [registro for registro in caplog.records if registro.name == "shopfix.api"]
+    assert registro.getMessage() == "No se pudo borrar el producto 1"
+    assert registro.exc_info[0] is RuntimeError
+    #nada de depuracion por stdout
+    assert capsys.readouterr().out == ""
+
+
+def test_patch_y_delete_de_un_producto_que_no_existe(client, base):
+    sembrar_productos(1)
+    assert client.patch("/productos/99", json={"precio": 5}).status_code == 404
+    assert client.delete("/productos/99").status_code == 404
+    respuesta = client.patch("/productos/1", json={"precio": 5, "titulo": "nuevo"})
+    assert respuesta.status_code == 200
+    assert (respuesta.get_json()["precio"], respuesta.get_json()["titulo"]) == (5, "nuevo")
+    assert client.delete("/productos/1").status_code == 200
+    assert client.delete("/productos/1").status_code == 404
+    assert base.query(Producto).count() == 0
+
+
+def test_bulk_patch_un_update_con_case(client, base):
+    sembrar_productos(4)
+    sentencias = []
+
+    def contar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", contar)
+    try:
+        respuesta = client.patch("/productos/bulk", json=[
+            {"id": 1, "precio": 10}, {"id": 2, "precio": 20, "titulo": "dos"},
+            {"id": 3, "titulo": "tres"}, {"id": 1, "titulo": "uno"}, {"id": 99, "precio": 1}
+        ])
+    finally:
+        event.remove(db.engine, "before_cursor_execute", contar)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {"actualizados": 3, "no_encontrados": [99]}
+    #un solo UPDATE ... CASE id para todos los productos del bloque (el otro numera el cambio al confirmar)
+    assert len([
+        sentencia for sentencia in sentencias
+        if sentencia.startswith("UPDATE producto") and "WHERE producto.cambio" not in sentencia
+    ]) == 1
+    filas = base.query(Producto.id, Producto.titulo, Producto.precio, Producto.version).order_by(Producto.id)
+    assert [tuple(fila) for fila in filas] == [
+        (1, "uno", 10, 2), (2, "dos", 20, 2), (3, "tres", 2, 2), (4, "Producto 3", 3, 1)
+    ]
+
+
+def test_bulk_patch_cambia_la_version_de_cada_producto(client, base):
+    sembrar_productos(2)
+    etags = [client.get(f"/productos/{producto_id}").headers["ETag"] for producto_id in (1, 2)]
+    assert client.patch("/productos/bulk", json=[{"id": 1, "precio": 10}]).status_code == 200
+    #el If-Match de antes del lote ya no coincide para el producto modificado, si para el otro
+    respuesta = client.patch("/productos/1", json={"precio": 11}, headers={"If-Match": etags[0]})
+    assert respuesta.status_code == 412
+    assert respuesta.headers["ETag"] == '"v2"'
+    assert client.patch("/productos/2", json={"precio": 12}, headers={"If-Match": etags[1]}).status_code == 200
+    assert dict(base.query(Producto.id, Producto.precio)) == {1: 10, 2: 12}
+
+
+def test_patch_y_delete_con_if_match(client, base):
+    sembrar_productos(1)
+    assert client.get("/productos/1").headers["ETag"].startswith('"v1-')
+    #sin If-Match o con * se escribe sin comparar la version
+    assert client.patch("/productos/1", json={"precio": 5}).headers["ETag"].startswith('"v2-')
+    respuesta = client.patch("/productos/1", json={"precio": 6}, headers={"If-Match": "*"})
+    assert respuesta.headers["ETag"].startswith('"v3-')
+    #el hash del cuerpo y la codificacion que el cache agrega al ETag se ignoran
+    etag = respuesta.headers["ETag"].strip('"')
+    respuesta = client.patch("/productos/1", json={"precio": 7}, headers={"If-Match": f'"{etag}-gzip"'})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["ETag"].startswith('"v4-')
+    respuesta = client.patch("/productos/1", json={"precio": 8}, headers={"If-Match": '"v3", "otro"'})
+    assert respuesta.status_code == 412
+    assert respuesta.headers["ETag"] == '"v4"'
+    assert client.delete("/productos/1", headers={"If-Match": '"v3"'}).status_code == 412
+    assert base.query(Producto.precio).filter_by(id=1).scalar() == 7
+    assert client.delete("/productos/1", headers={"If-Match": '"v4"'}).status_code == 200
+    assert client.delete("/productos/1", headers={"If-Match": '"v4"'}).status_code == 404
+
+
+def test_patch_con_if_match_no_lee_antes(client, base):
+    sembrar_productos(1)
+    etag = client.get("/productos/1").headers["ETag"]
+    respuesta, sentencias = sentencias_ejecutadas(
+        lambda: client.patch("/productos/1", json={"titulo": "otro"}, headers={"If-Match": etag})
+    )
+    assert respuesta.status_code == 200
+    escritura = antes_de_confirmar(sentencias)
+    #el UPDATE condicional va primero; sin RETURNING (SQLite) la fila se lee despues
+    assert len(escritura) == 2
+    assert escritura[0].startswith("UPDATE producto") and "producto.version IN (?)" in escritura[0]
+    assert escritura[1].startswith("SELECT producto.id")
+    #al confirmar: tomar el numero de cambio (UPDATE y SELECT sin RETURNING) y numerar el producto
+    assert len(sentencias) == 5
+    assert respuesta.headers["ETag"] != etag
+
+
+def test_delete_sentencias(client, base):
+    sembrar_productos(1)
+    respuesta, sentencias = sentencias_ejecutadas(lambda: client.delete("/productos/1"))
+    assert respuesta.status_code == 200
+    escritura = antes_de_confirmar(sentencias)
+    #sin RETURNING la categoria y el precio para las facetas se leen con el lock de escritura
+    assert escritura[0] == "BEGIN IMMEDIATE"
+    assert escritura[1].startswith("SELECT producto.categoria_id, producto.precio")
+    assert escritura[2].startswith("DELETE FROM producto")
+    assert escritura[3].startswith("INSERT INTO eliminacion")
+    assert escritura[4].startswith("INSERT INTO resumen_faceta")
+    assert len(escritura) == 5
+    #el producto borrado no se numera, solo su eliminacion
+    assert len(sentencias) == 8
+
+
+def test_patch_sin_returning_lee_antes_solo_lo_que_cambia(client, base):
+    sembrar_productos(1)
+    respuesta, sentencias = sentencias_ejecutadas(lambda: client.patch("/productos/1", json={"precio": 5}))
+    assert respuesta.status_code == 200
+    escritura = antes_de_confirmar(sentencias)
+    #el precio anterior hace falta para las facetas: se lee con el lock de escritura de SQLite
+    assert escritura[0] == "BEGIN IMMEDIATE"
+    assert escritura[1].startswith("SELECT producto.precio \nFROM producto")
+    assert escritura[2].startswith("UPDATE producto")
+    assert escritura[3].startswith("SELECT producto.id")
+    assert len(escritura) == 4
+
+
+def test_update_devuelve_los_anteriores_en_la_misma_sentencia():
+    tabla = Producto.__table__
+    sentencia = update_devolviendo_anteriores(
+        tabla, {"precio": 5}, [tabla.c.id == 1, tabla.c.version.in_([1])], [tabla.c.id], ["precio"]
+    )
+    sql = str(sentencia.compile(dialect=postgresql.dialect()))
+    assert "FROM (SELECT producto.id AS id, producto.precio AS precio" in sql
+    assert "FOR UPDATE) AS anterior WHERE producto.id = anterior.id" in sql
+    assert sql.endswith("RETURNING producto.id, anterior.precio AS anterior_precio")
+
+
+def pedir_por_ids(client, forma, ids):
+    if forma == "get":
+        return client.get("/productos?ids=" + ",".join(str(producto_id) for producto_id in ids))
+    return client.post("/productos/batch-get", json={"ids": ids})
+
+
+@pytest.mark.parametrize("forma", ["get", "post"])
+def test_varios_por_id(client, base, forma):
+    sembrar_productos(5)
+    #en el orden pedido, sin repetir, y los que no existen aparte
+    respuesta = pedir_por_ids(client, forma, [4, 2, 99, 4, 1, 98])
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.get_json()
+    assert [producto["id"] for producto in cuerpo["resultados"]] == [4, 2, 1]
+    assert cuerpo["no_encontrados"] == [99, 98]
+    #la misma serializacion que GET /productos/<id>
+    assert cuerpo["resultados"][0] == client.get("/productos/4").get_json()
+
+
+@pytest.mark.parametrize("forma", ["get", "post"])
+def test_varios_por_id_limite_y_errores(client, base, app, monkeypatch, forma):
+    sembrar_productos(5)
+    monkeypatch.setitem(app.config, "MULTI_GET_MAX_IDS", 3)
+    #los repetidos no cuentan para el maximo
+    assert pedir_por_ids(client, forma, [1, 2, 3, 3, 1]).status_code == 200
+    respuesta = pedir_por_ids(client, forma, [1, 2, 3, 4])
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"message": "Puede pedir hasta 3 ids"}
+    assert pedir_por_ids(client, forma, []).get_json() == {"message": "Debe indicar al menos un id"}
+
+
+@pytest.mark.parametrize("forma, ids, mensaje", [
+    ("get", "1,dos", "El parametro ids debe ser una lista de numeros enteros separados por coma"),
+    ("post", [1, "2"], "ids debe ser una lista de numeros enteros"),
+    ("post", [True], "ids debe ser una lista de numeros enteros"),
+    ("post", None, "ids debe ser una lista de numeros enteros"),
+])
+def test_varios_por_id_ids_malos(client, base, forma, ids, mensaje):
+    if forma == "get":
+        respuesta = client.get(f"/productos?ids={ids}")
+    else:
+        respuesta = client.post("/productos/batch-get", json={"ids": ids})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"message": mensaje}
+
+
+@pytest.mark.parametrize("url, leidas", [
+    #el listado lee ademas el id y la columna de orden para el cursor
+    ("/productos?fields=titulo", {"id", "titulo"}),
+    ("/productos?fields=titulo,precio&sort=-precio", {"id", "titulo", "precio"}),
+    ("/productos/{id}?fields=titulo", {"id", "titulo", "version"}),
+])
+def test_fields_lee_y_devuelve_solo_lo_pedido(client, base, url, leidas):
+    (categoria_id,) = sembrar_categorias(1)
+    sembrar_productos(3, categoria=lambda i: categoria_id)
+    (producto_id,) = base.query(Producto.id).filter(Producto.titulo == "Producto 0").one()
+    respuesta, columnas = columnas_leidas(client, url.format(id=producto_id), "producto")
+    assert respuesta.status_code == 200
+    assert columnas == leidas
+    cuerpo = respuesta.get_json()
+    for serializado in cuerpo.get("resultados", [cuerpo]):
+        assert set(serializado) == {campo for campo in ("titulo", "precio") if campo in url}
+
+
+@pytest.mark.parametrize("url", [
+    "/productos?fields=titulo,clave", "/productos/1?fields=version", "/productos?ids=1&fields=categoria",
+])
+def test_fields_desconocido_es_400(client, base, url):
+    sembrar_productos(1)
+    respuesta = client.get(url)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["message"] == (
+        "El parametro fields debe contener solo: " + ", ".join(Producto.CAMPOS_SERIALIZADOS)
+    )
@@ -0,0 +1,85 @@
+"""
+ReadReplicas con dos bases SQLite reales como replicas: los GET se reparten
+por round robin, las escrituras y los GET de quien acaba de escribir van al
+primario, y una replica que falla el chequeo de salud queda fuera hasta que
+vuelve a responder.
+"""
+import shutil
+import sqlite3
+import pytest
+from flask import Flask, g, jsonify
+from sqlalchemy import text
+from replicas import COOKIE_PRIMARIO, ReadReplicas
+
+
+def crear_replica(carpeta, nombre):
+    carpeta.mkdir()
+    archivo = carpeta / "replica.db"
+    with sqlite3.connect(archivo) as conexion:
+        conexion.execute("CREATE TABLE origen (nombre TEXT)")
+        conexion.execute("INSERT INTO origen VALUES (?)", (nombre,))
+    return f"sqlite:///{archivo}"
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        DB_REPLICA_CONNECTION_STRINGS=[
+            crear_replica(tmp_path / "r0", "r0"), crear_replica(tmp_path / "r1", "r1")
+        ],
+        #cada eleccion vuelve a revisar la salud de la replica
+        DB_REPLICA_HEALTH_INTERVAL=0,
+    )
+    replicas = ReadReplicas(app)
+
+    @app.route('/origen', methods=['GET', 'POST'])
+    def origen():
+        if g.replica is None:
+            return jsonify(nombre="primario")
+        with g.replica.engine.connect() as conexion:
+            return jsonify(nombre=conexion.execute(text("SELECT nombre FROM origen")).scalar())
+
+    yield app.test_client(), replicas, tmp_path
+    for replica in replicas.replicas:
+        replica.engine.dispose()
+
+
+def origenes(client, veces):
+    return [client.get("/origen").get_json()["nombre"] for _ in range(veces)]
+
+
+def test_round_robin_y_leer_lo_propio(replicas):
+    client, replicas, _ = replicas
+    assert origenes(client, 4) == ["r0", "r1", "r0", "r1"]
+    respuesta = client.post("/origen")
+    assert respuesta.get_json()["nombre"] == "primario"
+    assert COOKIE_PRIMARIO in respuesta.headers["Set-Cookie"]
+    #con la cookie el cliente lee del primario
+    assert origenes(client, 2) == ["primario", "primario"]
+    client.delete_cookie("localhost", COOKIE_PRIMARIO)
+    assert origenes(client, 2) == ["r0", "r1"]
+    assert replicas.destinos == {"replica": 6, "primario": 3}
+
+
+def test_replica_caida_queda_fuera(replicas):
+    client, replicas, carpeta = replicas
+    assert origenes(client, 2) == ["r0", "r1"]
+    #la replica 1 deja de responder: su archivo ya no se puede abrir
+    shutil.rmtree(carpeta / "r1")
+    replicas.replicas[1].engine.dispose()
+    assert origenes(client, 4) == ["r0", "r0", "r0", "r0"]
+    assert not replicas.replicas[1].sana
+    assert 'shopfix_db_replica_up{replica="1"} 0' in replicas.prometheus()
+    #vuelve al round robin cuando pasa el chequeo
+    crear_replica(carpeta / "r1", "r1")
+    assert sorted(origenes(client, 2)) == ["r0", "r1"]
+    assert 'shopfix_db_replica_up{replica="1"} 1' in replicas.prometheus()
+
+
+def test_sin_replicas_sanas_usa_el_primario(replicas):
+    client, replicas, carpeta = replicas
+    for numero, replica in enumerate(replicas.replicas):
+        shutil.rmtree(carpeta / f"r{numero}")
+        replica.engine.dispose()
+    assert origenes(client, 2) == ["primario", "primario"]